@@ -1,11 +1,5 @@
-import sqlite3
-import os
-
-def add_interaction_tables(db_path='data.db'):
-    """Add tables for likes, comments, and messages"""
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    
+def create_interaction_tables(c):
+    """Create the likes, comments, and messages tables on an open cursor"""
     # Likes table
     c.execute('''CREATE TABLE IF NOT EXISTS likes (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -40,13 +34,3 @@ def add_interaction_tables(db_path='data.db'):
         FOREIGN KEY(sender_id) REFERENCES users(id) ON DELETE CASCADE,
         FOREIGN KEY(receiver_id) REFERENCES users(id) ON DELETE CASCADE
     )''')
-    
-    conn.commit()
-    conn.close()
-    print('Interaction tables created successfully!')
-    print('   - likes')
-    print('   - comments')
-    print('   - messages')
-
-if __name__ == '__main__':
-    add_interaction_tables()
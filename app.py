@@ -1,16 +1,38 @@
-from flask import Flask, render_template, request, redirect, url_for, session, g, flash
-import sqlite3
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, render_template, request, redirect, url_for, session, g, flash, has_app_context, has_request_context, make_response, abort, send_file
+from werkzeug.middleware.proxy_fix import ProxyFix
 from werkzeug.utils import secure_filename
+from markupsafe import Markup, escape
 from functools import wraps
+import atexit
+import base64
+import csv
+import hashlib
+import io
+import json
 import os
-from datetime import datetime
+import re
+from datetime import datetime, timedelta, timezone
 import requests
 import threading
 import time
+from cache import Snapshot, make_cache
+from db import ConnectionPool, GroupCommitter
+from metrics import Metrics, SamplingProfiler, normalize_sql
+from passwords import AttemptLimiter, HasherBusy, PasswordHasher
+from events import EventBroker, format_sse
+from assets import Assets
+import facets
+import images
+import uploads
+from notification_queue import NotificationQueue
+from purge import Purger, delete_pitch
+from trending import TrendingScheduler, parse_weights
+from view_counter import ViewCounter
+from init_db import init_db
+from migrations import migrate
 
 BASE_DIR = os.path.dirname(__file__)
-DB_PATH = os.path.join(BASE_DIR, 'data.db')
+DB_PATH = os.environ.get('DB_PATH', os.path.join(BASE_DIR, 'data.db'))
 UPLOAD_FOLDER = os.path.join(BASE_DIR, 'static', 'uploads')
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp'}
 
@@ -21,6 +43,83 @@ app = Flask(__name__)
 app.secret_key = 'change_this_secret_in_production'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 5 * 1024 * 1024  # 5MB max file size
+# Send an X-Query-Count header with the number of SQL statements each request ran
+app.config['QUERY_COUNT_HEADER'] = os.environ.get('QUERY_COUNT_HEADER') == '1'
+
+# Number of reverse proxies (e.g. 1 on Render) whose X-Forwarded-For is trusted
+# for the client address the login limiter keys on
+PROXY_HOPS = int(os.environ.get('PROXY_HOPS', 0))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS, x_proto=PROXY_HOPS)
+
+# Password hashing on a bounded thread pool, and failed-login limits (see passwords.py)
+hasher = PasswordHasher(method=os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000'),
+                        workers=int(os.environ.get('PASSWORD_HASH_WORKERS', 2)),
+                        max_pending=int(os.environ.get('PASSWORD_HASH_QUEUE', 32)))
+LOGIN_WINDOW_SECONDS = float(os.environ.get('LOGIN_WINDOW_SECONDS', 300))
+ip_attempts = AttemptLimiter(int(os.environ.get('LOGIN_LIMIT_PER_IP', 20)), LOGIN_WINDOW_SECONDS)
+user_attempts = AttemptLimiter(int(os.environ.get('LOGIN_LIMIT_PER_USER', 5)), LOGIN_WINDOW_SECONDS)
+
+# Create the database, or apply pending schema migrations (one indexed read
+# when there are none); see migrations.py
+if os.path.exists(DB_PATH):
+    migrate(DB_PATH)
+else:
+    init_db(DB_PATH)
+
+# Pooled SQLite connections (WAL, tuned PRAGMAs); see db.py
+db_pool = ConnectionPool(DB_PATH,
+                         max_idle=int(os.environ.get('DB_POOL_SIZE', 8)),
+                         cache_kib=int(os.environ.get('DB_CACHE_KIB', 16384)),
+                         mmap_bytes=int(os.environ.get('DB_MMAP_BYTES', 128 * 1024 * 1024)),
+                         synchronous=os.environ.get('DB_SYNCHRONOUS', 'NORMAL'))
+
+# execute_db() writes from concurrent requests share transactions (see db.py)
+group_commit = GroupCommitter(db_pool, max_batch=int(os.environ.get('WRITE_BATCH_SIZE', 256)))
+atexit.register(group_commit.stop)
+
+# Background notification writer; pending notifications are flushed at exit
+notification_queue = NotificationQueue(db_pool,
+                                       flush_interval=float(os.environ.get('NOTIFICATION_FLUSH_SECONDS', 0.5)),
+                                       collapse=os.environ.get('NOTIFICATION_COLLAPSE', '1') == '1')
+atexit.register(notification_queue.stop)
+
+# Live notification/message pushes over Server-Sent Events (see events.py)
+event_broker = EventBroker()
+STREAM_HEARTBEAT_SECONDS = float(os.environ.get('STREAM_HEARTBEAT_SECONDS', 15))
+
+# Anonymous page and pitch card cache (see cache.py); CACHE_TTL=0 turns it off
+CACHE_TTL = float(os.environ.get('CACHE_TTL', 60))
+page_cache = make_cache(os.environ.get('CACHE_URL'),
+                        max_entries=int(os.environ.get('CACHE_MAX_ENTRIES', 2048)),
+                        ttl=CACHE_TTL)
+
+# Background deletion of users and everything they own (see purge.py)
+purger = Purger(db_pool, UPLOAD_FOLDER, batch_size=int(os.environ.get('PURGE_BATCH_SIZE', 500)))
+atexit.register(purger.stop)
+
+def purged(kind, target_id):
+    if kind == 'pitch':
+        page_cache.bump('feed', f'pitch:{target_id}')
+    else:
+        # Their likes and comments were spread over many pages
+        page_cache.clear()
+purger.on_deleted = purged
+
+# Time-decayed scores behind the "hot" feed, refreshed in the background (see trending.py)
+trending = TrendingScheduler(db_pool, weights=parse_weights(os.environ.get('TRENDING_WEIGHTS')),
+                             half_life_hours=float(os.environ.get('TRENDING_HALF_LIFE_HOURS', 24)),
+                             interval=float(os.environ.get('TRENDING_INTERVAL', 60)),
+                             rebuild_hours=float(os.environ.get('TRENDING_REBUILD_HOURS', 24)))
+trending.on_refresh = lambda changed: page_cache.bump('trending')
+atexit.register(trending.stop)
+
+# Pitch views, buffered per worker and written in batches (see view_counter.py);
+# VIEW_DEDUP_SECONDS=0 counts every request
+view_counter = ViewCounter(db_pool, interval=float(os.environ.get('VIEW_FLUSH_SECONDS', 5)),
+                           dedup_seconds=float(os.environ.get('VIEW_DEDUP_SECONDS', 1800)),
+                           dedup_max_keys=int(os.environ.get('VIEW_DEDUP_MAX_KEYS', 100000)))
+atexit.register(view_counter.stop)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
@@ -28,15 +127,14 @@ def allowed_file(filename):
 def get_db():
     db = getattr(g, '_database', None)
     if db is None:
-        db = g._database = sqlite3.connect(DB_PATH)
-        db.row_factory = sqlite3.Row
+        db = g._database = db_pool.acquire()
     return db
 
 @app.teardown_appcontext
 def close_connection(exception):
-    db = getattr(g, '_database', None)
+    db = g.pop('_database', None)
     if db is not None:
-        db.close()
+        db_pool.release(db)
 
 def query_db(query, args=(), one=False):
     cur = get_db().execute(query, args)
@@ -45,62 +143,304 @@ def query_db(query, args=(), one=False):
     return (rv[0] if rv else None) if one else rv
 
 def execute_db(query, args=()):
-    conn = get_db()
-    cur = conn.execute(query, args)
-    conn.commit()
-    cur.close()
-    return cur.lastrowid
+    """Run one write statement and wait until it is committed; returns its lastrowid"""
+    return group_commit.execute(query, args).lastrowid
+
+def transaction():
+    """Group several writes into one transaction: `with transaction() as conn:`"""
+    return db_pool.writer()
 
 # Notification functions
-def create_notification(user_id, notification_type, title, message, related_id=None, related_type=None):
-    """Create a new notification for a user"""
-    execute_db('''INSERT INTO notifications
-                  (user_id, type, title, message, related_id, related_type, created_at)
-                  VALUES (?, ?, ?, ?, ?, ?, ?)''',
-               [user_id, notification_type, title, message, related_id, related_type,
-                datetime.utcnow().isoformat()])
-
-def get_user_notifications(user_id, limit=50):
-    """Get notifications for a user, ordered by creation date (newest first)"""
-    return query_db('''SELECT n.*, u.username as related_username
-                      FROM notifications n
-                      LEFT JOIN users u ON n.related_id = u.id AND n.related_type = 'user'
-                      WHERE n.user_id = ?
-                      ORDER BY n.created_at DESC
-                      LIMIT ?''', [user_id, limit])
+def create_notification(user_id, notification_type, title, message, related_id=None, related_type=None,
+                        actor=None):
+    """Queue a notification for a user; it is written in the background (see notification_queue.py).
+
+    `{actor}` in the message is replaced by the actor's name, or by "alice and 4 others"
+    when several likes or comments on the same pitch arrive together.
+    """
+    notification_queue.put(user_id, notification_type, title, message, related_id, related_type, actor)
+
+NOTIFICATION_PAGE_SIZE = 30
+
+def get_user_notifications(user_id, cursor=None, limit=NOTIFICATION_PAGE_SIZE):
+    """One page of a user's notifications, newest first, keyset-paginated on (created_at, id)"""
+    sql = '''SELECT n.*, u.username as related_username
+             FROM notifications n
+             LEFT JOIN users u ON n.related_id = u.id AND n.related_type = 'user'
+             WHERE n.user_id = ?'''
+    args = [user_id]
+    position = decode_cursor(cursor)
+    if position:
+        sql += ' AND (n.created_at, n.id) < (?, ?)'
+        args.extend(position)
+    rows = query_db(sql + ' ORDER BY n.created_at DESC, n.id DESC LIMIT ?', args + [limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+    return rows, next_cursor
 
 def get_unread_count(user_id):
     """Get count of unread notifications for a user"""
-    result = query_db('SELECT COUNT(*) as count FROM notifications WHERE user_id = ? AND is_read = 0',
-                      [user_id], one=True)
-    return result['count'] if result else 0
+    result = query_db('SELECT unread_notifications FROM users WHERE id = ?', [user_id], one=True)
+    return result['unread_notifications'] if result else 0
+
+def notification_filter(user_id, ids=None, notification_type=None, older_than_days=None):
+    """WHERE clause and args selecting a user's notifications by id list, type and/or age"""
+    where, args = ['user_id = ?'], [user_id]
+    if ids is not None:
+        # The whole list is bound as one JSON array, however many ids there are
+        where.append('id IN (SELECT value FROM json_each(?))')
+        args.append(json.dumps([int(i) for i in ids]))
+    if notification_type:
+        where.append('type = ?')
+        args.append(notification_type)
+    if older_than_days is not None:
+        where.append('created_at < ?')
+        args.append((datetime.utcnow() - timedelta(days=older_than_days)).isoformat())
+    return ' AND '.join(where), args
+
+def mark_notifications_read(user_id, **criteria):
+    """Mark a user's matching notifications read in one statement; returns how many changed"""
+    where, args = notification_filter(user_id, **criteria)
+    with db_pool.writer() as conn:
+        return conn.execute(f'UPDATE notifications SET is_read = 1 WHERE {where} AND is_read = 0', args).rowcount
+
+def delete_notifications(user_id, **criteria):
+    """Delete a user's matching notifications in one statement; returns how many went"""
+    where, args = notification_filter(user_id, **criteria)
+    with db_pool.writer() as conn:
+        return conn.execute(f'DELETE FROM notifications WHERE {where}', args).rowcount
 
 def mark_notification_read(notification_id, user_id):
     """Mark a specific notification as read"""
-    execute_db('UPDATE notifications SET is_read = 1 WHERE id = ? AND user_id = ?',
-               [notification_id, user_id])
+    mark_notifications_read(user_id, ids=[notification_id])
 
 def mark_all_notifications_read(user_id):
     """Mark all notifications as read for a user"""
-    execute_db('UPDATE notifications SET is_read = 1 WHERE user_id = ? AND is_read = 0', [user_id])
+    mark_notifications_read(user_id)
 
 def delete_notification(notification_id, user_id):
     """Delete a specific notification"""
-    execute_db('DELETE FROM notifications WHERE id = ? AND user_id = ?', [notification_id, user_id])
+    delete_notifications(user_id, ids=[notification_id])
+
+# Live updates
+def read_counts(user_ids):
+    """Unread notification and message counts per user, readable outside a request"""
+    user_ids = list(user_ids)
+    conn = db_pool.acquire()
+    try:
+        rows = conn.execute(f"""SELECT id, unread_notifications, unread_messages FROM users
+                                WHERE id IN ({','.join('?' * len(user_ids))})""", user_ids).fetchall()
+    finally:
+        db_pool.release(conn)
+    return {row['id']: {'notifications': row['unread_notifications'], 'messages': row['unread_messages']}
+            for row in rows}
+
+def push_counts(user_id):
+    """Send a user's current unread counts to their open streams"""
+    if event_broker.has_subscribers(user_id):
+        counts = read_counts([user_id]).get(user_id)
+        if counts is not None:
+            event_broker.publish(user_id, 'counts', counts)
+
+def push_notifications(rows):
+    """Notification queue hook: push each written notification, then the new counts"""
+    live = {row[0] for row in rows if event_broker.has_subscribers(row[0])}
+    if not live:
+        return
+    for user_id, notification_type, title, message, related_id, related_type, created_at in rows:
+        if user_id in live:
+            event_broker.publish(user_id, 'notification', {
+                'type': notification_type, 'title': title, 'message': message,
+                'related_id': related_id, 'related_type': related_type, 'created_at': created_at})
+    for user_id, counts in read_counts(live).items():
+        event_broker.publish(user_id, 'counts', counts)
+
+notification_queue.on_written = push_notifications
+
+# Request-scoped user context
+def get_current_user():
+    """Load the logged-in user's row and unread counts, at most once per request"""
+    if 'current_user' not in g:
+        g.current_user = None
+        if session.get('user_id'):
+            # unread_messages and unread_notifications are trigger-maintained columns
+            g.current_user = query_db('SELECT * FROM users WHERE id = ?', [session['user_id']], one=True)
+    return g.current_user
+
+# Not counted as queries (group commits wrap each write in a savepoint)
+TRANSACTION_CONTROL = ('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE')
+
+def count_query(statement):
+    """Count the SQL statements run on behalf of the current request"""
+    if has_app_context() and not statement.startswith(TRANSACTION_CONTROL + ('PRAGMA', '--')):
+        g.query_count = g.get('query_count', 0) + 1
+
+db_pool.on_statement = count_query
+
+def count_queued_write(sql):
+    """Count an execute_db() write, which runs on the group commit thread, against the current request"""
+    count_query(sql)
+    if has_request_context() and 'sql_statements' in g:
+        query = normalize_sql(sql)
+        g.sql_statements[query] = g.sql_statements.get(query, 0) + 1
+
+group_commit.on_queued = count_queued_write
+
+@app.after_request
+def add_query_count_header(response):
+    """Expose the per-request statement count when QUERY_COUNT_HEADER is on"""
+    if app.config['QUERY_COUNT_HEADER']:
+        response.headers['X-Query-Count'] = str(g.get('query_count', 0))
+    return response
+
+# Opt-in request/SQL metrics for GET /metrics and a sampling profiler (see metrics.py)
+METRICS_ENABLED = os.environ.get('METRICS') == '1'
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+metrics = Metrics(n_plus_one=int(os.environ.get('METRICS_N_PLUS_ONE', 5)))
+profiler = SamplingProfiler(hz=float(os.environ.get('PROFILE_HZ', 100)))
+
+def record_query(sql, seconds):
+    """Time a statement and count it against the current request"""
+    query = metrics.record_query(sql, seconds)
+    if has_request_context() and 'sql_statements' in g and not sql.startswith(TRANSACTION_CONTROL):
+        g.sql_statements[query] = g.sql_statements.get(query, 0) + 1
+
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.sql_statements = {}
+    # Unrouted requests (404s) have no endpoint
+    profiler.active[threading.get_ident()] = request.endpoint or 'unknown'
+
+def finish_request_metrics(response):
+    profiler.active.pop(threading.get_ident(), None)
+    if 'request_started' in g:
+        metrics.record_request(request.endpoint, request.method, response.status_code,
+                               time.perf_counter() - g.request_started, g.sql_statements)
+    return response
+
+if METRICS_ENABLED:
+    db_pool.on_query = record_query
+    app.before_request(start_request_metrics)
+    app.after_request(finish_request_metrics)
+    if os.environ.get('PROFILE') == '1':
+        profiler.start()
+
+@app.after_request
+def cache_hashed_uploads(response):
+    """Content-addressed uploads never change, so browsers may cache them forever"""
+    if (request.endpoint == 'static' and response.status_code == 200
+            and request.view_args.get('filename', '').startswith('uploads/')
+            and uploads.is_hashed_name(request.view_args['filename'])):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = 31536000
+        response.cache_control.immutable = True
+    return response
+
+# Bundled CSS/JS (see assets.py); built by `python assets.py`
+assets = Assets(app.static_folder)
+
+@app.template_global()
+def asset_url(name):
+    """URL of a CSS/JS bundle: its fingerprinted build, or the live sources before a build"""
+    return url_for('asset', filename=assets.filename(name))
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    """A built bundle in the best encoding the client accepts, cached for a year; or an unbuilt one, uncached"""
+    found = assets.find(filename, lambda encoding: request.accept_encodings[encoding] > 0)
+    if found is None:
+        source = assets.source(filename)
+        if source is None:
+            abort(404)
+        response = make_response(source[0])
+        response.mimetype = source[1]
+        response.cache_control.no_cache = True
+        return response
+    path, encoding, mimetype = found
+    response = send_file(path, mimetype=mimetype, max_age=31536000)
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.immutable = True
+    return response
+
+# Page cache
+def cache_depends(*names):
+    """Record that the page being rendered is built from these cache versions"""
+    if 'cache_deps' in g:
+        for name, version in page_cache.versions(*names).items():
+            g.cache_deps.setdefault(name, version)
+
+def page_cacheable():
+    """Only anonymous GETs with no pending flash messages share cached pages"""
+    return (CACHE_TTL > 0 and request.method == 'GET'
+            and 'user_id' not in session and '_flashes' not in session)
+
+def cached_page(f):
+    """Serve anonymous requests for a view from the page cache, answering revalidations with 304"""
+    @wraps(f)
+    def wrapped(*args, **kwargs):
+        if not page_cacheable():
+            return f(*args, **kwargs)
+        key = 'page:' + request.full_path
+        entry = page_cache.get(key)
+        if entry is None:
+            # Views call cache_depends() to list what the page is built from
+            g.cache_deps = {}
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200 or session.modified:
+                return response
+            body = response.get_data()
+            entry = {'body': body, 'content_type': response.content_type,
+                     'etag': hashlib.sha1(body).hexdigest(),
+                     'last_modified': datetime.now(timezone.utc).replace(microsecond=0)}
+            page_cache.set(key, entry, g.cache_deps)
+        response = app.response_class(entry['body'], content_type=entry['content_type'])
+        response.set_etag(entry['etag'])
+        response.last_modified = entry['last_modified']
+        response.cache_control.no_cache = True  # always revalidate; a 304 costs no rendering
+        response.vary.add('Cookie')
+        return response.make_conditional(request)
+    return wrapped
+
+def counts_views(f):
+    """Record a view of the pitch whenever its page is served, including from the page cache"""
+    @wraps(f)
+    def wrapped(pitch_id):
+        response = make_response(f(pitch_id))
+        if response.status_code in (200, 304):
+            viewer = session.get('user_id') or (request.remote_addr, request.user_agent.string)
+            view_counter.record(pitch_id, viewer)
+        return response
+    return wrapped
+
+@app.template_global()
+def pitch_card(p):
+    """Render one feed card, memoized on the row's contents so it never goes stale"""
+    if CACHE_TTL <= 0 or 'snippet' in p.keys():
+        return Markup(render_template('pitch_card.html', p=p))
+    fingerprint = hashlib.sha1(repr((tuple(p), image_srcset(p['image']) is not None)).encode()).hexdigest()
+    key = f"card:{p['id']}:{fingerprint}"
+    html = page_cache.get(key)
+    if html is None:
+        html = render_template('pitch_card.html', p=p)
+        page_cache.set(key, html, {})
+    return Markup(html)
 
 @app.context_processor
 def inject_notification_count():
-    """Make notification count available to all templates"""
-    if session.get('user_id'):
-        unread_notifications = get_unread_count(session['user_id'])
-        unread_messages = query_db('SELECT COUNT(*) as count FROM messages WHERE receiver_id = ? AND is_read = 0',
-                                   [session['user_id']], one=True)
-        unread_messages_count = unread_messages['count'] if unread_messages else 0
+    """Make the current user and their unread counts available to all templates"""
+    user = get_current_user()
+    if user is not None:
         return {
-            'notification_count': unread_notifications,
-            'unread_count': unread_messages_count
+            'current_user': user,
+            'notification_count': user['unread_notifications'],
+            'unread_count': user['unread_messages']
         }
-    return {'notification_count': 0, 'unread_count': 0}
+    return {'current_user': None, 'notification_count': 0, 'unread_count': 0}
 
 def login_required(f):
     @wraps(f)
@@ -116,7 +456,7 @@ def role_required(roles):
         def wrapped(*args, **kwargs):
             if 'user_id' not in session:
                 return redirect(url_for('login'))
-            user = query_db('SELECT * FROM users WHERE id = ?', [session['user_id']], one=True)
+            user = get_current_user()
             if user is None or user['role'] not in roles:
                 flash('Insufficient permissions.', 'error')
                 return redirect(url_for('index'))
@@ -124,23 +464,255 @@ def role_required(roles):
         return wrapped
     return decorator
 
+@app.template_global()
+def image_srcset(filename):
+    """srcset attributes for an uploaded image's variants, or None until they are ready"""
+    sources = images.image_sources(app.config['UPLOAD_FOLDER'], filename)
+    if sources is None:
+        return None
+    srcset = {ext: ', '.join(f"{url_for('static', filename=path)} {width}w" for path, width in entries)
+              for ext, entries in sources.items()}
+    srcset['src'] = url_for('static', filename=sources['jpg'][0][0])
+    return srcset
+
+# Pitch feed
+FEED_PAGE_SIZE = 12
+
+# Only the columns the pitch card renders; the body is cut down to the excerpt
+FEED_COLUMNS = ('p.id, p.title, p.summary, substr(p.content, 1, 150) AS excerpt, '
+                'p.category, p.image, p.like_count, p.created_at, u.username')
+
+def query_feed(columns, rest, params, column_params=(), pitch_id='p.id'):
+    """Run `SELECT columns rest` for a feed page, recording its pitches' cache versions first.
+
+    The page's ids are selected on their own and their pitch:<id> versions read
+    before the rows are, so a pitch changed in between leaves the cached page
+    out of date (and refetched) instead of keyed newer than what it shows.
+    """
+    ids = query_db(f'SELECT {pitch_id} AS id {rest}', params)
+    cache_depends(*(f"pitch:{row['id']}" for row in ids))
+    return query_db(f'SELECT {columns} {rest}', [*column_params, *params])
+
+def encode_cursor(created_at, pitch_id):
+    """Encode the (created_at, id) position of a feed or inbox row as an opaque cursor"""
+    raw = f"{created_at}|{pitch_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+# Largest integer SQLite can bind
+MAX_SQL_INT = 2 ** 63 - 1
+
+def decode_cursor(cursor):
+    """Decode a cursor, returning None if it is missing or malformed"""
+    if not cursor:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, pitch_id = raw.rsplit('|', 1)
+        pitch_id = int(pitch_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not -MAX_SQL_INT - 1 <= pitch_id <= MAX_SQL_INT:
+        return None
+    return created_at, pitch_id
+
+# Query-string filters of the feed and /api/feed (see feed_filters), and its sort order
+FEED_FILTERS = ('category', 'stage', 'tag', 'funding', 'funding_min', 'funding_max', 'team_max', 'sort')
+FACET_TAG_LIMIT = 30
+
+def int_arg(args, name):
+    """A non-negative integer query argument, or None if it is missing, malformed or too big to bind"""
+    value = args.get(name, '').strip()
+    # isdigit() alone also accepts digits such as '²' that int() rejects
+    if not (value.isascii() and value.isdigit()) or len(value) > len(str(MAX_SQL_INT)):
+        return None
+    number = int(value)
+    return number if number <= MAX_SQL_INT else None
+
+def feed_filters(args):
+    """WHERE conditions and args for the feed from the query string, plus the tag filter (or None)"""
+    where, params = [], []
+    for column in ('category', 'stage'):
+        if args.get(column, '').strip():
+            where.append(f'p.{column} = ?')
+            params.append(args[column].strip())
+    # A funding bucket name (see facets.FUNDING_BUCKETS) or an explicit range
+    funding_min, funding_max = facets.funding_range(args.get('funding')) or (None, None)
+    funding_min = int_arg(args, 'funding_min') if int_arg(args, 'funding_min') is not None else funding_min
+    funding_max = int_arg(args, 'funding_max') if int_arg(args, 'funding_max') is not None else funding_max
+    if funding_min is not None:
+        where.append('p.funding_amount >= ?')
+        params.append(funding_min)
+    if funding_max is not None:
+        where.append('p.funding_amount < ?')
+        params.append(funding_max)
+    if int_arg(args, 'team_max') is not None:
+        where.append('p.team_size_min <= ?')
+        params.append(int_arg(args, 'team_max'))
+    tags = facets.parse_tags(args.get('tag'))
+    return where, params, (tags[0] if tags else None)
+
+def get_feed_page(search_query='', cursor=None, limit=FEED_PAGE_SIZE, args=None):
+    """Get one page of the pitch feed, newest first, keyset-paginated on (created_at, id)"""
+    # The feed version is read before the query, so a post racing this render invalidates it
+    cache_depends('feed')
+    trending.start()
+    args = args or {}
+    where, params, tag = feed_filters(args)
+    if args.get('sort') == 'hot' and not search_query:
+        return get_hot_page(cursor, limit, where, params, tag)
+    if search_query:
+        if tag:
+            where.append('p.id IN (SELECT pitch_id FROM pitch_tags WHERE tag_id = (SELECT id FROM tags WHERE name = ?))')
+            params.append(tag)
+        return search_pitches(search_query, cursor, limit, where, params)
+    if tag:
+        # pitch_tags keeps created_at, so a tag's pitches come off its index in feed order
+        sql = 'FROM pitch_tags pt JOIN pitches p ON p.id = pt.pitch_id JOIN users u ON p.author_id = u.id'
+        where.insert(0, 'pt.tag_id = (SELECT id FROM tags WHERE name = ?)')
+        params.insert(0, tag)
+        created_at, pitch_id = 'pt.created_at', 'pt.pitch_id'
+    else:
+        sql = 'FROM pitches p JOIN users u ON p.author_id = u.id'
+        created_at, pitch_id = 'p.created_at', 'p.id'
+    position = decode_cursor(cursor)
+    if position:
+        where.append(f'({created_at}, {pitch_id}) < (?, ?)')
+        params.extend(position)
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    sql += f' ORDER BY {created_at} DESC, {pitch_id} DESC LIMIT ?'
+    # Fetch one extra row to learn whether another page exists
+    rows = query_feed(FEED_COLUMNS, sql, params + [limit + 1], pitch_id=pitch_id)
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+    return rows, next_cursor
+
+def get_hot_page(cursor, limit, where, params, tag):
+    """One page of the feed by trending score, keyset-paginated on (score, id)"""
+    cache_depends('trending')
+    if tag:
+        where.append('p.id IN (SELECT pitch_id FROM pitch_tags WHERE tag_id = (SELECT id FROM tags WHERE name = ?))')
+        params.append(tag)
+    position = decode_cursor(cursor)
+    try:
+        score = float(position[0]) if position else None
+    except ValueError:
+        score = None
+    if score is not None:
+        where.append('(s.score, s.pitch_id) < (?, ?)')
+        params.extend([score, position[1]])
+    # CROSS JOIN keeps pitch_scores outermost: walking the score index and
+    # filtering stops after a page, where a filter index would sort every match
+    sql = 'FROM pitch_scores s CROSS JOIN pitches p ON p.id = s.pitch_id JOIN users u ON p.author_id = u.id'
+    if where:
+        sql += ' WHERE ' + ' AND '.join(where)
+    rows = query_feed(f'{FEED_COLUMNS}, s.score', sql + ' ORDER BY s.score DESC, s.pitch_id DESC LIMIT ?',
+                      params + [limit + 1], pitch_id='s.pitch_id')
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(repr(rows[-1]['score']), rows[-1]['id'])
+    return rows, next_cursor
+
+def get_facets(tag_limit=FACET_TAG_LIMIT):
+    """Pitch counts per category, stage, funding bucket and (most used) tag, from facet_counts"""
+    cache_depends('feed')
+    result = {}
+    for facet, limit in (('category', -1), ('stage', -1), ('funding', -1), ('tag', tag_limit)):
+        result[facet] = [{'value': row['value'], 'count': row['count']} for row in query_db(
+            '''SELECT value, count FROM facet_counts WHERE facet = ? AND count > 0
+               ORDER BY count DESC LIMIT ?''', [facet, limit])]
+    order = [name for name, _, _ in facets.FUNDING_BUCKETS]
+    result['funding'].sort(key=lambda item: order.index(item['value']))
+    return result
+
+# Full-text search (see search_index.py for the FTS5 table and its triggers)
+# BM25 column weights: title, summary, content, tags, category.
+# Ordering by the FTS5 rank column lets the index hand rows back in rank order,
+# so only the rows on the page get a snippet built.
+SEARCH_RANK = 'bm25(10.0, 5.0, 1.0, 4.0, 2.0)'
+# Search results are paged by offset, which gets slower the deeper it goes; stop here
+SEARCH_MAX_OFFSET = 1000
+SNIPPET_OPEN, SNIPPET_CLOSE = '\x02', '\x03'
+
+def build_search_match(search_query):
+    """Turn free text into an FTS5 query: every word must match, as a prefix"""
+    words = re.findall(r'\w+', search_query)
+    return ' '.join('"%s"*' % word for word in words)
+
+def highlight_snippet(snippet):
+    """Escape a search snippet and turn the match markers into <mark> tags"""
+    html = str(escape(snippet or ''))
+    return Markup(html.replace(SNIPPET_OPEN, '<mark>').replace(SNIPPET_CLOSE, '</mark>'))
+
+def search_pitches(search_query, cursor=None, limit=FEED_PAGE_SIZE, where=(), params=()):
+    """Get one page of pitches matching a search, best BM25 rank first, optionally filtered"""
+    match = build_search_match(search_query)
+    if not match:
+        return [], None
+    # Results are ordered by rank, so the cursor is just an offset into them
+    offset = int(cursor) if cursor and cursor.isascii() and cursor.isdigit() else 0
+    if offset > SEARCH_MAX_OFFSET:
+        offset = 0
+    filters = ''.join(' AND ' + condition for condition in where)
+    rows = query_feed(f"{FEED_COLUMNS}, snippet(pitches_fts, -1, ?, ?, '…', 16) AS snippet",
+                      f'''FROM pitches_fts
+                          JOIN pitches p ON p.id = pitches_fts.rowid
+                          JOIN users u ON p.author_id = u.id
+                          WHERE pitches_fts MATCH ? AND rank MATCH ?{filters}
+                          ORDER BY rank
+                          LIMIT ? OFFSET ?''',
+                      [match, SEARCH_RANK, *params, limit + 1, offset],
+                      column_params=[SNIPPET_OPEN, SNIPPET_CLOSE])
+    next_cursor = str(offset + limit) if len(rows) > limit and offset + limit <= SEARCH_MAX_OFFSET else None
+    results = []
+    for row in rows[:limit]:
+        result = dict(row)
+        result['snippet'] = highlight_snippet(row['snippet'])
+        results.append(result)
+    return results, next_cursor
+
 @app.route('/')
+@cached_page
 def index():
     search_query = request.args.get('q', '').strip()
-    if search_query:
-        pitches = query_db('SELECT p.id, p.title, p.summary, p.content, p.category, p.image, p.created_at, u.username FROM pitches p JOIN users u ON p.author_id = u.id WHERE p.title LIKE ? OR p.content LIKE ? ORDER BY p.created_at DESC', ['%' + search_query + '%', '%' + search_query + '%'])
-    else:
-        pitches = query_db('SELECT p.id, p.title, p.summary, p.content, p.category, p.image, p.created_at, u.username FROM pitches p JOIN users u ON p.author_id = u.id ORDER BY p.created_at DESC')
-    return render_template('index.html', pitches=pitches, search_query=search_query)
+    pitches, next_cursor = get_feed_page(search_query, request.args.get('after'), args=request.args)
+    return render_template('index.html', pitches=pitches, search_query=search_query,
+                           next_cursor=next_cursor,
+                           filters={key: request.args[key] for key in FEED_FILTERS if request.args.get(key)})
+
+@app.route('/api/feed')
+@cached_page
+def feed_json():
+    """JSON variant of the pitch feed, used for infinite scroll and faceted browsing.
+
+    Takes the FEED_FILTERS as query arguments; ?facets=1 adds the pitch counts
+    per facet value (over all pitches, not just the filtered ones).
+    """
+    search_query = request.args.get('q', '').strip()
+    pitches, next_cursor = get_feed_page(search_query, request.args.get('after'), args=request.args)
+    result = {
+        'pitches': [dict(p) for p in pitches],
+        'html': render_template('pitch_card_list.html', pitches=pitches),
+        'next_cursor': next_cursor
+    }
+    if request.args.get('facets'):
+        result['facets'] = get_facets()
+    return result
 
 @app.route('/pitch/<int:pitch_id>')
+@counts_views
+@cached_page
 def pitch(pitch_id):
+    cache_depends(f'pitch:{pitch_id}')
     p = query_db('SELECT p.*, u.username, u.id as author_user_id FROM pitches p JOIN users u ON p.author_id = u.id WHERE p.id = ?', [pitch_id], one=True)
     if p is None:
         return "Pitch not found", 404
     
-    # Get like count and check if current user liked
-    like_count = query_db('SELECT COUNT(*) as count FROM likes WHERE pitch_id = ?', [pitch_id], one=True)['count']
+    # Like count is kept on the pitch row; check if current user liked
+    like_count = p['like_count']
     user_liked = False
     if session.get('user_id'):
         user_liked = query_db('SELECT * FROM likes WHERE pitch_id = ? AND user_id = ?', 
@@ -168,24 +740,56 @@ def register():
         if existing:
             flash('Username exists', 'error')
             return redirect(url_for('register'))
-        pwd_hash = generate_password_hash(password)
+        try:
+            pwd_hash = hasher.hash(password)
+        except HasherBusy:
+            return busy_response('register.html')
         execute_db('INSERT INTO users (username, password_hash, role, created_at) VALUES (?, ?, ?, ?)', [username, pwd_hash, role, datetime.utcnow().isoformat()])
         flash('Registered. Please login.', 'success')
         return redirect(url_for('login'))
     return render_template('register.html')
 
+def busy_response(template):
+    """Ask the client to retry when the password hashing pool is full"""
+    flash('The server is busy, please try again in a moment.', 'error')
+    response = make_response(render_template(template), 503)
+    response.headers['Retry-After'] = '1'
+    return response
+
 @app.route('/login', methods=['GET','POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username'].strip()
         password = request.form['password']
+        # Refuse floods before spending a hash on them
+        ip_key, user_key = request.remote_addr, username.lower()
+        wait = max(ip_attempts.retry_after(ip_key), user_attempts.retry_after(user_key))
+        if wait:
+            flash(f'Too many failed logins. Try again in {wait} seconds.', 'error')
+            response = make_response(render_template('login.html'), 429)
+            response.headers['Retry-After'] = str(wait)
+            return response
         user = query_db('SELECT * FROM users WHERE username = ?', [username], one=True)
-        if user and check_password_hash(user['password_hash'], password):
+        try:
+            valid = hasher.verify(user['password_hash'] if user else None, password)
+        except HasherBusy:
+            return busy_response('login.html')
+        if valid:
+            user_attempts.reset(user_key)
+            if hasher.needs_rehash(user['password_hash']):
+                # PASSWORD_HASH_METHOD changed since this hash was made; upgrade it now we know the password
+                try:
+                    execute_db('UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?',
+                               [hasher.hash(password), user['id'], user['password_hash']])
+                except HasherBusy:
+                    pass
             session['user_id'] = user['id']
             session['username'] = user['username']
             session['role'] = user['role']
             flash('Logged in', 'success')
             return redirect(url_for('index'))
+        ip_attempts.fail(ip_key)
+        user_attempts.fail(user_key)
         flash('Invalid credentials', 'error')
         return redirect(url_for('login'))
     return render_template('login.html')
@@ -225,24 +829,44 @@ def post():
             return redirect(url_for('post'))
         
         # Handle image upload
-        image_filename = None
+        upload = None
         if 'image' in request.files:
             file = request.files['image']
             if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                # Add timestamp to filename to make it unique
-                timestamp = datetime.utcnow().strftime('%Y%m%d_%H%M%S')
-                image_filename = f"{timestamp}_{filename}"
-                file.save(os.path.join(app.config['UPLOAD_FOLDER'], image_filename))
+                error = images.check_image(file.stream)
+                if error:
+                    flash(error, 'error')
+                    return redirect(url_for('post'))
+                upload = file
         
-        # Insert into database with all fields
-        execute_db('''INSERT INTO pitches 
-                     (title, summary, content, category, tags, image, funding_goal, stage, 
-                      team_size, location, website, demo_url, looking_for, author_id, created_at) 
-                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', 
-                   [title, summary, content, category, tags, image_filename, funding_goal, stage,
-                    team_size, location, website, demo_url, looking_for_str, session['user_id'], 
-                    datetime.utcnow().isoformat()])
+        image_filename = None
+        created_at = datetime.utcnow().isoformat()
+        with transaction() as conn:
+            # Stored under its content hash (see uploads.py); inside the transaction so
+            # an orphan sweep cannot delete an identical file before this pitch uses it
+            if upload is not None:
+                image_filename = uploads.store_upload(upload.stream, secure_filename(upload.filename),
+                                                      app.config['UPLOAD_FOLDER'])
+
+            # Insert into database with all fields
+            pitch_id = conn.execute('''INSERT INTO pitches 
+                         (title, summary, content, category, tags, image, funding_goal, stage, 
+                          team_size, location, website, demo_url, looking_for, author_id, created_at,
+                          funding_amount, team_size_min) 
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', 
+                       [title, summary, content, category, tags, image_filename, funding_goal, stage,
+                        team_size, location, website, demo_url, looking_for_str, session['user_id'], 
+                        created_at, facets.parse_funding(funding_goal),
+                        facets.parse_team_size(team_size)]).lastrowid
+            # Normalized copies for the feed filters and facet counts (see facets.py)
+            facets.set_pitch_tags(conn, pitch_id, facets.parse_tags(tags), created_at)
+        page_cache.bump('feed')
+
+        # Resized WebP/JPEG variants are made in the background (see images.py);
+        # cached pages switch to them once they are ready
+        if image_filename:
+            future = images.process_async(app.config['UPLOAD_FOLDER'], image_filename)
+            future.add_done_callback(lambda _: page_cache.bump(f'pitch:{pitch_id}'))
         
         flash('Pitch posted successfully!', 'success')
         return redirect(url_for('index'))
@@ -251,55 +875,58 @@ def post():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    user = query_db('SELECT * FROM users WHERE id = ?', [session['user_id']], one=True)
+    user = get_current_user()
+    if user is None:
+        session.clear()
+        return redirect(url_for('login'))
     pitches = query_db('SELECT * FROM pitches WHERE author_id = ? ORDER BY created_at DESC', [session['user_id']])
 
-    # Get unread message count
-    unread_count = query_db('SELECT COUNT(*) as count FROM messages WHERE receiver_id = ? AND is_read = 0', 
-                           [session['user_id']], one=True)['count']
-
-    # Get unread notification count
-    notification_count = get_unread_count(session['user_id'])
-
-    return render_template('dashboard.html', user=user, pitches=pitches, unread_count=unread_count, notification_count=notification_count)
+    # Unread counts come with the request-scoped user row
+    return render_template('dashboard.html', user=user, pitches=pitches,
+                           unread_count=user['unread_messages'],
+                           notification_count=user['unread_notifications'])
 
 # Like/Unlike pitch
 @app.route('/pitch/<int:pitch_id>/like', methods=['POST'])
 @login_required
 def like_pitch(pitch_id):
+    """Toggle the current user's like in a single transaction (one commit per click)"""
     user_id = session['user_id']
-    existing = query_db('SELECT * FROM likes WHERE pitch_id = ? AND user_id = ?', [pitch_id, user_id], one=True)
+    now = datetime.utcnow().isoformat()
+    with transaction() as conn:
+        # The write lock is held from here on, so the count read below stays exact
+        pitch = conn.execute('SELECT author_id, title, like_count FROM pitches WHERE id = ?',
+                             [pitch_id]).fetchone()
+        if pitch is None:
+            return {'success': False, 'error': 'Pitch not found'}, 404
 
-    # Get pitch info to find the author
-    pitch = query_db('SELECT * FROM pitches WHERE id = ?', [pitch_id], one=True)
-    if not pitch:
-        return {'success': False, 'error': 'Pitch not found'}, 404
+        # Unlike if a like exists, otherwise like; ON CONFLICT absorbs racing double-clicks
+        removed = conn.execute('DELETE FROM likes WHERE pitch_id = ? AND user_id = ? RETURNING id',
+                               [pitch_id, user_id]).fetchall()
+        if removed:
+            liked = False
+            like_count = pitch['like_count'] - 1
+        else:
+            inserted = conn.execute('''INSERT INTO likes (pitch_id, user_id, created_at) VALUES (?, ?, ?)
+                                      ON CONFLICT(pitch_id, user_id) DO NOTHING RETURNING id''',
+                                   [pitch_id, user_id, now]).fetchall()
+            liked = True
+            like_count = pitch['like_count'] + len(inserted)
 
-    if existing:
-        # Unlike
-        execute_db('DELETE FROM likes WHERE pitch_id = ? AND user_id = ?', [pitch_id, user_id])
-        liked = False
-    else:
-        # Like
-        execute_db('INSERT INTO likes (pitch_id, user_id, created_at) VALUES (?, ?, ?)',
-                  [pitch_id, user_id, datetime.utcnow().isoformat()])
-        liked = True
-
-        # Create notification for pitch author (if not liking own pitch)
-        if pitch['author_id'] != user_id:
-            liker = query_db('SELECT username FROM users WHERE id = ?', [user_id], one=True)
-            if liker:
-                create_notification(
-                    user_id=pitch['author_id'],
-                    notification_type='like',
-                    title='New Like on Your Pitch',
-                    message=f"{liker['username']} liked your pitch '{pitch['title']}'",
-                    related_id=pitch_id,
-                    related_type='pitch'
-                )
-
-    # Get updated like count
-    like_count = query_db('SELECT COUNT(*) as count FROM likes WHERE pitch_id = ?', [pitch_id], one=True)['count']
+    if like_count != pitch['like_count']:
+        page_cache.bump(f'pitch:{pitch_id}')
+
+    # Notify the pitch author (if not liking own pitch) once the like is committed
+    if liked and like_count > pitch['like_count'] and pitch['author_id'] != user_id:
+        create_notification(
+            user_id=pitch['author_id'],
+            notification_type='like',
+            title='New Like on Your Pitch',
+            message=f"{{actor}} liked your pitch '{pitch['title']}'",
+            related_id=pitch_id,
+            related_type='pitch',
+            actor=session.get('username')
+        )
 
     return {'success': True, 'liked': liked, 'like_count': like_count}
 
@@ -312,25 +939,25 @@ def add_comment(pitch_id):
         return {'success': False, 'error': 'Comment cannot be empty'}, 400
 
     # Get pitch info to find the author
-    pitch = query_db('SELECT * FROM pitches WHERE id = ?', [pitch_id], one=True)
+    pitch = query_db('SELECT author_id, title FROM pitches WHERE id = ?', [pitch_id], one=True)
     if not pitch:
         return {'success': False, 'error': 'Pitch not found'}, 404
 
     execute_db('INSERT INTO comments (pitch_id, user_id, content, created_at) VALUES (?, ?, ?, ?)',
               [pitch_id, session['user_id'], content, datetime.utcnow().isoformat()])
+    page_cache.bump(f'pitch:{pitch_id}')
 
     # Create notification for pitch author (if not commenting on own pitch)
     if pitch['author_id'] != session['user_id']:
-        commenter = query_db('SELECT username FROM users WHERE id = ?', [session['user_id']], one=True)
-        if commenter:
-            create_notification(
-                user_id=pitch['author_id'],
-                notification_type='comment',
-                title='New Comment on Your Pitch',
-                message=f"{commenter['username']} commented on your pitch '{pitch['title']}'",
-                related_id=pitch_id,
-                related_type='pitch'
-            )
+        create_notification(
+            user_id=pitch['author_id'],
+            notification_type='comment',
+            title='New Comment on Your Pitch',
+            message=f"{{actor}} commented on your pitch '{pitch['title']}'",
+            related_id=pitch_id,
+            related_type='pitch',
+            actor=session.get('username')
+        )
 
     flash('Comment added successfully!', 'success')
     return redirect(url_for('pitch', pitch_id=pitch_id))
@@ -342,28 +969,72 @@ def delete_comment(comment_id):
     comment = query_db('SELECT * FROM comments WHERE id = ?', [comment_id], one=True)
     if comment and comment['user_id'] == session['user_id']:
         execute_db('DELETE FROM comments WHERE id = ?', [comment_id])
+        page_cache.bump(f"pitch:{comment['pitch_id']}")
         flash('Comment deleted', 'success')
     return redirect(request.referrer or url_for('index'))
 
-# Messages inbox
+# Messages: conversations per participant pair (see conversations.py)
+CONVERSATION_PAGE_SIZE = 20
+THREAD_PAGE_SIZE = 30
+
 @app.route('/messages')
 @login_required
 def messages():
-    # Get received messages
-    received = query_db('''SELECT m.*, u.username as sender_name 
-                          FROM messages m 
-                          JOIN users u ON m.sender_id = u.id 
-                          WHERE m.receiver_id = ? 
-                          ORDER BY m.created_at DESC''', [session['user_id']])
-    
-    # Get sent messages
-    sent = query_db('''SELECT m.*, u.username as receiver_name 
-                      FROM messages m 
-                      JOIN users u ON m.receiver_id = u.id 
-                      WHERE m.sender_id = ? 
-                      ORDER BY m.created_at DESC''', [session['user_id']])
-    
-    return render_template('messages.html', received=received, sent=sent)
+    """Conversation list, latest first, keyset-paginated on (last_message_at, conversation id)"""
+    sql = '''SELECT c.id, c.last_preview, c.last_sender_id, c.message_count,
+                    cm.last_message_at, cm.unread_count, cm.other_id, u.username AS other_name
+             FROM conversation_members cm
+             JOIN conversations c ON c.id = cm.conversation_id
+             JOIN users u ON u.id = cm.other_id
+             WHERE cm.user_id = ?'''
+    args = [session['user_id']]
+    position = decode_cursor(request.args.get('after'))
+    if position:
+        sql += ' AND (cm.last_message_at, cm.conversation_id) < (?, ?)'
+        args.extend(position)
+    sql += ' ORDER BY cm.last_message_at DESC, cm.conversation_id DESC LIMIT ?'
+    rows = query_db(sql, args + [CONVERSATION_PAGE_SIZE + 1])
+    next_cursor = None
+    if len(rows) > CONVERSATION_PAGE_SIZE:
+        rows = rows[:CONVERSATION_PAGE_SIZE]
+        next_cursor = encode_cursor(rows[-1]['last_message_at'], rows[-1]['id'])
+    return render_template('messages.html', conversations=rows, next_cursor=next_cursor)
+
+@app.route('/messages/<int:user_id>')
+@login_required
+def conversation(user_id):
+    """One conversation, newest page first (paged back with ?before=<message id>); opening it marks it read"""
+    other = query_db('SELECT id, username FROM users WHERE id = ?', [user_id], one=True)
+    if not other:
+        flash('User not found', 'error')
+        return redirect(url_for('messages'))
+
+    me = session['user_id']
+    member = query_db('''SELECT cm.conversation_id, cm.unread_count
+                         FROM conversations c
+                         JOIN conversation_members cm ON cm.conversation_id = c.id AND cm.user_id = ?
+                         WHERE c.user_low = ? AND c.user_high = ?''',
+                      [me, min(me, user_id), max(me, user_id)], one=True)
+    thread, older = [], None
+    if member:
+        sql = 'SELECT id, sender_id, subject, content, is_read, created_at FROM messages WHERE conversation_id = ?'
+        args = [member['conversation_id']]
+        before = int_arg(request.args, 'before')
+        if before:
+            sql += ' AND id < ?'
+            args.append(before)
+        rows = query_db(sql + ' ORDER BY id DESC LIMIT ?', args + [THREAD_PAGE_SIZE + 1])
+        if len(rows) > THREAD_PAGE_SIZE:
+            rows = rows[:THREAD_PAGE_SIZE]
+            older = rows[-1]['id']
+        thread = rows[::-1]
+        if member['unread_count']:
+            # One statement for the whole thread; the triggers adjust every unread counter
+            execute_db('''UPDATE messages SET is_read = 1
+                          WHERE conversation_id = ? AND receiver_id = ? AND is_read = 0''',
+                       [member['conversation_id'], me])
+            push_counts(me)
+    return render_template('conversation.html', other=other, thread=thread, older=older)
 
 # Send message
 @app.route('/message/send/<int:user_id>', methods=['GET', 'POST'])
@@ -385,21 +1056,23 @@ def send_message(user_id):
         execute_db('''INSERT INTO messages (sender_id, receiver_id, subject, content, created_at) 
                      VALUES (?, ?, ?, ?, ?)''',
                   [session['user_id'], user_id, subject, content, datetime.utcnow().isoformat()])
+        if event_broker.has_subscribers(user_id):
+            event_broker.publish(user_id, 'message', {'from': session.get('username'), 'subject': subject})
+            push_counts(user_id)
         
         # Create notification for message receiver
-        sender = query_db('SELECT username FROM users WHERE id = ?', [session['user_id']], one=True)
-        if sender:
-            create_notification(
-                user_id=user_id,
-                notification_type='message',
-                title='New Message',
-                message=f"You have a new message from {sender['username']}",
-                related_id=session['user_id'],
-                related_type='user'
-            )
+        create_notification(
+            user_id=user_id,
+            notification_type='message',
+            title='New Message',
+            message='You have a new message from {actor}',
+            related_id=session['user_id'],
+            related_type='user',
+            actor=session.get('username')
+        )
 
         flash('Message sent successfully!', 'success')
-        return redirect(url_for('messages'))
+        return redirect(url_for('conversation', user_id=user_id))
     
     return render_template('send_message.html', receiver=receiver)
 
@@ -410,21 +1083,72 @@ def mark_read(message_id):
     message = query_db('SELECT * FROM messages WHERE id = ?', [message_id], one=True)
     if message and message['receiver_id'] == session['user_id']:
         execute_db('UPDATE messages SET is_read = 1 WHERE id = ?', [message_id])
+        push_counts(session['user_id'])
     return {'success': True}
 
 # Notifications
 @app.route('/notifications')
 @login_required
 def notifications():
-    """View all notifications for the current user"""
-    user_notifications = get_user_notifications(session['user_id'])
-    return render_template('notifications.html', notifications=user_notifications)
+    """View the current user's notifications, one page at a time"""
+    user_notifications, next_cursor = get_user_notifications(session['user_id'], request.args.get('after'))
+    return render_template('notifications.html', notifications=user_notifications, next_cursor=next_cursor)
+
+@app.route('/notifications/stream')
+@login_required
+def notification_stream():
+    """Server-Sent Events: new notifications and messages, and unread counts, as they happen"""
+    user = get_current_user()
+    if user is None:
+        return '', 204  # tells EventSource not to reconnect
+    user_id = user['id']
+    counts = {'notifications': user['unread_notifications'], 'messages': user['unread_messages']}
+    subscription = event_broker.subscribe(user_id)
+
+    # Runs after the request context (and its DB connection) is gone
+    def stream(last_counts):
+        try:
+            yield 'retry: 5000\n' + format_sse('counts', last_counts)
+            while True:
+                item = subscription.get(STREAM_HEARTBEAT_SECONDS)
+                if item is None or subscription.stale:
+                    # Heartbeat: re-read the counters in case the write landed in another
+                    # worker (or events were dropped); otherwise just keep the connection alive
+                    subscription.stale = False
+                    current = read_counts([user_id]).get(user_id, last_counts)
+                    if current != last_counts:
+                        last_counts = current
+                        yield format_sse('counts', current)
+                    elif item is None:
+                        yield ': ping\n\n'
+                    if item is None:
+                        continue
+                event, data = item
+                if event == 'counts':
+                    if data == last_counts:
+                        continue
+                    last_counts = data
+                yield format_sse(event, data)
+        finally:
+            subscription.close()
+
+    response = app.response_class(stream(counts), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+@app.route('/admin/stream-stats')
+@role_required(['admin'])
+def admin_stream_stats():
+    """Open notification streams and delivery counters"""
+    return event_broker.stats()
 
 @app.route('/notifications/mark_read/<int:notification_id>', methods=['POST'])
 @login_required
 def mark_notification_read_route(notification_id):
     """Mark a specific notification as read"""
     mark_notification_read(notification_id, session['user_id'])
+    push_counts(session['user_id'])
     return redirect(url_for('notifications'))
 
 @app.route('/notifications/mark_all_read', methods=['POST'])
@@ -432,6 +1156,7 @@ def mark_notification_read_route(notification_id):
 def mark_all_notifications_read_route():
     """Mark all notifications as read"""
     mark_all_notifications_read(session['user_id'])
+    push_counts(session['user_id'])
     return redirect(url_for('notifications'))
 
 @app.route('/notifications/delete/<int:notification_id>', methods=['POST'])
@@ -439,8 +1164,170 @@ def mark_all_notifications_read_route():
 def delete_notification_route(notification_id):
     """Delete a specific notification"""
     delete_notification(notification_id, session['user_id'])
+    push_counts(session['user_id'])
+    return redirect(url_for('notifications'))
+
+# Largest older_than_days a bulk notification request may give (ten years)
+MAX_AGE_DAYS = 3650
+
+@app.route('/notifications/bulk', methods=['POST'])
+@login_required
+def bulk_notifications_route():
+    """Mark read or delete many notifications in one statement.
+
+    Takes a form or JSON body with `action` ("read" or "delete") and any of `ids`
+    (a list), `type` and `older_than_days`; every given criterion must match.
+    """
+    data = request.get_json(silent=True) if request.is_json else None
+    if data is None:
+        data = {'action': request.form.get('action'), 'ids': request.form.getlist('ids') or None,
+                'type': request.form.get('type'), 'older_than_days': request.form.get('older_than_days') or None}
+    action = data.get('action')
+    try:
+        criteria = {'ids': data.get('ids'), 'notification_type': data.get('type') or None,
+                    'older_than_days': None if data.get('older_than_days') is None else float(data['older_than_days'])}
+        if criteria['ids'] is not None:
+            criteria['ids'] = [int(i) for i in criteria['ids']]
+        # Also false for NaN
+        if criteria['older_than_days'] is not None and not 0 <= criteria['older_than_days'] <= MAX_AGE_DAYS:
+            raise ValueError('older_than_days out of range')
+    except (TypeError, ValueError):
+        criteria = None
+
+    if action not in ('read', 'delete') or criteria is None:
+        error = 'Invalid bulk notification request'
+    elif action == 'delete' and all(value is None for value in criteria.values()):
+        error = 'Choose which notifications to delete'
+    else:
+        error = None
+    if error:
+        if request.is_json:
+            return {'success': False, 'error': error}, 400
+        flash(error, 'error')
+        return redirect(url_for('notifications'))
+
+    if action == 'read':
+        count = mark_notifications_read(session['user_id'], **criteria)
+    else:
+        count = delete_notifications(session['user_id'], **criteria)
+    push_counts(session['user_id'])
+    if request.is_json:
+        return {'success': True, 'count': count}
+    flash(f"{count} notification{'s' if count != 1 else ''} {'marked as read' if action == 'read' else 'deleted'}",
+          'success')
     return redirect(url_for('notifications'))
 
+# Admin console: one server-side page of users or pitches at a time
+ADMIN_PAGE_SIZE = 25
+EXPORT_BATCH_SIZE = 500
+ADMIN_FILTERS = {'users': ['q', 'role', 'sort'], 'pitches': ['q', 'category', 'author', 'sort']}
+# sort name -> (column, descending); each has an index that yields rows in that order
+ADMIN_SORTS = {
+    'users': {'newest': ('created_at', True), 'oldest': ('created_at', False), 'username': ('username', False)},
+    'pitches': {'newest': ('created_at', True), 'oldest': ('created_at', False)},
+}
+
+# Exports page through the table on id: {where} ends with an `id > ?` condition, and
+# NOT INDEXED keeps a filter's index from turning each batch into a sort
+ADMIN_EXPORTS = {
+    'users': (['id', 'username', 'role', 'created_at', 'pitch_count'],
+              '''SELECT batch.id, batch.username, batch.role, batch.created_at, COUNT(p.id) AS pitch_count
+                 FROM (SELECT u.id, u.username, u.role, u.created_at FROM users u NOT INDEXED
+                       WHERE {where} ORDER BY u.id LIMIT ?) AS batch
+                 LEFT JOIN pitches p ON p.author_id = batch.id
+                 GROUP BY batch.id ORDER BY batch.id'''),
+    'pitches': (['id', 'title', 'category', 'stage', 'funding_goal', 'author', 'like_count', 'comment_count',
+                 'created_at'],
+                '''SELECT p.id, p.title, p.category, p.stage, p.funding_goal, u.username, p.like_count,
+                          p.comment_count, p.created_at
+                   FROM pitches p NOT INDEXED JOIN users u ON u.id = p.author_id
+                   WHERE {where} ORDER BY p.id LIMIT ?'''),
+}
+
+def admin_filters(tab, args):
+    """WHERE conditions and args for the admin user or pitch list from the query string"""
+    where, params = [], []
+    q = args.get('q', '').strip()
+    if tab == 'users':
+        if q:
+            # Username prefix, as a range on the UNIQUE index
+            where.append('u.username >= ? AND u.username < ?')
+            params += [q, q + '\uffff']
+        if args.get('role'):
+            # Sorted by username, walk the username index and filter (unary + keeps
+            # the planner off the role index, which would mean sorting the whole role)
+            where.append('+u.role = ?' if args.get('sort') == 'username' else 'u.role = ?')
+            params.append(args['role'])
+    else:
+        if build_search_match(q):
+            where.append('p.id IN (SELECT rowid FROM pitches_fts WHERE pitches_fts MATCH ?)')
+            params.append(build_search_match(q))
+        if args.get('category'):
+            where.append('p.category = ?')
+            params.append(args['category'])
+        if args.get('author'):
+            where.append('p.author_id = (SELECT id FROM users WHERE username = ?)')
+            params.append(args['author'])
+    return where, params
+
+def admin_page(tab, args):
+    """One page of the admin user or pitch list, keyset-paginated on (sort column, id)"""
+    column, descending = ADMIN_SORTS[tab].get(args.get('sort'), ADMIN_SORTS[tab]['newest'])
+    op, direction = ('<', 'DESC') if descending else ('>', 'ASC')
+    where, params = admin_filters(tab, args)
+    alias = tab[0]
+    position = decode_cursor(args.get('after'))
+    if position:
+        where.append(f'({alias}.{column}, {alias}.id) {op} (?, ?)')
+        params += list(position)
+    where_sql = ' AND '.join(where) or '1 = 1'
+    if tab == 'users':
+        # Page the users first, then count only their pitches in one GROUP BY join
+        sql = f'''SELECT page.*, COUNT(p.id) AS pitch_count
+                  FROM (SELECT u.id, u.username, u.role, u.created_at FROM users u WHERE {where_sql}
+                        ORDER BY u.{column} {direction}, u.id {direction} LIMIT ?) AS page
+                  LEFT JOIN pitches p ON p.author_id = page.id
+                  GROUP BY page.id ORDER BY page.{column} {direction}, page.id {direction}'''
+    else:
+        sql = f'''SELECT p.id, p.title, p.category, p.image, p.like_count, p.comment_count, p.view_count,
+                         p.created_at, u.username
+                  FROM pitches p JOIN users u ON u.id = p.author_id WHERE {where_sql}
+                  ORDER BY p.{column} {direction}, p.id {direction} LIMIT ?'''
+    rows = query_db(sql, params + [ADMIN_PAGE_SIZE + 1])
+    next_cursor = None
+    if len(rows) > ADMIN_PAGE_SIZE:
+        rows = rows[:ADMIN_PAGE_SIZE]
+        next_cursor = encode_cursor(rows[-1][column], rows[-1]['id'])
+    return rows, next_cursor
+
+def compute_admin_stats():
+    """Site totals and breakdowns for the admin console (see admin_stats)"""
+    week_ago = (datetime.utcnow() - timedelta(days=7)).isoformat()
+    conn = db_pool.acquire()
+    try:
+        stats = dict(conn.execute('SELECT name, value FROM site_stats').fetchall())
+        stats['roles'] = sorted(map(tuple, conn.execute('SELECT role, COUNT(*) FROM users GROUP BY role')),
+                                key=lambda row: -row[1])
+        stats['categories'] = sorted(map(tuple, conn.execute('SELECT category, COUNT(*) FROM pitches GROUP BY category')),
+                                     key=lambda row: -row[1])
+        stats['new_users'] = conn.execute('SELECT COUNT(*) FROM users WHERE created_at >= ?',
+                                          [week_ago]).fetchone()[0]
+        stats['new_pitches'] = conn.execute('SELECT COUNT(*) FROM pitches WHERE created_at >= ?',
+                                            [week_ago]).fetchone()[0]
+        stats['messages'] = conn.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+    finally:
+        db_pool.release(conn)
+    return stats
+
+# The breakdowns read whole indexes, so they are recomputed at most every few minutes
+admin_stats = Snapshot(compute_admin_stats, max_age=float(os.environ.get('ADMIN_STATS_SECONDS', 300)))
+
+def csv_cell(value):
+    """A CSV value that spreadsheets will not evaluate as a formula"""
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@'):
+        return "'" + value
+    return value
+
 @app.route('/admin', methods=['GET','POST'])
 @role_required(['admin'])
 def admin():
@@ -451,40 +1338,149 @@ def admin():
         
         if action == 'promote' and target:
             execute_db('UPDATE users SET role = ? WHERE username = ?', [request.form.get('newrole','verified'), target])
+            page_cache.clear()
             flash('User role updated successfully!', 'success')
         elif action == 'delete_user' and target:
-            execute_db('DELETE FROM users WHERE username = ?', [target])
-            flash('User deleted successfully!', 'success')
+            user = query_db('SELECT id FROM users WHERE username = ?', [target], one=True)
+            if user:
+                # A prolific user's rows are removed in the background, a batch at
+                # a time (see purge.py); until then they can no longer log in
+                with transaction() as conn:
+                    conn.execute("UPDATE users SET password_hash = '!' WHERE id = ?", [user['id']])
+                    purger.schedule(conn, 'user', user['id'])
+                purger.wake()
+                flash('User scheduled for deletion.', 'success')
         elif action == 'delete_pitch' and pitch_id:
-            execute_db('DELETE FROM pitches WHERE id = ?', [pitch_id])
+            # Likes, comments, notifications and its image (unless shared) go with it
+            with transaction() as conn:
+                orphans = delete_pitch(conn, int(pitch_id))
+            uploads.remove_orphan_files(db_pool, app.config['UPLOAD_FOLDER'], orphans)
+            page_cache.bump('feed', f'pitch:{pitch_id}')
             flash('Pitch deleted successfully!', 'success')
         
         return redirect(url_for('admin'))
     
-    # Get all users with pitch counts
-    users = query_db('''SELECT u.id, u.username, u.role, u.created_at,
-                       (SELECT COUNT(*) FROM pitches WHERE author_id = u.id) as pitch_count
-                       FROM users u ORDER BY u.created_at DESC''')
-    
-    # Get all pitches with author info
-    pitches = query_db('''SELECT p.*, u.username 
-                         FROM pitches p 
-                         JOIN users u ON p.author_id = u.id 
-                         ORDER BY p.created_at DESC''')
-    
-    # Get statistics
-    total_users = len(users)
-    total_pitches = len(pitches)
-    total_comments = query_db('SELECT COUNT(*) as count FROM comments', one=True)['count']
-    total_likes = query_db('SELECT COUNT(*) as count FROM likes', one=True)['count']
-    
-    return render_template('admin.html', 
-                          users=users, 
-                          pitches=pitches,
-                          total_users=total_users,
-                          total_pitches=total_pitches,
-                          total_comments=total_comments,
-                          total_likes=total_likes)
+    # Resume purge jobs left over from a restart
+    purger.wake()
+    tab = 'pitches' if request.args.get('tab') == 'pitches' else 'users'
+    rows, next_cursor = admin_page(tab, request.args)
+    return render_template('admin.html',
+                          tab=tab,
+                          rows=rows,
+                          next_cursor=next_cursor,
+                          filters={key: request.args[key] for key in ADMIN_FILTERS[tab] if request.args.get(key)},
+                          sorts=ADMIN_SORTS[tab],
+                          stats=admin_stats.get(refresh=request.args.get('refresh') == '1'),
+                          stats_taken_at=datetime.utcfromtimestamp(admin_stats.taken_at))
+
+@app.route('/admin/export/<kind>.csv')
+@role_required(['admin'])
+def admin_export(kind):
+    """Stream the (filtered) user or pitch list as CSV, one batch of rows at a time"""
+    if kind not in ADMIN_EXPORTS:
+        return 'Unknown export', 404
+    header, sql = ADMIN_EXPORTS[kind]
+    where, args = admin_filters(kind, request.args)
+    statement = sql.format(where=' AND '.join(where + [f'{kind[0]}.id > ?']))
+
+    # Runs after the request context is gone; each batch takes a pool connection
+    # only for its own query, so a long download holds no read snapshot open
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(header)
+        last_id = 0
+        while True:
+            conn = db_pool.acquire()
+            try:
+                rows = conn.execute(statement, args + [last_id, EXPORT_BATCH_SIZE]).fetchall()
+            finally:
+                db_pool.release(conn)
+            for row in rows:
+                writer.writerow([csv_cell(value) for value in row])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            if len(rows) < EXPORT_BATCH_SIZE:
+                break
+            last_id = rows[-1]['id']
+
+    response = app.response_class(generate(), mimetype='text/csv')
+    response.headers['Content-Disposition'] = f'attachment; filename=ideabridge-{kind}.csv'
+    return response
+
+@app.route('/admin/queue-stats')
+@role_required(['admin'])
+def admin_queue_stats():
+    """Notification queue depth and delivery counters"""
+    return notification_queue.stats()
+
+@app.route('/admin/cache-stats')
+@role_required(['admin'])
+def admin_cache_stats():
+    """Page cache hit/miss counters"""
+    return page_cache.stats()
+
+@app.route('/admin/login-stats')
+@role_required(['admin'])
+def admin_login_stats():
+    """Password hashing pool and failed-login limiter state"""
+    return {'hasher': hasher.stats(), 'per_ip': ip_attempts.stats(), 'per_user': user_attempts.stats()}
+
+@app.route('/admin/purge-stats')
+@role_required(['admin'])
+def admin_purge_stats():
+    """Pending and finished purge jobs"""
+    return purger.stats()
+
+@app.route('/admin/trending-stats')
+@role_required(['admin'])
+def admin_trending_stats():
+    """Trending score refreshes and rebuilds"""
+    return trending.stats()
+
+@app.route('/admin/view-stats')
+@role_required(['admin'])
+def admin_view_stats():
+    """Buffered and flushed pitch views in this worker"""
+    return view_counter.stats()
+
+@app.route('/admin/write-stats')
+@role_required(['admin'])
+def admin_write_stats():
+    """Group commit batches of execute_db() writes in this worker"""
+    return group_commit.stats()
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape target; 404 unless METRICS=1, bearer token if METRICS_TOKEN is set"""
+    if not METRICS_ENABLED:
+        abort(404)
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        abort(401)
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/profile', methods=['GET', 'POST'])
+@role_required(['admin'])
+def admin_profile():
+    """Start/stop/reset the sampling profiler (POST action=...), or download folded stacks"""
+    if not METRICS_ENABLED:
+        abort(404)
+    if request.method == 'POST':
+        action = request.form.get('action')
+        if action == 'start':
+            profiler.start()
+        elif action == 'stop':
+            profiler.stop()
+        elif action == 'reset':
+            profiler.reset()
+        else:
+            return {'error': 'action must be start, stop or reset'}, 400
+        return {'running': profiler.running, 'samples': profiler.sample_count()}
+    response = app.response_class(profiler.folded(request.args.get('endpoint')), mimetype='text/plain')
+    response.headers['Content-Disposition'] = 'attachment; filename=ideabridge-profile.folded'
+    return response
+
 def ping_self():
     while True:
         try:
@@ -495,14 +1491,5 @@ def ping_self():
         time.sleep(600)  # Ping every 10 minutes
 
 if __name__ == '__main__':
-    if not os.path.exists(DB_PATH):
-        from init_db import init_db
-        init_db(DB_PATH)
-    # Add notifications table if it doesn't exist (for existing databases)
-    try:
-        from add_notifications import add_notifications_table
-        add_notifications_table(DB_PATH)
-    except Exception as e:
-        print(f"Note: Could not add notifications table: {e}")
     threading.Thread(target=ping_self, daemon=True).start()
     app.run(host="0.0.0.0", port=5000)
@@ -0,0 +1,246 @@
+"""CSS/JS bundles: minified, fingerprinted and precompressed at build time.
+
+Usage: python assets.py [static_dir]
+
+Each bundle in BUNDLES is the concatenation of some files under static/. The
+build minifies it, writes it to static/dist/ as <name>.<hash>.<ext> together
+with .gz and (when the brotli package is installed) .br copies, and records
+the names in static/dist/manifest.json. Templates link bundles with
+asset_url('base.css'); the app serves the fingerprinted files with
+Content-Encoding negotiation and a one-year immutable Cache-Control, so a
+repeat visit does not even revalidate them. The files of the previous build
+are kept, for pages rendered before a deploy.
+
+Without a build (or for a bundle whose sources changed since), asset_url()
+points at the bundle's plain name and the app concatenates the sources on
+each request, uncached, so editing a stylesheet needs no rebuild locally.
+The minifiers are deliberately conservative: comments and whitespace only.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import re
+import sys
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+BUILD_DIR = 'dist'
+MANIFEST = 'manifest.json'
+
+# Bundle name -> source files under static/, in order
+BUNDLES = {
+    'base.css': ['style.css'],
+    'base.js': ['js/script.js'],
+    'index.css': ['animations.css', 'css/index.css'],
+    'index.js': ['animations.js'],
+    'admin.css': ['css/admin.css'],
+}
+
+MIMETYPES = {'.css': 'text/css', '.js': 'text/javascript'}
+
+# (Content-Encoding, file suffix), most preferred first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+CSS_TOKENS = re.compile(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')|/\*.*?\*/|(\s+)''', re.S)
+
+def minify_css(text):
+    """Drop comments and collapse whitespace, leaving strings alone"""
+    def replace(match):
+        if match.group(1):
+            return match.group(1)
+        return ' ' if match.group(2) else ''
+    text = CSS_TOKENS.sub(replace, text)
+    # No space is needed around these outside strings (": " only after a property name,
+    # since "a :hover" differs from "a:hover")
+    parts = re.split(r'''("(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')''', text)
+    for i in range(0, len(parts), 2):
+        part = re.sub(r'\s*([{};,>])\s*', r'\1', parts[i])
+        part = re.sub(r'(\{|;)([\w-]+):\s+', r'\1\2:', part)
+        parts[i] = part.replace(';}', '}')
+    return ''.join(parts).strip() + '\n'
+
+# A "/" after one of these (or at the start) begins a regex literal, not a division
+REGEX_PRECEDERS = set('(,=:[!&|?{};+-*%<>~^')
+REGEX_KEYWORDS = ('return', 'typeof', 'case', 'do', 'else', 'in', 'of', 'new', 'delete', 'void', 'throw')
+
+def minify_js(text):
+    """Drop comments, indentation and blank lines; line breaks stay, so semicolon insertion is unchanged"""
+    code, pieces = [], []  # pieces: code with comments removed, and literals kept verbatim
+
+    def literal(piece):
+        pieces.append((False, ''.join(code)))
+        pieces.append((True, piece))
+        code.clear()
+
+    i, n = 0, len(text)
+    last = ''  # last significant character or word
+    while i < n:
+        ch = text[i]
+        if ch in '"\'`':
+            end = i + 1
+            while end < n and text[end] != ch:
+                end += 2 if text[end] == '\\' else 1
+            literal(text[i:end + 1])
+            i, last = end + 1, ch
+        elif text.startswith('//', i):
+            while i < n and text[i] != '\n':
+                i += 1
+        elif text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = n if end < 0 else end + 2
+            code.append(' ')
+        elif ch == '/' and (not last or last in REGEX_PRECEDERS or last in REGEX_KEYWORDS):
+            end, in_class = i + 1, False
+            while end < n and text[end] != '\n' and (text[end] != '/' or in_class):
+                if text[end] == '\\':
+                    end += 1
+                elif text[end] == '[':
+                    in_class = True
+                elif text[end] == ']':
+                    in_class = False
+                end += 1
+            while end + 1 < n and text[end + 1].isalpha():
+                end += 1
+            literal(text[i:end + 1])
+            i, last = end + 1, '/'
+        elif ch.isalnum() or ch in '_$':
+            end = i
+            while end < n and (text[end].isalnum() or text[end] in '_$'):
+                end += 1
+            code.append(text[i:end])
+            i, last = end, text[i:end]
+        else:
+            code.append(ch)
+            if not ch.isspace():
+                last = ch
+            i += 1
+    pieces.append((False, ''.join(code)))
+    out = []
+    for verbatim, piece in pieces:
+        if not verbatim:
+            piece = re.sub(r'[ \t]+', ' ', re.sub(r'\s*\n\s*', '\n', piece))
+        out.append(piece)
+    return ''.join(out).strip() + '\n'
+
+def minify(name, text):
+    return minify_css(text) if name.endswith('.css') else minify_js(text)
+
+def source_paths(static_dir, name):
+    return [os.path.join(static_dir, source) for source in BUNDLES[name]]
+
+def bundle_source(static_dir, name):
+    """The unminified bundle: its sources joined in order"""
+    parts = []
+    for path in source_paths(static_dir, name):
+        with open(path, encoding='utf-8') as f:
+            parts.append(f.read())
+    # A source ending without a semicolon must not run into the next one
+    return ('\n;\n' if name.endswith('.js') else '\n').join(parts)
+
+def sources_mtime(static_dir, name):
+    return max(os.path.getmtime(path) for path in source_paths(static_dir, name))
+
+def read_manifest(static_dir):
+    try:
+        with open(os.path.join(static_dir, BUILD_DIR, MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def write_atomic(path, data):
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.tmp', path)
+
+def build(static_dir=STATIC_DIR):
+    """Write every bundle and the manifest; returns {name: (source, minified, gzip, brotli or None) sizes}"""
+    build_dir = os.path.join(static_dir, BUILD_DIR)
+    os.makedirs(build_dir, exist_ok=True)
+    if brotli is None:
+        logger.warning('brotli is not installed (it is in requirements.txt); writing gzip copies only')
+    previous = read_manifest(static_dir)
+    manifest, sizes = {}, {}
+    for name in BUNDLES:
+        source = bundle_source(static_dir, name).encode('utf-8')
+        data = minify(name, source.decode('utf-8')).encode('utf-8')
+        stem, ext = os.path.splitext(name)
+        filename = f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+        path = os.path.join(build_dir, filename)
+        write_atomic(path, data)
+        # mtime=0 keeps the gzip bytes identical from build to build
+        compressed = {'gzip': gzip.compress(data, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed['br'] = brotli.compress(data, quality=11)
+        for encoding, suffix in ENCODINGS:
+            if encoding in compressed:
+                write_atomic(path + suffix, compressed[encoding])
+        manifest[name] = {'file': filename, 'encodings': sorted(compressed),
+                          'sources_mtime': sources_mtime(static_dir, name)}
+        sizes[name] = (len(source), len(data), len(compressed['gzip']),
+                       len(compressed['br']) if 'br' in compressed else None)
+    write_atomic(os.path.join(build_dir, MANIFEST), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    # Keep this build and the previous one
+    keep = {entry['file'] for entry in list(manifest.values()) + list(previous.values())}
+    for filename in os.listdir(build_dir):
+        if filename != MANIFEST and filename.split('.gz')[0].split('.br')[0] not in keep:
+            os.remove(os.path.join(build_dir, filename))
+    return sizes
+
+class Assets:
+    """Resolves bundle names to the built files, and asset requests to files to send"""
+
+    def __init__(self, static_dir=STATIC_DIR):
+        self.static_dir = static_dir
+        self.build_dir = os.path.join(static_dir, BUILD_DIR)
+        self.built = {}
+        for name, entry in read_manifest(static_dir).items():
+            if name not in BUNDLES:
+                continue
+            if sources_mtime(static_dir, name) > entry['sources_mtime']:
+                logger.warning('%s changed since the last build; serving it unminified (run python assets.py)', name)
+                continue
+            self.built[name] = entry
+        self.by_file = {entry['file']: entry for entry in self.built.values()}
+
+    def filename(self, name):
+        """What to request for a bundle: its fingerprinted file if built, else its plain name"""
+        entry = self.built.get(name)
+        return entry['file'] if entry else name
+
+    def find(self, filename, accepts):
+        """(path, Content-Encoding or None, mimetype) of a built file, choosing the best encoding
+        `accepts(encoding)` allows; None if filename is not a built bundle"""
+        entry = self.by_file.get(filename)
+        if entry is None:
+            return None
+        path = os.path.join(self.build_dir, filename)
+        mimetype = MIMETYPES[os.path.splitext(filename)[1]]
+        for encoding, suffix in ENCODINGS:
+            if encoding in entry['encodings'] and accepts(encoding):
+                return path + suffix, encoding, mimetype
+        return path, None, mimetype
+
+    def source(self, name):
+        """(text, mimetype) of an unbuilt bundle, or None if there is no such bundle"""
+        if name not in BUNDLES:
+            return None
+        return bundle_source(self.static_dir, name), MIMETYPES[os.path.splitext(name)[1]]
+
+def build_assets(static_dir=STATIC_DIR):
+    """Build every bundle and print the sizes"""
+    sizes = build(static_dir)
+    for name, (source, minified, gzipped, brotlied) in sizes.items():
+        br = f', brotli {brotlied:,}' if brotlied is not None else ''
+        print(f'{name:<10} {source:>8,} bytes -> minified {minified:,}, gzip {gzipped:,}{br}')
+    print(f'Manifest written to {os.path.join(static_dir, BUILD_DIR, MANIFEST)}')
+
+if __name__ == '__main__':
+    build_assets(sys.argv[1] if len(sys.argv) > 1 else STATIC_DIR)
@@ -0,0 +1,127 @@
+"""Concurrent readers against writers on the main pitch routes.
+
+Usage: python benchmarks/bench_concurrency.py [--readers 8] [--writers 4] [--seconds 10]
+                                              [--app-dir PATH]
+
+Reader threads fetch / and /pitch/<id> while writer threads toggle likes on
+/pitch/<id>/like, all through the Flask test client against a seeded temporary
+database. Prints throughput and p50/p99 latency per route; --readers 0
+--writers 1 measures like throughput on a single worker thread. Point --app-dir
+at another checkout (e.g. a `git worktree` of an older commit) to get the
+"before" numbers.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+def seed(db_path, users=200, pitches=2000, likes=20000):
+    from init_db import init_db
+    init_db(db_path)
+    rng = random.Random(42)
+    conn = sqlite3.connect(db_path)
+    start = datetime(2025, 1, 1)
+    conn.executemany('INSERT INTO users (username, password_hash, role, created_at) VALUES (?, ?, ?, ?)',
+                     [(f'user{i}', 'x', 'user', start.isoformat()) for i in range(users)])
+    user_ids = [row[0] for row in conn.execute('SELECT id FROM users')]
+    conn.executemany('''INSERT INTO pitches (title, summary, content, category, author_id, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?)''',
+                     [(f'Pitch {i}', f'Summary {i}', 'Body text ' * 200, 'technology',
+                       rng.choice(user_ids), (start + timedelta(minutes=i)).isoformat())
+                      for i in range(pitches)])
+    pitch_ids = [row[0] for row in conn.execute('SELECT id FROM pitches')]
+    conn.executemany('INSERT OR IGNORE INTO likes (pitch_id, user_id, created_at) VALUES (?, ?, ?)',
+                     [(rng.choice(pitch_ids), rng.choice(user_ids), start.isoformat()) for _ in range(likes)])
+    conn.commit()
+    conn.close()
+    return user_ids, pitch_ids
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--app-dir', default=os.path.join(os.path.dirname(__file__), '..'))
+    args = parser.parse_args()
+
+    sys.path.insert(0, os.path.abspath(args.app_dir))
+    tmp = tempfile.mkdtemp()
+    db_path = os.path.join(tmp, 'bench.db')
+    user_ids, pitch_ids = seed(db_path)
+    os.environ['DB_PATH'] = db_path
+
+    import app as app_module
+    app_module.DB_PATH = db_path  # older trees read the module global per request
+    flask_app = app_module.app
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+
+    def record(route, response_or_error, started):
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            if isinstance(response_or_error, Exception) or response_or_error.status_code >= 500:
+                errors[route] += 1
+            else:
+                latencies[route].append(elapsed)
+
+    def reader(seed_value):
+        rng = random.Random(seed_value)
+        client = flask_app.test_client()
+        while time.perf_counter() < deadline:
+            route, url = rng.choice([('/', '/'), ('/pitch/<id>', f'/pitch/{rng.choice(pitch_ids)}')])
+            started = time.perf_counter()
+            try:
+                response = client.get(url)
+            except Exception as exc:
+                response = exc
+            record(route, response, started)
+
+    def writer(seed_value):
+        rng = random.Random(seed_value)
+        client = flask_app.test_client()
+        with client.session_transaction() as sess:
+            sess['user_id'] = rng.choice(user_ids)
+            sess['username'] = 'bench'
+            sess['role'] = 'user'
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                response = client.post(f'/pitch/{rng.choice(pitch_ids)}/like')
+            except Exception as exc:
+                response = exc
+            record('/pitch/<id>/like', response, started)
+
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+    threads += [threading.Thread(target=writer, args=(1000 + i,)) for i in range(args.writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    print(f'{args.readers} readers, {args.writers} writers, {args.seconds:.0f}s')
+    print(f"{'route':<20} {'requests':>9} {'req/s':>8} {'errors':>7} {'p50 ms':>8} {'p99 ms':>8} {'mean ms':>8}")
+    for route in ('/', '/pitch/<id>', '/pitch/<id>/like'):
+        samples = latencies[route]
+        if not samples:
+            print(f'{route:<20} {0:>9} {0:>8} {errors[route]:>7}')
+            continue
+        print(f'{route:<20} {len(samples):>9} {len(samples) / args.seconds:>8.1f} {errors[route]:>7} '
+              f'{percentile(samples, 50):>8.1f} '
+              f'{percentile(samples, 99):>8.1f} {statistics.mean(samples):>8.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Write throughput of one transaction per write against group commits.
+
+Usage: python benchmarks/bench_group_commit.py [--writers 1,8,32] [--seconds 5]
+                                               [--synchronous NORMAL,FULL]
+
+Each writer thread inserts comments (with their counter triggers) as fast as
+it can into a fresh temporary database, either each in its own transaction on
+the pool's write connection (what execute_db() did before) or through a
+GroupCommitter (what it does now). Prints writes per second, p50/p99 latency
+and the mean number of writes per commit. synchronous=FULL makes every commit
+an fsync, which is where sharing commits pays the most.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+INSERT_COMMENT = 'INSERT INTO comments (pitch_id, user_id, content, created_at) VALUES (?, ?, ?, ?)'
+
+def seed(db_path):
+    """A new database with one user and one pitch to comment on"""
+    import sqlite3
+    from init_db import init_db
+    init_db(db_path)
+    conn = sqlite3.connect(db_path)
+    now = datetime.utcnow().isoformat()
+    conn.execute("INSERT INTO users (username, password_hash, role, created_at) VALUES ('bench', 'x', 'user', ?)",
+                 [now])
+    conn.execute("INSERT INTO pitches (title, content, author_id, created_at) VALUES ('Bench', 'Body', 1, ?)", [now])
+    conn.commit()
+    conn.close()
+
+def percentile(samples, pct):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+def run(mode, writers, seconds, synchronous):
+    """(writes, per-write latencies in ms, commits) for one configuration"""
+    from db import ConnectionPool, GroupCommitter
+    db_path = os.path.join(tempfile.mkdtemp(), 'writes.db')
+    seed(db_path)
+    pool = ConnectionPool(db_path, synchronous=synchronous)
+    committer = GroupCommitter(pool)
+    args = [1, 1, 'Benchmark comment', datetime.utcnow().isoformat()]
+
+    def direct():
+        with pool.writer() as conn:
+            conn.execute(INSERT_COMMENT, args)
+
+    def grouped():
+        committer.execute(INSERT_COMMENT, args)
+
+    write = grouped if mode == 'group' else direct
+    latencies = [[] for _ in range(writers)]
+    deadline = time.perf_counter() + seconds
+
+    def writer(samples):
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            write()
+            samples.append((time.perf_counter() - started) * 1000)
+
+    threads = [threading.Thread(target=writer, args=(samples,)) for samples in latencies]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    committer.stop()
+    pool.close()
+    samples = [ms for thread_samples in latencies for ms in thread_samples]
+    commits = committer.stats()['batches'] if mode == 'group' else len(samples)
+    return len(samples), samples, commits
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', default='1,8,32', help='comma-separated thread counts')
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--synchronous', default='NORMAL,FULL', help='comma-separated PRAGMA synchronous values')
+    args = parser.parse_args()
+
+    print(f"{'synchronous':<12} {'writers':>7} {'mode':<8} {'writes/s':>10} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'per commit':>10}")
+    for synchronous in args.synchronous.split(','):
+        for writers in [int(n) for n in args.writers.split(',')]:
+            for mode in ('direct', 'group'):
+                writes, samples, commits = run(mode, writers, args.seconds, synchronous)
+                print(f'{synchronous:<12} {writers:>7} {mode:<8} {writes / args.seconds:>10.0f} '
+                      f'{percentile(samples, 50):>8.2f} {percentile(samples, 99):>8.2f} '
+                      f'{writes / max(commits, 1):>10.1f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Compare the old LIKE '%q%' search with the FTS5 index.
+
+Usage: python benchmarks/bench_search.py [sizes...]   (default: 10000 100000 1000000)
+
+Each size gets a fresh database in a temporary directory, filled with synthetic
+pitches, and both search paths run the same set of queries.
+"""
+import itertools
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from search_index import create_search_index
+
+WORDS = ('market platform users revenue growth climate health fintech saas mobile '
+         'data cloud energy solar water farm retail logistics supply chain robot '
+         'learning student teacher clinic patient payment wallet crypto carbon '
+         'travel food delivery kitchen fitness music video game social network '
+         'privacy security analytics marketplace subscription hardware sensor').split()
+SYLLABLES = 'ka lo mi ne ru sa ti vo ze bra cle dri fro glu pla qui sto tra wen'.split()
+CATEGORIES = ['technology', 'healthcare', 'education', 'finance', 'environment', 'retail']
+QUERIES = ['solar', 'supply chain', 'health clinic', 'crypto wallet', 'deliv', 'robot learning']
+
+LIKE_SQL = '''SELECT p.id, p.title FROM pitches p JOIN users u ON p.author_id = u.id
+              WHERE p.title LIKE ? OR p.content LIKE ?
+              ORDER BY p.created_at DESC LIMIT 13'''
+
+FTS_SQL = '''SELECT p.id, p.title, snippet(pitches_fts, -1, '[', ']', '…', 16)
+             FROM pitches_fts
+             JOIN pitches p ON p.id = pitches_fts.rowid
+             JOIN users u ON p.author_id = u.id
+             WHERE pitches_fts MATCH ? AND rank MATCH 'bm25(10.0, 5.0, 1.0, 4.0, 2.0)'
+             ORDER BY rank LIMIT 13'''
+
+def vocabulary(rng, size=20000):
+    """Pseudo-words with Zipf-like frequencies; the domain words sit at mid ranks"""
+    words = [''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(size)]
+    for word in WORDS:
+        words.insert(rng.randint(200, 5000), word)
+    return words, list(itertools.accumulate(1.0 / rank for rank in range(1, len(words) + 1)))
+
+def text(rng, vocab, n):
+    words, cum_weights = vocab
+    return ' '.join(rng.choices(words, cum_weights=cum_weights, k=n))
+
+def build_db(path, size):
+    rng = random.Random(size)
+    vocab = vocabulary(rng)
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    c.execute('CREATE TABLE users (id INTEGER PRIMARY KEY, username TEXT)')
+    c.execute('''CREATE TABLE pitches (id INTEGER PRIMARY KEY, title TEXT, summary TEXT, content TEXT,
+                 category TEXT, tags TEXT, author_id INTEGER, created_at TEXT)''')
+    create_search_index(c)
+    c.executemany('INSERT INTO users (id, username) VALUES (?, ?)', [(i, f'user{i}') for i in range(1, 1001)])
+    batch = []
+    for i in range(1, size + 1):
+        batch.append((text(rng, vocab, 6), text(rng, vocab, 15), text(rng, vocab, 120), rng.choice(CATEGORIES),
+                      ','.join(rng.sample(WORDS, 3)), rng.randint(1, 1000), f'2025-01-01T00:00:{i:09d}'))
+        if len(batch) == 10000:
+            c.executemany('''INSERT INTO pitches (title, summary, content, category, tags, author_id, created_at)
+                             VALUES (?, ?, ?, ?, ?, ?, ?)''', batch)
+            batch = []
+    if batch:
+        c.executemany('''INSERT INTO pitches (title, summary, content, category, tags, author_id, created_at)
+                         VALUES (?, ?, ?, ?, ?, ?, ?)''', batch)
+    c.execute("INSERT INTO pitches_fts(pitches_fts) VALUES ('optimize')")
+    conn.commit()
+    return conn
+
+def timed(conn, sql, args, repeat=3):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        conn.execute(sql, args).fetchall()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def main(sizes):
+    print(f"{'pitches':>10} {'query':>16} {'LIKE ms':>10} {'FTS5 ms':>10} {'speedup':>9}")
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            conn = build_db(os.path.join(tmp, 'bench.db'), size)
+            for query in QUERIES:
+                like = timed(conn, LIKE_SQL, ['%' + query + '%'] * 2)
+                match = ' '.join('"%s"*' % word for word in query.split())
+                fts = timed(conn, FTS_SQL, [match])
+                print(f'{size:>10} {query:>16} {like:>10.2f} {fts:>10.2f} {like / fts:>8.1f}x')
+            conn.close()
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or [10000, 100000, 1000000])
@@ -0,0 +1,159 @@
+"""Thousands of idle /notifications/stream subscribers on a single gevent worker.
+
+Usage: python benchmarks/bench_sse.py [--subscribers 5000] [--users 200] [--idle 10]
+                                      [--heartbeat 15]
+
+Starts the app under gevent's WSGI server (what `gunicorn --worker-class gevent`
+runs) in a subprocess, opens --subscribers event streams spread over --users
+logged-in users, then reports the server's memory and CPU while they sit idle
+and how long one message per user takes to reach every open stream.
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+APP_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+SERVER = '''
+from gevent import monkey; monkey.patch_all()
+import sys
+from gevent.pywsgi import WSGIServer
+from app import app
+WSGIServer(('127.0.0.1', int(sys.argv[1])), app, log=None).serve_forever()
+'''
+
+def seed(db_path, users):
+    from init_db import init_db
+    import sqlite3
+    init_db(db_path)
+    conn = sqlite3.connect(db_path)
+    conn.executemany('INSERT INTO users (username, password_hash, role, created_at) VALUES (?, ?, ?, ?)',
+                     [(f'sse{i}', 'x', 'user', '2025-01-01T00:00:00') for i in range(users)])
+    conn.commit()
+    user_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE username LIKE 'sse%' ORDER BY id")]
+    conn.close()
+    return user_ids
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def proc_stats(pid):
+    """(RSS in MiB, CPU seconds) of a process, from /proc"""
+    with open(f'/proc/{pid}/status') as f:
+        rss = next(int(line.split()[1]) for line in f if line.startswith('VmRSS')) / 1024
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    return rss, cpu
+
+class Subscriber:
+    def __init__(self, user_id, cookie):
+        self.user_id = user_id
+        self.cookie = cookie
+        self.connected = asyncio.Event()
+        self.message_at = None
+        self.got_message = asyncio.Event()
+
+    async def run(self, port):
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write((f'GET /notifications/stream HTTP/1.1\r\nHost: localhost\r\n'
+                      f'Accept: text/event-stream\r\nCookie: session={self.cookie}\r\n\r\n').encode())
+        await writer.drain()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.startswith(b'event: counts'):
+                    self.connected.set()
+                elif line.startswith(b'event: message'):
+                    self.message_at = time.perf_counter()
+                    self.got_message.set()
+        finally:
+            writer.close()
+
+def send(port, cookie, receiver_id):
+    import urllib.request
+    request = urllib.request.Request(f'http://127.0.0.1:{port}/message/send/{receiver_id}',
+                                     data=b'subject=Bench&content=Hello', method='POST',
+                                     headers={'Cookie': f'session={cookie}'})
+    urllib.request.urlopen(request).read()
+
+async def run(args, port, cookies, user_ids, server):
+    # The last user only sends; everyone else listens
+    listeners = len(user_ids) - 1
+    subscribers = [Subscriber(user_ids[i % listeners], cookies[i % listeners]) for i in range(args.subscribers)]
+    rss_before, _ = proc_stats(server.pid)
+    started = time.perf_counter()
+    tasks = []
+    for start in range(0, len(subscribers), 500):
+        batch = subscribers[start:start + 500]
+        tasks += [asyncio.create_task(subscriber.run(port)) for subscriber in batch]
+        await asyncio.gather(*(subscriber.connected.wait() for subscriber in batch))
+    connect_seconds = time.perf_counter() - started
+
+    rss_connected, cpu_start = proc_stats(server.pid)
+    await asyncio.sleep(args.idle)
+    rss_idle, cpu_end = proc_stats(server.pid)
+
+    # One message per user, sent by a user with no open streams
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    await asyncio.gather(*(loop.run_in_executor(None, send, port, cookies[-1], user_id)
+                           for user_id in user_ids[:-1]))
+    targets = subscribers
+    await asyncio.wait_for(asyncio.gather(*(subscriber.got_message.wait() for subscriber in targets)), 60)
+    latencies = sorted((subscriber.message_at - started) * 1000 for subscriber in targets)
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    print(f'{args.subscribers} subscribers over {listeners} users, heartbeat {args.heartbeat:.0f}s')
+    print(f'connect all:        {connect_seconds:8.2f} s')
+    print(f'server RSS:         {rss_before:8.1f} MiB before, {rss_connected:.1f} MiB connected, '
+          f'{(rss_connected - rss_before) * 1024 / args.subscribers:.1f} KiB per stream')
+    print(f'idle CPU:           {(cpu_end - cpu_start) / args.idle * 100:8.1f} % of one core over {args.idle:.0f}s')
+    print(f'fan-out ({len(targets)} streams): p50 {latencies[len(latencies) // 2]:.1f} ms, '
+          f'p99 {latencies[int(len(latencies) * 0.99)]:.1f} ms, last {latencies[-1]:.1f} ms')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--subscribers', type=int, default=5000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--idle', type=float, default=10)
+    parser.add_argument('--heartbeat', type=float, default=15)
+    args = parser.parse_args()
+
+    sys.path.insert(0, APP_DIR)
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    user_ids = seed(db_path, args.users + 1)
+    env = dict(os.environ, DB_PATH=db_path, STREAM_HEARTBEAT_SECONDS=str(args.heartbeat))
+    os.environ['DB_PATH'] = db_path
+    from app import app
+    serializer = app.session_interface.get_signing_serializer(app)
+    cookies = [serializer.dumps({'user_id': user_id, 'username': f'sse{i}'}) for i, user_id in enumerate(user_ids)]
+
+    port = free_port()
+    server = subprocess.Popen([sys.executable, '-c', SERVER, str(port)], cwd=APP_DIR, env=env)
+    try:
+        for _ in range(100):
+            try:
+                socket.create_connection(('127.0.0.1', port)).close()
+                break
+            except OSError:
+                time.sleep(0.1)
+        asyncio.run(run(args, port, cookies, user_ids, server))
+    finally:
+        server.terminate()
+        server.wait()
+
+if __name__ == '__main__':
+    main()
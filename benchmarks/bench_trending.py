@@ -0,0 +1,99 @@
+"""Cost of rebuilding and incrementally refreshing the trending scores.
+
+Usage: python benchmarks/bench_trending.py path/to/bench.db [--new 100,1000,10000] [--repeat 3]
+
+Works on a copy of a database made by benchmarks/generate_data.py (the default
+there is 1M likes and 200k comments). Measures a full rebuild, which reads
+every pitch, like and comment; refresh() after --new interactions have been
+added since the last one, which is what the scheduler pays each interval; a
+refresh with nothing new; and reading one page of the hot listing, which is
+all a request pays.
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+def timed(function, repeat):
+    """Median milliseconds of `repeat` calls, and the last result"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples), result
+
+def add_interactions(conn, count, rng, users, pitches):
+    """Insert `count` likes and comments (4:1) on random pitches, committed"""
+    now = datetime.utcnow().isoformat()
+    likes = [(rng.choice(pitches), rng.choice(users), now) for _ in range(count * 4 // 5)]
+    conn.executemany('INSERT OR IGNORE INTO likes (pitch_id, user_id, created_at) VALUES (?, ?, ?)', likes)
+    conn.executemany('INSERT INTO comments (pitch_id, user_id, content, created_at) VALUES (?, ?, ?, ?)',
+                     [(rng.choice(pitches), rng.choice(users), 'Benchmark comment', now)
+                      for _ in range(count - len(likes))])
+    conn.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('db_path')
+    parser.add_argument('--new', default='100,1000,10000', help='comma-separated interaction counts')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    from migrations import migrate
+    import trending
+
+    db_path = os.path.join(tempfile.mkdtemp(), 'trending.db')
+    shutil.copyfile(args.db_path, db_path)
+    migrate(db_path)
+    conn = sqlite3.connect(db_path)
+    sizes = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+             for table in ('pitches', 'likes', 'comments')}
+    print(', '.join(f'{count:,} {table}' for table, count in sizes.items()))
+
+    def rebuild():
+        count = trending.rebuild(conn)
+        conn.commit()
+        return count
+    ms, count = timed(rebuild, args.repeat)
+    print(f'{"full rebuild":<28} {ms:10.1f} ms  ({count:,} pitches scored)')
+
+    rng = random.Random(7)
+    users = [row[0] for row in conn.execute('SELECT id FROM users')]
+    pitches = [row[0] for row in conn.execute('SELECT id FROM pitches')]
+    for count in [int(n) for n in args.new.split(',')]:
+        samples = []
+        for _ in range(args.repeat):
+            add_interactions(conn, count, rng, users, pitches)
+            started = time.perf_counter()
+            more = True
+            while more:
+                _, more = trending.refresh(conn, batch_size=max(count, 10000))
+            conn.commit()
+            samples.append((time.perf_counter() - started) * 1000)
+        print(f'{f"refresh, {count:,} new rows":<28} {statistics.median(samples):10.1f} ms')
+
+    def idle():
+        result = trending.refresh(conn)
+        conn.commit()
+        return result
+    ms, _ = timed(idle, args.repeat)
+    print(f'{"refresh, nothing new":<28} {ms:10.3f} ms')
+
+    def hot_page():
+        return conn.execute('''SELECT p.id, p.title FROM pitch_scores s CROSS JOIN pitches p ON p.id = s.pitch_id
+                               ORDER BY s.score DESC, s.pitch_id DESC LIMIT 13''').fetchall()
+    ms, _ = timed(hot_page, max(args.repeat, 100))
+    print(f'{"hot page read":<28} {ms:10.3f} ms')
+    conn.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""Fill a fresh database with synthetic users, pitches and interactions at scale.
+
+Usage: python benchmarks/generate_data.py path/to/bench.db [--users 20000] [--pitches 50000]
+           [--likes 1000000] [--comments 200000] [--messages 200000]
+           [--notifications 500000] [--seed 42]
+
+Activity is skewed the way it is on a live site: a few authors write most
+pitches, a few pitches get most likes and comments (Zipf-like weights), and
+the most active users send most messages. The same --seed gives the same
+database, so runs on different commits are comparable.
+
+Rows are loaded with executemany in one transaction, with the triggers and
+secondary indexes dropped for the load and recreated afterwards; the counters,
+search index, conversations, facets and upload refcounts are then rebuilt in bulk. Every
+user's password is PASSWORD.
+"""
+import argparse
+import itertools
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+PASSWORD = 'bench-password'
+
+WORDS = ('market platform users revenue growth climate health fintech saas mobile '
+         'data cloud energy solar water farm retail logistics supply chain robot '
+         'learning student teacher clinic patient payment wallet crypto carbon '
+         'travel food delivery kitchen fitness music video game social network '
+         'privacy security analytics marketplace subscription hardware sensor').split()
+CATEGORIES = ['technology', 'healthcare', 'education', 'finance', 'environment', 'retail']
+STAGES = ['idea', 'prototype', 'mvp', 'growth']
+NOTIFICATION_TYPES = ['like', 'comment', 'message']
+
+# Everything happens within this window
+START = datetime(2024, 1, 1)
+SPAN_SECONDS = 365 * 24 * 3600
+
+def zipf_weights(n, s=1.1):
+    """Cumulative weights for picking one of n items with a Zipf-like skew (item 0 most popular)"""
+    return list(itertools.accumulate(1.0 / (rank + 1) ** s for rank in range(n)))
+
+def spread(total, n, rng, s=1.1, cap=None):
+    """Split total into n skewed parts of at most cap, shuffled so popularity is not tied to id"""
+    if cap is not None:
+        total = min(total, n * cap)
+    weights = [1.0 / (rank + 1) ** s for rank in range(n)]
+    scale = total / sum(weights)
+    parts = [int(weight * scale) for weight in weights]
+    if cap is not None:
+        parts = [min(part, cap) for part in parts]
+    # Hand what rounding and the cap left over to the most popular parts with room
+    remaining = total - sum(parts)
+    i = 0
+    while remaining > 0:
+        if cap is None or parts[i % n] < cap:
+            parts[i % n] += 1
+            remaining -= 1
+        i += 1
+    rng.shuffle(parts)
+    return parts
+
+def offset(rng, after=0):
+    """Seconds into the window, no earlier than `after`"""
+    return rng.randint(after, SPAN_SECONDS)
+
+def iso(seconds):
+    return (START + timedelta(seconds=seconds)).isoformat()
+
+def timestamp(rng, after=0):
+    """An ISO timestamp in the window, no earlier than `after` seconds into it"""
+    return iso(offset(rng, after))
+
+def sentence(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+def drop_triggers_and_indexes(conn):
+    """Drop every trigger and secondary index; returns the SQL to recreate them"""
+    saved = conn.execute('''SELECT type, name, sql FROM sqlite_master
+                            WHERE type IN ('trigger', 'index') AND sql IS NOT NULL''').fetchall()
+    for kind, name, _ in saved:
+        conn.execute(f'DROP {kind.upper()} IF EXISTS {name}')
+    return [sql for _, _, sql in saved]
+
+def generate(db_path, users=20000, pitches=50000, likes=1000000, comments=200000,
+             messages=200000, notifications=500000, seed=42):
+    from werkzeug.security import generate_password_hash
+    from conversations import rebuild
+    from counters import reconcile
+    from facets import rebuild as rebuild_facets
+    from init_db import init_db
+    from uploads import recount
+
+    if os.path.exists(db_path):
+        sys.exit(f'{db_path} already exists; generate into a new file')
+    init_db(db_path)
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute('PRAGMA synchronous = OFF')
+    conn.execute('PRAGMA cache_size = -262144')
+    conn.execute('BEGIN')
+    recreate = drop_triggers_and_indexes(conn)
+    timings = {}
+
+    def load(table, sql, rows):
+        started = time.perf_counter()
+        conn.executemany(sql, rows)
+        timings[table] = time.perf_counter() - started
+
+    first_user = conn.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM users').fetchone()[0]
+    password_hash = generate_password_hash(PASSWORD)
+    user_created = [offset(rng) for _ in range(users)]
+    load('users', 'INSERT INTO users (id, username, password_hash, role, created_at) VALUES (?, ?, ?, ?, ?)',
+         ((first_user + i, f'user{i}', password_hash, 'verified' if i % 20 == 0 else 'user',
+           iso(user_created[i]))
+          for i in range(users)))
+    user_ids = range(first_user, first_user + users)
+    # The same users are the busiest everywhere: index 0 is the most active
+    user_weights = zipf_weights(users, s=0.9)
+
+    def active_user():
+        return user_ids[rng.choices(range(users), cum_weights=user_weights)[0]]
+
+    pitch_authors = [active_user() for _ in range(pitches)]
+    pitch_created = [offset(rng, user_created[author - first_user]) for author in pitch_authors]
+    load('pitches', '''INSERT INTO pitches (id, title, summary, content, category, tags, funding_goal, stage,
+                                            team_size, author_id, created_at)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+         ((i + 1, sentence(rng, 4).title(), sentence(rng, 15), sentence(rng, rng.randint(80, 400)),
+           rng.choice(CATEGORIES), ', '.join(rng.sample(WORDS, 3)), str(rng.choice([10, 50, 100, 500]) * 1000),
+           rng.choice(STAGES), str(rng.randint(1, 12)), pitch_authors[i], iso(pitch_created[i]))
+          for i in range(pitches)))
+
+    # Likes: a skewed count per pitch, each from distinct users
+    like_counts = spread(likes, pitches, rng, cap=users)
+    load('likes', 'INSERT INTO likes (pitch_id, user_id, created_at) VALUES (?, ?, ?)',
+         ((i + 1, user_id, timestamp(rng, pitch_created[i]))
+          for i, count in enumerate(like_counts)
+          for user_id in rng.sample(user_ids, min(count, users))))
+
+    comment_counts = spread(comments, pitches, rng)
+    load('comments', 'INSERT INTO comments (pitch_id, user_id, content, created_at) VALUES (?, ?, ?, ?)',
+         ((i + 1, active_user(), sentence(rng, rng.randint(5, 40)), timestamp(rng, pitch_created[i]))
+          for i, count in enumerate(comment_counts) for _ in range(count)))
+
+    def message():
+        sender = active_user()
+        receiver = active_user()
+        while receiver == sender:
+            receiver = rng.choice(user_ids)
+        return (sender, receiver, sentence(rng, 3), sentence(rng, rng.randint(5, 60)),
+                int(rng.random() < 0.8), timestamp(rng))
+    load('messages', '''INSERT INTO messages (sender_id, receiver_id, subject, content, is_read, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?)''', (message() for _ in range(messages)))
+
+    def notification():
+        kind = rng.choice(NOTIFICATION_TYPES)
+        related = (rng.randint(1, pitches), 'pitch') if kind != 'message' else (active_user(), 'user')
+        return (active_user(), kind, f'New {kind}', sentence(rng, 8), related[0], related[1],
+                int(rng.random() < 0.7), timestamp(rng))
+    load('notifications', '''INSERT INTO notifications (user_id, type, title, message, related_id, related_type,
+                                                        is_read, created_at)
+                             VALUES (?, ?, ?, ?, ?, ?, ?, ?)''', (notification() for _ in range(notifications)))
+
+    started = time.perf_counter()
+    for sql in recreate:
+        conn.execute(sql)
+    conn.execute("INSERT INTO pitches_fts(pitches_fts) VALUES ('rebuild')")
+    reconcile(conn)
+    rebuild(conn)
+    rebuild_facets(conn)
+    recount(conn)
+    conn.execute('COMMIT')
+    conn.execute('ANALYZE')
+    timings['indexes and derived data'] = time.perf_counter() - started
+    counts = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+              for table in ('users', 'pitches', 'likes', 'comments', 'messages', 'notifications')}
+    conn.close()
+    return counts, timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('db_path')
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--pitches', type=int, default=50000)
+    parser.add_argument('--likes', type=int, default=1000000)
+    parser.add_argument('--comments', type=int, default=200000)
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--notifications', type=int, default=500000)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    started = time.perf_counter()
+    counts, timings = generate(args.db_path, args.users, args.pitches, args.likes, args.comments,
+                               args.messages, args.notifications, args.seed)
+    for table, seconds in timings.items():
+        rows = f'{counts[table]:>10,} rows' if table in counts else ' ' * 15
+        print(f'{table:<26} {rows} {seconds:8.1f} s')
+    size = os.path.getsize(args.db_path) / 1024 / 1024
+    print(f'{args.db_path}: {size:.0f} MiB in {time.perf_counter() - started:.1f} s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+"""Drive the main routes against a generated database and report latency as JSON.
+
+Usage: python benchmarks/run_benchmarks.py path/to/bench.db [--requests 500] [--threads 1]
+           [--routes index,pitch,...] [--output results.json] [--compare baseline.json]
+           [--app-dir PATH]
+
+Make the database with benchmarks/generate_data.py. Each run works on a copy of
+it, so writes made by like_pitch and add_comment never carry over into the
+next run. Routes are measured one after another: a short warm-up, then
+--requests requests spread over --threads threads through the Flask test
+client, each logged in as a user picked with the same skew as the data
+(anonymous requests would mostly measure the page cache). Request targets come
+from a fixed seed, so two runs of the same database see the same ids.
+
+The JSON report holds the commit, the environment, the table sizes and, per
+route, throughput and latency percentiles. --compare prints the change against
+an earlier report; point --app-dir at a `git worktree` of another commit to
+measure it on the same database.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+WARMUP_REQUESTS = 20
+
+def choose_targets(db_path, seed):
+    """Users and pitches to request, skewed towards the most active ones"""
+    rng = random.Random(seed)
+    conn = sqlite3.connect(db_path)
+    users = [row[0] for row in conn.execute(
+        '''SELECT u.id FROM users u
+           ORDER BY (SELECT COUNT(*) FROM conversation_members m WHERE m.user_id = u.id) DESC, u.id
+           LIMIT 200''')]
+    pitches = [row[0] for row in conn.execute('SELECT id FROM pitches ORDER BY like_count DESC, id LIMIT 2000')]
+    admin = conn.execute("SELECT id FROM users WHERE role = 'admin' ORDER BY id LIMIT 1").fetchone()[0]
+    conn.close()
+    weights = [1.0 / (rank + 1) for rank in range(len(pitches))]
+    return rng, users, pitches, weights, admin
+
+def route_requests(rng, users, pitches, weights, admin):
+    """route name -> function returning (method, url, form, user_id) for one request"""
+    def pitch_id():
+        return rng.choices(pitches, weights=weights)[0]
+
+    return {
+        'index': lambda: ('GET', '/', None, rng.choice(users)),
+        'pitch': lambda: ('GET', f'/pitch/{pitch_id()}', None, rng.choice(users)),
+        'like_pitch': lambda: ('POST', f'/pitch/{pitch_id()}/like', None, rng.choice(users)),
+        'add_comment': lambda: ('POST', f'/pitch/{pitch_id()}/comment', {'content': 'Benchmark comment'},
+                                rng.choice(users)),
+        'messages': lambda: ('GET', '/messages', None, rng.choice(users)),
+        'notifications': lambda: ('GET', '/notifications', None, rng.choice(users)),
+        'admin': lambda: ('GET', '/admin', None, admin),
+    }
+
+def percentile(samples, pct):
+    return samples[min(len(samples) - 1, int(len(samples) * pct / 100))]
+
+def run_route(flask_app, make_request, requests, threads):
+    """Run `requests` requests over `threads` threads; returns the route's summary"""
+    planned = [make_request() for _ in range(WARMUP_REQUESTS + requests)]
+    warmup, planned = planned[:WARMUP_REQUESTS], planned[WARMUP_REQUESTS:]
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+
+    def send(client, method, url, form, user_id):
+        with client.session_transaction() as sess:
+            # Dropping the previous request's flashes keeps the cookie small
+            sess.clear()
+            sess['user_id'] = user_id
+            sess['username'] = f'user-{user_id}'
+        started = time.perf_counter()
+        response = client.open(url, method=method, data=form)
+        response.get_data()
+        elapsed = (time.perf_counter() - started) * 1000
+        response.close()
+        return response.status_code, elapsed
+
+    def worker(batch):
+        client = flask_app.test_client()
+        for request in batch:
+            status, elapsed = send(client, *request)
+            with lock:
+                if status >= 400:
+                    errors[0] += 1
+                else:
+                    latencies.append(elapsed)
+
+    worker(warmup)
+    latencies.clear()
+    errors[0] = 0
+    workers = [threading.Thread(target=worker, args=(planned[i::threads],)) for i in range(threads)]
+    started = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    seconds = time.perf_counter() - started
+
+    latencies.sort()
+    summary = {'requests': requests, 'errors': errors[0], 'seconds': round(seconds, 3),
+               'requests_per_second': round(requests / seconds, 1)}
+    if latencies:
+        summary.update({f'p{pct}_ms': round(percentile(latencies, pct), 3) for pct in (50, 90, 99)})
+        summary.update(mean_ms=round(statistics.mean(latencies), 3), max_ms=round(latencies[-1], 3))
+    return summary
+
+def git_commit(app_dir):
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=app_dir, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(report, baseline):
+    """Print each route's change against an earlier report"""
+    print(f"\nChange since {baseline.get('commit') or 'baseline'} ({baseline.get('created_at')}):")
+    print(f"{'route':<14} {'req/s':>22} {'p50 ms':>22} {'p99 ms':>22}")
+    for route, now in report['routes'].items():
+        before = baseline['routes'].get(route)
+        if not before or 'p50_ms' not in now or 'p50_ms' not in before:
+            continue
+        cells = []
+        for key in ('requests_per_second', 'p50_ms', 'p99_ms'):
+            change = (now[key] - before[key]) / before[key] * 100 if before[key] else 0.0
+            cells.append(f'{before[key]:>8} -> {now[key]:<8} {change:+4.0f}%')
+        print(f'{route:<14} ' + ' '.join(cells))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('db_path')
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--routes', help='comma-separated subset of the routes (default: all)')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--output', help='write the JSON report here as well as to stdout')
+    parser.add_argument('--compare', metavar='BASELINE', help='an earlier JSON report to compare against')
+    parser.add_argument('--app-dir', default=os.path.join(os.path.dirname(__file__), '..'))
+    args = parser.parse_args()
+
+    app_dir = os.path.abspath(args.app_dir)
+    db_path = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    shutil.copyfile(args.db_path, db_path)
+    sys.path.insert(0, app_dir)
+    os.environ['DB_PATH'] = db_path
+    import app as app_module
+    # Keep uploads made during the run (none are expected) out of the checkout
+    app_module.app.config['UPLOAD_FOLDER'] = os.path.join(os.path.dirname(db_path), 'uploads')
+    if hasattr(app_module, 'purger'):
+        app_module.purger.upload_dir = app_module.app.config['UPLOAD_FOLDER']
+
+    rng, users, pitches, weights, admin = choose_targets(db_path, args.seed)
+    routes = route_requests(rng, users, pitches, weights, admin)
+    selected = args.routes.split(',') if args.routes else list(routes)
+    unknown = set(selected) - set(routes)
+    if unknown:
+        parser.error(f'unknown routes: {", ".join(sorted(unknown))}')
+
+    conn = sqlite3.connect(db_path)
+    tables = {table: conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+              for table in ('users', 'pitches', 'likes', 'comments', 'messages', 'notifications')}
+    conn.close()
+    report = {
+        'commit': git_commit(app_dir),
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'threads': args.threads,
+        'tables': tables,
+        'routes': {},
+    }
+    for route in selected:
+        summary = report['routes'][route] = run_route(app_module.app, routes[route], args.requests, args.threads)
+        print(f"{route:<14} {summary['requests_per_second']:>8} req/s  p50 {summary.get('p50_ms', '-')} ms  "
+              f"p99 {summary.get('p99_ms', '-')} ms", file=sys.stderr)
+    app_module.notification_queue.flush()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Rendered page and fragment cache with version-based invalidation.
+
+Every entry records the versions of what it was built from ("site", "feed",
+"pitch:12", ...). Write paths bump the versions they change, and an entry whose
+recorded versions no longer match is treated as a miss. A like on one pitch thus
+invalidates that pitch's page and card, plus any feed page that shows it, and
+nothing else. The TTL only bounds how long a page can be stale across processes
+that do not share a backend.
+
+Backends: LRUCache (in process, the default) or RedisCache (shared between
+workers; needs the `redis` package and CACHE_URL=redis://...).
+
+Snapshot is the other kind of cache here: one value (such as the admin
+statistics) recomputed on a timer rather than invalidated by writes.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+# Every entry depends on this version, so bumping it drops the whole cache
+SITE = 'site'
+
+class LRUCache:
+    """In-process LRU with a per-entry TTL; versions live outside the LRU so they are never evicted"""
+
+    def __init__(self, max_entries=2048, ttl=60):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def versions(self, names):
+        with self._lock:
+            return {name: self._versions.get(name, 0) for name in names}
+
+    def bump(self, *names):
+        with self._lock:
+            for name in names:
+                self._versions[name] = self._versions.get(name, 0) + 1
+
+    def __len__(self):
+        return len(self._entries)
+
+class RedisCache:
+    """Shared backend: entries expire through Redis TTLs, versions are INCR counters"""
+
+    def __init__(self, url, ttl=60, prefix='ideabridge:'):
+        import pickle
+        import redis
+        self._pickle = pickle
+        self._redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self._redis.get(self.prefix + key)
+        return self._pickle.loads(raw) if raw is not None else None
+
+    def set(self, key, value):
+        self._redis.set(self.prefix + key, self._pickle.dumps(value), ex=max(1, int(self.ttl)))
+
+    def versions(self, names):
+        names = list(names)
+        values = self._redis.mget([self.prefix + 'v:' + name for name in names]) if names else []
+        return {name: int(value or 0) for name, value in zip(names, values)}
+
+    def bump(self, *names):
+        pipe = self._redis.pipeline(transaction=False)
+        for name in names:
+            pipe.incr(self.prefix + 'v:' + name)
+        pipe.execute()
+
+    def __len__(self):
+        return 0
+
+class PageCache:
+    """Versioned get/set on top of a backend, with hit/miss counters"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Return the cached value, or None if it is missing, expired or out of date"""
+        entry = self.backend.get(key)
+        if entry is not None:
+            deps, value = entry
+            if self.backend.versions(deps) == deps:
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def set(self, key, value, deps):
+        """Store a value along with the versions (from versions()) it was built from"""
+        deps = dict(deps)
+        deps.setdefault(SITE, self.backend.versions([SITE])[SITE])
+        self.backend.set(key, (deps, value))
+
+    def versions(self, *names):
+        return self.backend.versions(names)
+
+    def bump(self, *names):
+        """Invalidate everything built from these names"""
+        self.backend.bump(*names)
+
+    def clear(self):
+        self.backend.bump(SITE)
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.backend)}
+
+def make_cache(url=None, max_entries=2048, ttl=60):
+    """PageCache on Redis if a redis:// URL is given, else in process"""
+    if url and url.startswith(('redis://', 'rediss://', 'unix://')):
+        return PageCache(RedisCache(url, ttl=ttl))
+    return PageCache(LRUCache(max_entries=max_entries, ttl=ttl))
+
+class Snapshot:
+    """A value recomputed at most every `max_age` seconds.
+
+    While one thread recomputes, the others keep getting the previous value
+    instead of piling onto the same expensive queries.
+    """
+
+    def __init__(self, compute, max_age=300):
+        self.compute = compute
+        self.max_age = max_age
+        self.value = None
+        self.taken_at = None
+        self._taken = 0.0
+        self._lock = threading.Lock()
+
+    def get(self, refresh=False):
+        stale = refresh or self.value is None or time.monotonic() - self._taken >= self.max_age
+        # Only wait for a refresh in progress when there is nothing to show yet
+        if stale and self._lock.acquire(blocking=self.value is None):
+            try:
+                if refresh or self.value is None or time.monotonic() - self._taken >= self.max_age:
+                    self.value = self.compute()
+                    self._taken = time.monotonic()
+                    self.taken_at = time.time()
+            finally:
+                self._lock.release()
+        return self.value
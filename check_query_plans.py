@@ -0,0 +1,270 @@
+"""Query-plan regression check for every route in app.py.
+
+Usage: python check_query_plans.py [-v]
+
+Builds a seeded temporary database, requests every route through the Flask test
+client and captures each SQL statement the app runs. Every statement is then put
+through EXPLAIN QUERY PLAN; the check fails if one falls back to a full SCAN (or
+an automatic index, which is a full scan in disguise) of a large table, or if a
+route has no request below. Temp B-trees for ORDER BY / GROUP BY are reported as
+warnings. Exits non-zero on failure, so it can run in CI.
+"""
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+# Tables that grow with usage; a full scan of any of these is a regression
+LARGE_TABLES = {'users', 'pitches', 'likes', 'comments', 'messages', 'notifications',
+                'conversations', 'conversation_members', 'pitch_tags', 'pitch_scores', 'pitch_view_log'}
+
+PASSWORD = 'plan-check'
+
+def seed(db_path, users=200, pitches=2000):
+    """Create the schema and fill it with enough rows to look like a live site"""
+    from init_db import init_db
+    from werkzeug.security import generate_password_hash
+    init_db(db_path)
+    conn = sqlite3.connect(db_path)
+    start = datetime(2025, 1, 1)
+    password_hash = generate_password_hash(PASSWORD)
+    conn.executemany('INSERT INTO users (username, password_hash, role, created_at) VALUES (?, ?, ?, ?)',
+                     [(f'user{i}', password_hash, 'user', (start + timedelta(hours=i)).isoformat())
+                      for i in range(users)])
+    user_ids = [row[0] for row in conn.execute("SELECT id FROM users WHERE username LIKE 'user%'")]
+    conn.executemany('''INSERT INTO pitches (title, summary, content, category, tags, funding_goal, stage,
+                                             team_size, author_id, created_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                     [(f'Pitch {i}', f'Summary {i}', f'Solar farming robot number {i}', 'technology',
+                       'solar,robots' if i % 2 else 'solar', str(5000 * (i % 300)), ('idea', 'mvp')[i % 2],
+                       '2-5', user_ids[i % users], (start + timedelta(minutes=i)).isoformat())
+                      for i in range(pitches)])
+    pitch_ids = [row[0] for row in conn.execute('SELECT id FROM pitches')]
+    conn.executemany('INSERT OR IGNORE INTO likes (pitch_id, user_id, created_at) VALUES (?, ?, ?)',
+                     [(pitch_ids[i % pitches], user_ids[(i * 7) % users], start.isoformat())
+                      for i in range(pitches * 5)])
+    conn.executemany('INSERT INTO comments (pitch_id, user_id, content, created_at) VALUES (?, ?, ?, ?)',
+                     [(pitch_ids[i % pitches], user_ids[(i * 3) % users], 'Nice', start.isoformat())
+                      for i in range(pitches * 2)])
+    conn.executemany('''INSERT INTO messages (sender_id, receiver_id, subject, content, created_at)
+                        VALUES (?, ?, ?, ?, ?)''',
+                     [(user_ids[i % users], user_ids[(i + 1 + i // users) % users], 'Hi', 'Hello',
+                       (start + timedelta(minutes=i)).isoformat())
+                      for i in range(users * 10)])
+    conn.executemany('''INSERT INTO notifications (user_id, type, title, message, created_at)
+                        VALUES (?, ?, ?, ?, ?)''',
+                     [(user_ids[i % users], 'like', 'New Like', 'Someone liked your pitch', start.isoformat())
+                      for i in range(users * 20)])
+    conn.execute("UPDATE users SET role = 'admin' WHERE username = 'user0'")
+    from counters import reconcile
+    from facets import rebuild
+    from trending import rebuild as rebuild_scores
+    reconcile(conn.cursor())
+    rebuild(conn.cursor())
+    rebuild_scores(conn)
+    conn.commit()
+    conn.close()
+
+def route_requests(db_path):
+    """One or more (endpoint, method, url, data, login) requests per route"""
+    conn = sqlite3.connect(db_path)
+    admin_id, user_id, other_id = [row[0] for row in conn.execute(
+        "SELECT id FROM users WHERE username IN ('user0', 'user1', 'user2') ORDER BY username")]
+    pitch_id = conn.execute('SELECT id FROM pitches WHERE author_id = ? LIMIT 1', [other_id]).fetchone()[0]
+    comment_id = conn.execute('SELECT id FROM comments WHERE user_id = ? LIMIT 1', [user_id]).fetchone()[0]
+    message_id, sender_id = conn.execute('SELECT id, sender_id FROM messages WHERE receiver_id = ? LIMIT 1',
+                                         [user_id]).fetchone()
+    inbox_cursor = conn.execute('''SELECT last_message_at, conversation_id FROM conversation_members
+                                   WHERE user_id = ? ORDER BY last_message_at DESC LIMIT 1''', [user_id]).fetchone()
+    notification_ids = [row[0] for row in conn.execute('SELECT id FROM notifications WHERE user_id = ? LIMIT 3',
+                                                       [user_id])]
+    notification_id = notification_ids[0]
+    notification_cursor = conn.execute('''SELECT created_at, id FROM notifications WHERE user_id = ?
+                                          ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET 10''',
+                                       [user_id]).fetchone()
+    cursor = conn.execute('SELECT created_at, id FROM pitches ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET 20').fetchone()
+    hot_position = conn.execute('SELECT score, pitch_id FROM pitch_scores ORDER BY score DESC, pitch_id DESC LIMIT 1 OFFSET 20').fetchone()
+    conn.close()
+
+    from app import encode_cursor
+    hot_cursor = encode_cursor(repr(hot_position[0]), hot_position[1])
+    return [
+        ('index', 'GET', '/', None, None),
+        ('index', 'GET', f'/?after={encode_cursor(*cursor)}', None, None),
+        ('index', 'GET', '/?q=solar robot', None, user_id),
+        ('feed_json', 'GET', f'/api/feed?after={encode_cursor(*cursor)}', None, None),
+        ('feed_json', 'GET', '/api/feed?q=solar&after=12', None, None),
+        ('feed_json', 'GET', '/api/feed?facets=1&category=technology', None, None),
+        ('feed_json', 'GET', f'/api/feed?stage=mvp&after={encode_cursor(*cursor)}', None, None),
+        ('feed_json', 'GET', f'/api/feed?tag=robots&after={encode_cursor(*cursor)}', None, None),
+        ('feed_json', 'GET', '/api/feed?tag=robots&funding=50k-250k&team_max=5', None, None),
+        ('feed_json', 'GET', '/api/feed?q=solar&tag=robots&stage=idea', None, None),
+        ('feed_json', 'GET', '/api/feed?sort=hot', None, None),
+        ('feed_json', 'GET', f'/api/feed?sort=hot&category=technology&after={hot_cursor}', None, None),
+        ('index', 'GET', '/?sort=hot&tag=robots', None, user_id),
+        ('pitch', 'GET', f'/pitch/{pitch_id}', None, user_id),
+        ('register', 'GET', '/register', None, None),
+        ('register', 'POST', '/register', {'username': 'newcomer', 'password': PASSWORD}, None),
+        ('login', 'GET', '/login', None, None),
+        ('login', 'POST', '/login', {'username': 'user1', 'password': PASSWORD}, None),
+        ('logout', 'GET', '/logout', None, user_id),
+        ('post', 'GET', '/post', None, user_id),
+        ('post', 'POST', '/post', {'title': 'Plan check', 'summary': 'Summary', 'content': 'Body',
+                                   'category': 'technology', 'tags': 'Solar, new-tag', 'funding_goal': '25000',
+                                   'stage': 'idea', 'team_size': 'solo'}, user_id),
+        ('dashboard', 'GET', '/dashboard', None, user_id),
+        ('like_pitch', 'POST', f'/pitch/{pitch_id}/like', None, user_id),
+        ('like_pitch', 'POST', f'/pitch/{pitch_id}/like', None, user_id),
+        ('add_comment', 'POST', f'/pitch/{pitch_id}/comment', {'content': 'Great idea'}, user_id),
+        ('delete_comment', 'POST', f'/comment/{comment_id}/delete', None, user_id),
+        ('messages', 'GET', '/messages', None, user_id),
+        ('messages', 'GET', f'/messages?after={encode_cursor(*inbox_cursor)}', None, user_id),
+        ('conversation', 'GET', f'/messages/{sender_id}', None, user_id),
+        ('conversation', 'GET', f'/messages/{sender_id}?before={message_id + 1000}', None, user_id),
+        ('send_message', 'GET', f'/message/send/{other_id}', None, user_id),
+        ('send_message', 'POST', f'/message/send/{other_id}', {'subject': 'Hi', 'content': 'Hello'}, user_id),
+        ('mark_read', 'POST', f'/message/{message_id}/read', None, user_id),
+        ('notifications', 'GET', '/notifications', None, user_id),
+        ('notifications', 'GET', f'/notifications?after={encode_cursor(*notification_cursor)}', None, user_id),
+        ('notification_stream', 'GET', '/notifications/stream', None, user_id),
+        ('mark_notification_read_route', 'POST', f'/notifications/mark_read/{notification_id}', None, user_id),
+        ('mark_all_notifications_read_route', 'POST', '/notifications/mark_all_read', None, user_id),
+        ('delete_notification_route', 'POST', f'/notifications/delete/{notification_id}', None, user_id),
+        ('bulk_notifications_route', 'POST', '/notifications/bulk',
+         {'action': 'read', 'ids': [str(i) for i in notification_ids[1:]]}, user_id),
+        ('bulk_notifications_route', 'POST', '/notifications/bulk',
+         {'action': 'delete', 'type': 'like', 'older_than_days': '30'}, user_id),
+        ('admin', 'GET', '/admin', None, admin_id),
+        ('admin', 'GET', f'/admin?sort=username&role=user&after={encode_cursor("user5", 0)}', None, admin_id),
+        ('admin', 'GET', '/admin?q=user1&sort=oldest', None, admin_id),
+        ('admin', 'GET', f'/admin?tab=pitches&after={encode_cursor(*cursor)}', None, admin_id),
+        ('admin', 'GET', '/admin?tab=pitches&category=technology&sort=oldest', None, admin_id),
+        ('admin', 'GET', '/admin?tab=pitches&author=user2&q=solar', None, admin_id),
+        ('admin_export', 'GET', '/admin/export/users.csv', None, admin_id),
+        ('admin_export', 'GET', '/admin/export/pitches.csv?category=technology', None, admin_id),
+        ('admin', 'POST', '/admin', {'action': 'promote', 'target': 'user3', 'newrole': 'verified'}, admin_id),
+        ('admin', 'POST', '/admin', {'action': 'delete_pitch', 'pitch_id': str(pitch_id)}, admin_id),
+        ('admin', 'POST', '/admin', {'action': 'delete_user', 'target': 'user4'}, admin_id),
+        ('admin_queue_stats', 'GET', '/admin/queue-stats', None, admin_id),
+        ('admin_cache_stats', 'GET', '/admin/cache-stats', None, admin_id),
+        ('admin_purge_stats', 'GET', '/admin/purge-stats', None, admin_id),
+        ('admin_trending_stats', 'GET', '/admin/trending-stats', None, admin_id),
+        ('admin_view_stats', 'GET', '/admin/view-stats', None, admin_id),
+        ('admin_write_stats', 'GET', '/admin/write-stats', None, admin_id),
+        ('admin_login_stats', 'GET', '/admin/login-stats', None, admin_id),
+        ('metrics_endpoint', 'GET', '/metrics', None, None),
+        ('asset', 'GET', '/assets/base.css', None, None),
+        ('admin_profile', 'POST', '/admin/profile', {'action': 'start'}, admin_id),
+        ('admin_profile', 'GET', '/admin/profile', None, admin_id),
+        ('admin_profile', 'POST', '/admin/profile', {'action': 'stop'}, admin_id),
+        ('admin_stream_stats', 'GET', '/admin/stream-stats', None, admin_id),
+    ]
+
+def table_aliases(sql):
+    """Map the names used in a statement's FROM/JOIN/UPDATE/INTO clauses to table names"""
+    aliases = {}
+    for table, alias in re.findall(r'\b(?:FROM|JOIN|UPDATE|INTO)\s+(\w+)(?:\s+(?:AS\s+)?(\w+))?', sql, re.I):
+        aliases[table] = table
+        if alias and alias.upper() not in ('WHERE', 'SET', 'ON', 'JOIN', 'LEFT', 'INNER', 'ORDER',
+                                           'GROUP', 'LIMIT', 'VALUES', 'USING', 'AS'):
+            aliases[alias] = table
+    return aliases
+
+def check_plan(conn, sql):
+    """Return (errors, warnings) for one statement's query plan"""
+    errors, warnings = [], []
+    aliases = table_aliases(sql)
+    for _, _, _, detail in conn.execute('EXPLAIN QUERY PLAN ' + sql):
+        if 'TEMP B-TREE' in detail:
+            warnings.append(detail)
+            continue
+        match = re.match(r'(SCAN|SEARCH) (\w+)', detail)
+        if not match or 'VIRTUAL TABLE' in detail:
+            continue
+        table = aliases.get(match.group(2), match.group(2))
+        if table not in LARGE_TABLES:
+            continue
+        if 'AUTOMATIC' in detail or (match.group(1) == 'SCAN' and 'INDEX' not in detail):
+            errors.append(detail)
+    return errors, warnings
+
+def main():
+    verbose = '-v' in sys.argv[1:]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    db_path = os.path.join(tempfile.mkdtemp(), 'plans.db')
+    seed(db_path)
+    os.environ['DB_PATH'] = db_path
+    # Run the routes with the metrics hooks installed, so N+1 patterns are logged too
+    os.environ['METRICS'] = '1'
+
+    import app as app_module
+    from flask import has_request_context, request
+
+    # Record every statement the app runs, keyed by the route that ran it
+    statements = defaultdict(set)
+    count_query = app_module.db_pool.on_statement
+
+    def capture(statement):
+        if count_query:
+            count_query(statement)
+        if statement.startswith(('BEGIN', 'COMMIT', 'ROLLBACK', 'SAVEPOINT', 'RELEASE', 'PRAGMA', '--')):
+            return
+        endpoint = request.endpoint if has_request_context() else '(background)'
+        statements[statement].add(endpoint)
+
+    app_module.db_pool.on_statement = capture
+
+    requests_to_run = route_requests(db_path)
+    endpoints = {rule.endpoint for rule in app_module.app.url_map.iter_rules() if rule.endpoint != 'static'}
+    uncovered = endpoints - {endpoint for endpoint, *_ in requests_to_run}
+
+    client = app_module.app.test_client()
+    failed_requests = []
+    for endpoint, method, url, data, login in requests_to_run:
+        with client.session_transaction() as sess:
+            sess.clear()
+            if login:
+                sess['user_id'] = login
+                sess['username'] = f'user-{login}'
+        response = client.open(url, method=method, data=data)
+        if response.status_code >= 500:
+            failed_requests.append(f'{method} {url} -> {response.status_code}')
+        response.close()  # ends streamed responses
+    app_module.notification_queue.flush()
+    app_module.purger.flush()
+    app_module.view_counter.flush()
+
+    conn = sqlite3.connect(db_path)
+    errors = warnings = 0
+    for statement, routes in sorted(statements.items()):
+        plan_errors, plan_warnings = check_plan(conn, statement)
+        where = ', '.join(sorted(routes))
+        if plan_errors:
+            errors += 1
+            print(f'FAIL [{where}] {" ".join(statement.split())}')
+            for detail in plan_errors:
+                print(f'     {detail}')
+        elif plan_warnings:
+            warnings += 1
+            if verbose:
+                print(f'warn [{where}] {" ".join(statement.split())}')
+                for detail in plan_warnings:
+                    print(f'     {detail}')
+    conn.close()
+
+    for endpoint in sorted(uncovered):
+        print(f'FAIL route {endpoint} is not exercised; add a request for it in route_requests()')
+    for failure in failed_requests:
+        print(f'FAIL request {failure}')
+
+    print(f'{len(statements)} statements from {len(endpoints)} routes: '
+          f'{errors} full scans, {warnings} temp B-tree warnings')
+    if errors or uncovered or failed_requests:
+        sys.exit(1)
+    print('Query plans OK!')
+
+if __name__ == '__main__':
+    main()
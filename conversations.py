@@ -0,0 +1,130 @@
+import sqlite3
+import sys
+
+# Messages grouped by participant pair. conversations holds the last-message
+# summary for the pair; conversation_members holds one row per participant with
+# their unread count, so a user's inbox is a single index range scan. Triggers
+# on messages keep both exact, whichever code path writes the message.
+PREVIEW_LENGTH = 120
+
+CONVERSATION_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS conversations (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_low INTEGER NOT NULL,
+        user_high INTEGER NOT NULL,
+        last_message_id INTEGER,
+        last_message_at TEXT,
+        last_sender_id INTEGER,
+        last_preview TEXT,
+        message_count INTEGER NOT NULL DEFAULT 0,
+        FOREIGN KEY(user_low) REFERENCES users(id) ON DELETE CASCADE,
+        FOREIGN KEY(user_high) REFERENCES users(id) ON DELETE CASCADE,
+        UNIQUE(user_low, user_high)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS conversation_members (
+        conversation_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        other_id INTEGER NOT NULL,
+        last_message_at TEXT,
+        unread_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY(conversation_id, user_id),
+        FOREIGN KEY(conversation_id) REFERENCES conversations(id) ON DELETE CASCADE,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE,
+        FOREIGN KEY(other_id) REFERENCES users(id) ON DELETE CASCADE
+    )''',
+
+    # A new message updates the pair's summary and both participants' inbox rows
+    f'''CREATE TRIGGER IF NOT EXISTS messages_conversation_ai AFTER INSERT ON messages BEGIN
+        INSERT INTO conversations (user_low, user_high, last_message_id, last_message_at,
+                                   last_sender_id, last_preview, message_count)
+        VALUES (min(new.sender_id, new.receiver_id), max(new.sender_id, new.receiver_id), new.id,
+                new.created_at, new.sender_id, substr(new.content, 1, {PREVIEW_LENGTH}), 1)
+        ON CONFLICT(user_low, user_high) DO UPDATE SET
+            last_message_id = excluded.last_message_id,
+            last_message_at = excluded.last_message_at,
+            last_sender_id = excluded.last_sender_id,
+            last_preview = excluded.last_preview,
+            message_count = message_count + 1;
+        UPDATE messages SET conversation_id = (
+            SELECT id FROM conversations
+            WHERE user_low = min(new.sender_id, new.receiver_id) AND user_high = max(new.sender_id, new.receiver_id))
+        WHERE id = new.id;
+        INSERT INTO conversation_members (conversation_id, user_id, other_id, last_message_at, unread_count)
+        SELECT conversation_id, new.sender_id, new.receiver_id, new.created_at, 0 FROM messages WHERE id = new.id
+        ON CONFLICT(conversation_id, user_id) DO UPDATE SET last_message_at = excluded.last_message_at;
+        INSERT INTO conversation_members (conversation_id, user_id, other_id, last_message_at, unread_count)
+        SELECT conversation_id, new.receiver_id, new.sender_id, new.created_at, new.is_read = 0
+        FROM messages WHERE id = new.id
+        ON CONFLICT(conversation_id, user_id) DO UPDATE SET
+            last_message_at = excluded.last_message_at,
+            unread_count = unread_count + excluded.unread_count;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS messages_conversation_au AFTER UPDATE OF is_read ON messages
+       WHEN (old.is_read = 0) != (new.is_read = 0) BEGIN
+        UPDATE conversation_members
+        SET unread_count = unread_count + (CASE WHEN new.is_read = 0 THEN 1 ELSE -1 END)
+        WHERE conversation_id = new.conversation_id AND user_id = new.receiver_id;
+    END''',
+    # Messages are only deleted along with a user, which also drops the conversation;
+    # this keeps the counts right while the cascade runs
+    '''CREATE TRIGGER IF NOT EXISTS messages_conversation_ad AFTER DELETE ON messages BEGIN
+        UPDATE conversations SET message_count = message_count - 1 WHERE id = old.conversation_id;
+        UPDATE conversation_members SET unread_count = unread_count - 1
+        WHERE old.is_read = 0 AND conversation_id = old.conversation_id AND user_id = old.receiver_id;
+    END''',
+]
+
+# Rebuild every conversation from the messages table
+REBUILD_SQL = [
+    'DELETE FROM conversation_members',
+    'DELETE FROM conversations',
+    '''INSERT INTO conversations (user_low, user_high, last_message_id, message_count)
+       SELECT min(sender_id, receiver_id), max(sender_id, receiver_id), MAX(id), COUNT(*)
+       FROM messages GROUP BY 1, 2''',
+    f'''UPDATE conversations SET last_message_at = m.created_at, last_sender_id = m.sender_id,
+                                last_preview = substr(m.content, 1, {PREVIEW_LENGTH})
+       FROM messages AS m WHERE m.id = conversations.last_message_id''',
+    '''UPDATE messages SET conversation_id = c.id
+       FROM conversations AS c
+       WHERE c.user_low = min(messages.sender_id, messages.receiver_id)
+         AND c.user_high = max(messages.sender_id, messages.receiver_id)''',
+    '''INSERT INTO conversation_members (conversation_id, user_id, other_id, last_message_at, unread_count)
+       SELECT c.id, c.user_low, c.user_high, c.last_message_at,
+              (SELECT COUNT(*) FROM messages m
+               WHERE m.conversation_id = c.id AND m.receiver_id = c.user_low AND m.is_read = 0)
+       FROM conversations c
+       UNION ALL
+       SELECT c.id, c.user_high, c.user_low, c.last_message_at,
+              (SELECT COUNT(*) FROM messages m
+               WHERE m.conversation_id = c.id AND m.receiver_id = c.user_high AND m.is_read = 0)
+       FROM conversations c WHERE c.user_high != c.user_low''',
+]
+
+def create_conversations(c):
+    """Create the conversation tables and triggers; returns True if they are new"""
+    exists = c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'conversations'").fetchone()
+    columns = [column[1] for column in c.execute('PRAGMA table_info(messages)').fetchall()]
+    if 'conversation_id' not in columns:
+        c.execute('ALTER TABLE messages ADD COLUMN conversation_id INTEGER')
+    for statement in CONVERSATION_SCHEMA:
+        c.execute(statement)
+    return exists is None
+
+def rebuild(c):
+    """Recompute every conversation summary and unread count from the messages"""
+    for statement in REBUILD_SQL:
+        c.execute(statement)
+
+def rebuild_conversations(db_path='data.db'):
+    """Rebuild the conversation index in one transaction"""
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    create_conversations(c)
+    rebuild(c)
+    conn.commit()
+    count = c.execute('SELECT COUNT(*) FROM conversations').fetchone()[0]
+    conn.close()
+    print(f'Conversations rebuilt: {count}')
+
+if __name__ == '__main__':
+    rebuild_conversations(sys.argv[1] if len(sys.argv) > 1 else 'data.db')
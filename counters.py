@@ -0,0 +1,144 @@
+import sqlite3
+import sys
+
+# Denormalized counters, so hot pages read a column instead of running COUNT(*).
+# The triggers below keep them exact for every write path, including rows
+# removed by ON DELETE CASCADE.
+COUNTER_COLUMNS = {
+    'pitches': {'like_count': 'INTEGER NOT NULL DEFAULT 0',
+                'comment_count': 'INTEGER NOT NULL DEFAULT 0'},
+    'users': {'unread_messages': 'INTEGER NOT NULL DEFAULT 0',
+              'unread_notifications': 'INTEGER NOT NULL DEFAULT 0'},
+}
+
+# Site-wide totals for the admin page, one row per counter
+SITE_STATS = ['users', 'pitches', 'likes', 'comments']
+
+COUNTER_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS site_stats (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    )''',
+
+    # Per-pitch like and comment counts
+    '''CREATE TRIGGER IF NOT EXISTS likes_count_ai AFTER INSERT ON likes BEGIN
+        UPDATE pitches SET like_count = like_count + 1 WHERE id = new.pitch_id;
+        UPDATE site_stats SET value = value + 1 WHERE name = 'likes';
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS likes_count_ad AFTER DELETE ON likes BEGIN
+        UPDATE pitches SET like_count = like_count - 1 WHERE id = old.pitch_id;
+        UPDATE site_stats SET value = value - 1 WHERE name = 'likes';
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS comments_count_ai AFTER INSERT ON comments BEGIN
+        UPDATE pitches SET comment_count = comment_count + 1 WHERE id = new.pitch_id;
+        UPDATE site_stats SET value = value + 1 WHERE name = 'comments';
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS comments_count_ad AFTER DELETE ON comments BEGIN
+        UPDATE pitches SET comment_count = comment_count - 1 WHERE id = old.pitch_id;
+        UPDATE site_stats SET value = value - 1 WHERE name = 'comments';
+    END''',
+
+    # Per-user unread message counts
+    '''CREATE TRIGGER IF NOT EXISTS messages_unread_ai AFTER INSERT ON messages
+       WHEN new.is_read = 0 BEGIN
+        UPDATE users SET unread_messages = unread_messages + 1 WHERE id = new.receiver_id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS messages_unread_au AFTER UPDATE OF is_read ON messages
+       WHEN (old.is_read = 0) != (new.is_read = 0) BEGIN
+        UPDATE users SET unread_messages = unread_messages + (CASE WHEN new.is_read = 0 THEN 1 ELSE -1 END)
+        WHERE id = new.receiver_id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS messages_unread_ad AFTER DELETE ON messages
+       WHEN old.is_read = 0 BEGIN
+        UPDATE users SET unread_messages = unread_messages - 1 WHERE id = old.receiver_id;
+    END''',
+
+    # Per-user unread notification counts
+    '''CREATE TRIGGER IF NOT EXISTS notifications_unread_ai AFTER INSERT ON notifications
+       WHEN new.is_read = 0 BEGIN
+        UPDATE users SET unread_notifications = unread_notifications + 1 WHERE id = new.user_id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS notifications_unread_au AFTER UPDATE OF is_read ON notifications
+       WHEN (old.is_read = 0) != (new.is_read = 0) BEGIN
+        UPDATE users SET unread_notifications = unread_notifications + (CASE WHEN new.is_read = 0 THEN 1 ELSE -1 END)
+        WHERE id = new.user_id;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS notifications_unread_ad AFTER DELETE ON notifications
+       WHEN old.is_read = 0 BEGIN
+        UPDATE users SET unread_notifications = unread_notifications - 1 WHERE id = old.user_id;
+    END''',
+
+    # Site-wide user and pitch totals
+    '''CREATE TRIGGER IF NOT EXISTS users_stats_ai AFTER INSERT ON users BEGIN
+        UPDATE site_stats SET value = value + 1 WHERE name = 'users';
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS users_stats_ad AFTER DELETE ON users BEGIN
+        UPDATE site_stats SET value = value - 1 WHERE name = 'users';
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS pitches_stats_ai AFTER INSERT ON pitches BEGIN
+        UPDATE site_stats SET value = value + 1 WHERE name = 'pitches';
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS pitches_stats_ad AFTER DELETE ON pitches BEGIN
+        UPDATE site_stats SET value = value - 1 WHERE name = 'pitches';
+    END''',
+]
+
+# Recompute every counter from the source tables
+RECONCILE_SQL = [
+    'UPDATE pitches SET like_count = 0, comment_count = 0',
+    '''UPDATE pitches SET like_count = t.n
+       FROM (SELECT pitch_id, COUNT(*) AS n FROM likes GROUP BY pitch_id) AS t
+       WHERE pitches.id = t.pitch_id''',
+    '''UPDATE pitches SET comment_count = t.n
+       FROM (SELECT pitch_id, COUNT(*) AS n FROM comments GROUP BY pitch_id) AS t
+       WHERE pitches.id = t.pitch_id''',
+    'UPDATE users SET unread_messages = 0, unread_notifications = 0',
+    '''UPDATE users SET unread_messages = t.n
+       FROM (SELECT receiver_id, COUNT(*) AS n FROM messages WHERE is_read = 0 GROUP BY receiver_id) AS t
+       WHERE users.id = t.receiver_id''',
+    '''UPDATE users SET unread_notifications = t.n
+       FROM (SELECT user_id, COUNT(*) AS n FROM notifications WHERE is_read = 0 GROUP BY user_id) AS t
+       WHERE users.id = t.user_id''',
+    "INSERT OR REPLACE INTO site_stats (name, value) VALUES ('users', (SELECT COUNT(*) FROM users))",
+    "INSERT OR REPLACE INTO site_stats (name, value) VALUES ('pitches', (SELECT COUNT(*) FROM pitches))",
+    "INSERT OR REPLACE INTO site_stats (name, value) VALUES ('likes', (SELECT COUNT(*) FROM likes))",
+    "INSERT OR REPLACE INTO site_stats (name, value) VALUES ('comments', (SELECT COUNT(*) FROM comments))",
+]
+
+def create_counters(c):
+    """Add the counter columns, stats table and triggers; returns True if any column is new"""
+    added = False
+    for table, columns in COUNTER_COLUMNS.items():
+        existing = [column[1] for column in c.execute(f'PRAGMA table_info({table})').fetchall()]
+        for column_name, column_type in columns.items():
+            if column_name not in existing:
+                c.execute(f'ALTER TABLE {table} ADD COLUMN {column_name} {column_type}')
+                added = True
+    for statement in COUNTER_SCHEMA:
+        c.execute(statement)
+    c.executemany('INSERT OR IGNORE INTO site_stats (name, value) VALUES (?, 0)',
+                  [(name,) for name in SITE_STATS])
+    return added
+
+def reconcile(c):
+    """Recompute every counter from the source tables"""
+    for statement in RECONCILE_SQL:
+        c.execute(statement)
+
+def reconcile_counters(db_path='data.db'):
+    """Recompute every counter in one transaction and report the drift that was fixed"""
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    create_counters(c)
+    before = dict(c.execute('SELECT name, value FROM site_stats').fetchall())
+    reconcile(c)
+    after = dict(c.execute('SELECT name, value FROM site_stats').fetchall())
+    conn.commit()
+    conn.close()
+    for name in SITE_STATS:
+        drift = after[name] - before.get(name, 0)
+        print(f'{name}: {after[name]}' + (f' (corrected by {drift:+d})' if drift else ''))
+    print('Counters reconciled!')
+
+if __name__ == '__main__':
+    reconcile_counters(sys.argv[1] if len(sys.argv) > 1 else 'data.db')
@@ -0,0 +1,276 @@
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Applied to every connection the pool opens. journal_mode=WAL is persistent in
+# the database file; the rest are per-connection settings.
+CONNECTION_PRAGMAS = [
+    'PRAGMA synchronous = {synchronous}',
+    'PRAGMA busy_timeout = {busy_timeout_ms}',
+    'PRAGMA cache_size = -{cache_kib}',
+    'PRAGMA mmap_size = {mmap_bytes}',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA foreign_keys = ON',
+]
+
+class TimedConnection(sqlite3.Connection):
+    """Connection that reports how long each execute() took (see ConnectionPool.on_query)"""
+    on_query = None
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self.on_query(sql, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            self.on_query(sql, time.perf_counter() - started)
+
+class ConnectionPool:
+    """Per-process pool of SQLite connections.
+
+    Readers are kept in a LIFO queue and handed out one per request. Writes go
+    through a single write connection guarded by a lock, so in WAL mode a
+    like or comment never blocks the feed readers.
+    """
+
+    def __init__(self, db_path, max_idle=8, cache_kib=16384, mmap_bytes=128 * 1024 * 1024,
+                 busy_timeout_ms=5000, synchronous='NORMAL'):
+        self.db_path = db_path
+        self.max_idle = max_idle
+        self.settings = {'cache_kib': cache_kib, 'mmap_bytes': mmap_bytes,
+                         'busy_timeout_ms': busy_timeout_ms, 'synchronous': synchronous}
+        # Optional callable given the text of every statement run (for counting)
+        self.on_statement = None
+        # Optional callable given (sql, seconds) for every execute(); set it before
+        # the first connection is opened, since only connections opened while it
+        # is set are timed. Measures until the first row is ready, not the fetch.
+        self.on_query = None
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._readers = queue.LifoQueue()
+        self._writer = None
+        self._write_lock = threading.RLock()
+        self._write_owner = None
+        self._wal_checked = False
+
+    def _check_fork(self):
+        # Connections must not cross a fork (gunicorn workers); start over if they did
+        if self._pid != os.getpid():
+            self._reset()
+
+    def connect(self):
+        """Open a new connection with the pool's PRAGMAs applied"""
+        if self.on_query is None:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False)
+        else:
+            conn = sqlite3.connect(self.db_path, isolation_level=None, check_same_thread=False,
+                                   factory=TimedConnection)
+            conn.on_query = self.on_query
+        conn.row_factory = sqlite3.Row
+        if not self._wal_checked:
+            conn.execute('PRAGMA journal_mode = WAL')
+            self._wal_checked = True
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma.format(**self.settings))
+        conn.set_trace_callback(self._trace)
+        return conn
+
+    def _trace(self, statement):
+        if self.on_statement is not None:
+            self.on_statement(statement)
+
+    def acquire(self):
+        """Take a read connection from the pool, opening one if none are idle"""
+        self._check_fork()
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            conn = self.connect()
+            conn.execute('PRAGMA query_only = ON')
+            return conn
+
+    def release(self, conn):
+        """Return a read connection to the pool, closing it if the pool is full"""
+        if self._pid != os.getpid() or self._readers.qsize() >= self.max_idle:
+            conn.close()
+        else:
+            self._readers.put(conn)
+
+    @contextmanager
+    def writer(self):
+        """Run a block of writes as one transaction on the write connection"""
+        self._check_fork()
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = self.connect()
+            conn = self._writer
+            if conn.in_transaction:
+                # Nested use joins the enclosing transaction
+                yield conn
+                return
+            conn.execute('BEGIN IMMEDIATE')
+            self._write_owner = threading.get_ident()
+            try:
+                yield conn
+                conn.execute('COMMIT')
+            except BaseException:
+                if conn.in_transaction:
+                    conn.execute('ROLLBACK')
+                raise
+            finally:
+                self._write_owner = None
+
+    def in_writer(self):
+        """True if the calling thread is inside a writer() block"""
+        return self._pid == os.getpid() and self._write_owner == threading.get_ident()
+
+    def close(self):
+        """Close every idle connection held by the pool"""
+        while True:
+            try:
+                self._readers.get_nowait().close()
+            except queue.Empty:
+                break
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+
+# What a GroupCommitter write resolves to; rows holds the output of RETURNING, if any
+WriteResult = namedtuple('WriteResult', ['lastrowid', 'rowcount', 'rows'])
+
+_STOP = object()
+
+class GroupCommitter:
+    """Runs single-statement writes from many threads on one thread, many per transaction.
+
+    submit() queues a statement and returns a Future. The committer thread takes
+    everything queued so far (up to max_batch), runs each statement under its
+    own SAVEPOINT on the pool's write connection and commits once, then
+    resolves each Future with a WriteResult or the statement's exception; a
+    failing statement is rolled back alone and the rest still commit. It never
+    waits for a batch to fill: while one batch commits the next one queues, so
+    a lone writer pays one hop to the thread and busy periods share commits.
+
+    A caller already inside pool.writer() has its statement run inline, in
+    that transaction.
+    """
+
+    def __init__(self, pool, max_batch=256):
+        self.pool = pool
+        self.max_batch = max_batch
+        # Optional callable given the SQL of each statement handed to the committer
+        # thread, called on the submitting thread (pool.on_statement and
+        # pool.on_query run on the thread that executes it)
+        self.on_queued = None
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+        self._stats = {'writes': 0, 'failed': 0, 'batches': 0, 'largest_batch': 0,
+                       'last_batch_size': 0, 'last_batch_ms': 0.0}
+
+    def submit(self, sql, args=()):
+        """Queue one write statement; returns a Future of its WriteResult"""
+        if self._pid != os.getpid():
+            self._reset()
+        item = (Future(), sql, args)
+        if not self.pool.in_writer():
+            with self._lock:
+                queued = not self._stopped
+                if queued:
+                    if self._thread is None:
+                        self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+                        self._thread.start()
+                    self._queue.put(item)
+            if queued:
+                if self.on_queued is not None:
+                    self.on_queued(sql)
+                return item[0]
+        self._commit([item])
+        return item[0]
+
+    def execute(self, sql, args=()):
+        """Run one write statement and wait for its commit; returns its WriteResult"""
+        return self.submit(sql, args).result()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                stopping = True
+                batch = [item for item in batch if item is not _STOP]
+            if batch:
+                self._commit(batch)
+
+    def _commit(self, batch):
+        started = time.perf_counter()
+        outcomes = []
+        try:
+            with self.pool.writer() as conn:
+                for future, sql, args in batch:
+                    conn.execute('SAVEPOINT group_commit')
+                    try:
+                        cursor = conn.execute(sql, args)
+                        rows = cursor.fetchall()
+                        outcomes.append((future, WriteResult(cursor.lastrowid, cursor.rowcount, rows)))
+                    except Exception as exc:
+                        conn.execute('ROLLBACK TO group_commit')
+                        outcomes.append((future, exc))
+                    conn.execute('RELEASE group_commit')
+        except Exception as exc:
+            # The commit itself failed, so none of the batch was written
+            logger.exception('Group commit of %d writes failed', len(batch))
+            outcomes = [(future, exc) for future, _, _ in batch]
+        for future, outcome in outcomes:
+            if isinstance(outcome, Exception):
+                self._stats['failed'] += 1
+                future.set_exception(outcome)
+            else:
+                future.set_result(outcome)
+        self._stats['writes'] += len(batch)
+        self._stats['batches'] += 1
+        self._stats['largest_batch'] = max(self._stats['largest_batch'], len(batch))
+        self._stats['last_batch_size'] = len(batch)
+        self._stats['last_batch_ms'] = round((time.perf_counter() - started) * 1000, 3)
+
+    def stop(self, timeout=5.0):
+        """Commit what is queued and stop the thread; later writes run inline"""
+        with self._lock:
+            if self._stopped:
+                return
+            self._stopped = True
+            if self._thread is None or self._pid != os.getpid():
+                return
+            self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def stats(self):
+        return dict(self._stats, depth=self._queue.qsize(), max_batch=self.max_batch,
+                    running=self._thread is not None and self._thread.is_alive())
@@ -0,0 +1,89 @@
+"""In-process pub/sub for pushing per-user events to Server-Sent Event streams.
+
+Publishers call broker.publish(user_id, event, data); every open
+/notifications/stream of that user gets the event. Subscribers each own a small
+bounded queue, so a stalled client can never make publishers block: once its
+queue is full it is marked stale and resynchronized with a fresh counts event.
+
+The broker only reaches streams served by the same process. With several
+workers the stream also re-reads the user's counters on every heartbeat, so
+badges converge within one heartbeat even when the write happened elsewhere.
+Under the gevent worker the queues and locks below are cooperative, so an idle
+subscriber costs a parked greenlet rather than a thread or a worker.
+"""
+import json
+import queue
+import threading
+
+class Subscription:
+    """One open stream: a bounded queue of (event, data) pairs"""
+
+    def __init__(self, broker, user_id, max_queued=100):
+        self.broker = broker
+        self.user_id = user_id
+        self.stale = False
+        self._queue = queue.Queue(maxsize=max_queued)
+
+    def deliver(self, event, data):
+        try:
+            self._queue.put_nowait((event, data))
+        except queue.Full:
+            self.stale = True
+
+    def get(self, timeout):
+        """Next (event, data), or None after `timeout` seconds of silence"""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+class EventBroker:
+    def __init__(self, max_queued=100):
+        self.max_queued = max_queued
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self.published = 0
+        self.delivered = 0
+
+    def subscribe(self, user_id):
+        subscription = Subscription(self, user_id, self.max_queued)
+        with self._lock:
+            self._subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def has_subscribers(self, user_id):
+        return user_id in self._subscribers
+
+    def publish(self, user_id, event, data):
+        """Send an event to every stream of one user; returns how many got it"""
+        with self._lock:
+            subscribers = list(self._subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            subscription.deliver(event, data)
+        self.published += 1
+        self.delivered += len(subscribers)
+        return len(subscribers)
+
+    def stats(self):
+        with self._lock:
+            streams = sum(len(subscribers) for subscribers in self._subscribers.values())
+            users = len(self._subscribers)
+        return {'users': users, 'streams': streams, 'published': self.published, 'delivered': self.delivered}
+
+def format_sse(event, data, event_id=None):
+    """Encode one Server-Sent Event frame"""
+    frame = f'event: {event}\n'
+    if event_id is not None:
+        frame += f'id: {event_id}\n'
+    return frame + f'data: {json.dumps(data)}\n\n'
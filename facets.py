@@ -0,0 +1,208 @@
+"""Normalized tags, numeric funding/team size, and precomputed facet counts.
+
+The form still stores what the author typed in pitches.tags, funding_goal and
+team_size (the pitch page shows it as written). Alongside, post() fills
+pitches.funding_amount and team_size_min with parsed numbers, and pitch_tags
+with one row per normalized tag, so the feed can filter on them through an
+index instead of splitting strings.
+
+facet_counts holds the number of pitches per category, stage, funding bucket
+and tag. The triggers below keep it in step with every insert, update and
+delete on pitches and pitch_tags (including rows removed by ON DELETE CASCADE),
+so the browse API reads the counts instead of grouping the pitches table.
+Rows whose count drops to zero are kept and skipped when read.
+
+Usage: python facets.py [path/to/data.db]
+re-parses every pitch and recomputes the counts.
+"""
+import json
+import re
+import sqlite3
+import sys
+
+MAX_TAGS = 10
+MAX_TAG_LENGTH = 32
+
+# Largest integer SQLite can bind; bigger parsed numbers count as unknown
+MAX_SQL_INT = 2 ** 63 - 1
+
+# (facet value, lower bound, upper bound or None), on funding_amount in dollars
+FUNDING_BUCKETS = [
+    ('under-10k', 0, 10000),
+    ('10k-50k', 10000, 50000),
+    ('50k-250k', 50000, 250000),
+    ('250k-1m', 250000, 1000000),
+    ('1m-plus', 1000000, None),
+]
+
+def funding_bucket_sql(column):
+    """A CASE expression naming the funding bucket of `column` (NULL when it is NULL)"""
+    cases = ' '.join(f"WHEN {column} < {upper} THEN '{name}'" for name, _, upper in FUNDING_BUCKETS if upper)
+    return f"CASE WHEN {column} IS NULL THEN NULL {cases} ELSE '{FUNDING_BUCKETS[-1][0]}' END"
+
+def pitch_facets_sql(row):
+    """(facet, value) rows for one pitch row (`new` or `old` inside a trigger)"""
+    return (f"SELECT 'category' AS facet, {row}.category AS value "
+            f"UNION ALL SELECT 'stage', {row}.stage "
+            f"UNION ALL SELECT 'funding', {funding_bucket_sql(row + '.funding_amount')}")
+
+FACET_COLUMNS = {
+    'funding_amount': 'INTEGER',
+    'team_size_min': 'INTEGER',
+}
+
+FACET_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS tags (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE
+    )''',
+    # created_at is copied from the pitch, so a tag's pitches come out of the
+    # index already in feed order
+    '''CREATE TABLE IF NOT EXISTS pitch_tags (
+        pitch_id INTEGER NOT NULL,
+        tag_id INTEGER NOT NULL,
+        created_at TEXT,
+        PRIMARY KEY (pitch_id, tag_id),
+        FOREIGN KEY(pitch_id) REFERENCES pitches(id) ON DELETE CASCADE,
+        FOREIGN KEY(tag_id) REFERENCES tags(id)
+    ) WITHOUT ROWID''',
+    'CREATE INDEX IF NOT EXISTS idx_pitch_tags_feed ON pitch_tags(tag_id, created_at DESC, pitch_id DESC)',
+    '''CREATE TABLE IF NOT EXISTS facet_counts (
+        facet TEXT NOT NULL,
+        value TEXT NOT NULL,
+        count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (facet, value)
+    ) WITHOUT ROWID''',
+    'CREATE INDEX IF NOT EXISTS idx_facet_counts_top ON facet_counts(facet, count DESC)',
+
+    f'''CREATE TRIGGER IF NOT EXISTS pitches_facets_ai AFTER INSERT ON pitches BEGIN
+        INSERT INTO facet_counts (facet, value, count)
+        SELECT facet, value, 1 FROM ({pitch_facets_sql('new')}) WHERE value IS NOT NULL AND value != ''
+        ON CONFLICT(facet, value) DO UPDATE SET count = count + 1;
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS pitches_facets_ad AFTER DELETE ON pitches BEGIN
+        UPDATE facet_counts SET count = count - 1 WHERE (facet, value) IN ({pitch_facets_sql('old')});
+    END''',
+    f'''CREATE TRIGGER IF NOT EXISTS pitches_facets_au AFTER UPDATE OF category, stage, funding_amount ON pitches BEGIN
+        UPDATE facet_counts SET count = count - 1 WHERE (facet, value) IN ({pitch_facets_sql('old')});
+        INSERT INTO facet_counts (facet, value, count)
+        SELECT facet, value, 1 FROM ({pitch_facets_sql('new')}) WHERE value IS NOT NULL AND value != ''
+        ON CONFLICT(facet, value) DO UPDATE SET count = count + 1;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS pitch_tags_facets_ai AFTER INSERT ON pitch_tags BEGIN
+        INSERT INTO facet_counts (facet, value, count)
+        SELECT 'tag', name, 1 FROM tags WHERE id = new.tag_id
+        ON CONFLICT(facet, value) DO UPDATE SET count = count + 1;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS pitch_tags_facets_ad AFTER DELETE ON pitch_tags BEGIN
+        UPDATE facet_counts SET count = count - 1
+        WHERE facet = 'tag' AND value = (SELECT name FROM tags WHERE id = old.tag_id);
+    END''',
+]
+
+# Recompute every count from the source tables
+RECOUNT_SQL = [
+    'DELETE FROM facet_counts',
+    '''INSERT INTO facet_counts (facet, value, count)
+       SELECT 'category', category, COUNT(*) FROM pitches
+       WHERE category IS NOT NULL AND category != '' GROUP BY category''',
+    '''INSERT INTO facet_counts (facet, value, count)
+       SELECT 'stage', stage, COUNT(*) FROM pitches
+       WHERE stage IS NOT NULL AND stage != '' GROUP BY stage''',
+    f'''INSERT INTO facet_counts (facet, value, count)
+        SELECT 'funding', bucket, COUNT(*) FROM
+        (SELECT {funding_bucket_sql('funding_amount')} AS bucket FROM pitches WHERE funding_amount IS NOT NULL)
+        GROUP BY bucket''',
+    '''INSERT INTO facet_counts (facet, value, count)
+       SELECT 'tag', t.name, COUNT(*) FROM pitch_tags pt JOIN tags t ON t.id = pt.tag_id GROUP BY pt.tag_id''',
+    'DELETE FROM tags WHERE NOT EXISTS (SELECT 1 FROM pitch_tags WHERE pitch_tags.tag_id = tags.id)',
+]
+
+def parse_tags(text):
+    """Lower-cased, de-duplicated tags from comma-separated text, at most MAX_TAGS"""
+    tags = []
+    for part in (text or '').split(','):
+        tag = ' '.join(part.strip().lstrip('#').lower().split())[:MAX_TAG_LENGTH]
+        if tag and tag not in tags:
+            tags.append(tag)
+    return tags[:MAX_TAGS]
+
+def parse_funding(text):
+    """Whole dollars from e.g. "50000", "$50,000", "50k" or "1.5M"; None if there is no number"""
+    match = re.search(r'([0-9]+(?:\.[0-9]+)?)\s*([km]?)', (text or '').replace(',', '').lower())
+    if not match:
+        return None
+    # A float, so a long run of digits becomes inf rather than an int too big to bind
+    amount = float(match.group(1)) * {'': 1, 'k': 1000, 'm': 1000000}[match.group(2)]
+    return int(amount) if amount <= MAX_SQL_INT else None
+
+def parse_team_size(text):
+    """The smallest team size in e.g. "solo", "2-5", "11+" or "4"; None if unknown"""
+    text = (text or '').strip().lower()
+    if text == 'solo':
+        return 1
+    match = re.search(r'[0-9]+', text)
+    if not match or len(match.group()) > len(str(MAX_SQL_INT)):
+        return None
+    size = int(match.group())
+    return size if size <= MAX_SQL_INT else None
+
+def funding_range(bucket):
+    """(lower, upper or None) for a funding bucket name, or None if there is no such bucket"""
+    for name, lower, upper in FUNDING_BUCKETS:
+        if name == bucket:
+            return lower, upper
+    return None
+
+def set_pitch_tags(conn, pitch_id, tags, created_at):
+    """Make pitch_tags hold exactly `tags` (already normalized) for one pitch"""
+    names = json.dumps(tags)
+    conn.executemany('INSERT OR IGNORE INTO tags (name) VALUES (?)', [(tag,) for tag in tags])
+    conn.execute('''DELETE FROM pitch_tags WHERE pitch_id = ? AND tag_id NOT IN
+                    (SELECT id FROM tags WHERE name IN (SELECT value FROM json_each(?)))''', [pitch_id, names])
+    conn.execute('''INSERT OR IGNORE INTO pitch_tags (pitch_id, tag_id, created_at)
+                    SELECT ?, id, ? FROM tags WHERE name IN (SELECT value FROM json_each(?))''',
+                 [pitch_id, created_at, names])
+
+def index_pitches(conn, rows):
+    """Fill the numeric columns and pitch_tags from (id, tags, funding_goal, team_size, created_at) rows"""
+    conn.executemany('UPDATE pitches SET funding_amount = ?, team_size_min = ? WHERE id = ?',
+                     [(parse_funding(funding_goal), parse_team_size(team_size), pitch_id)
+                      for pitch_id, _, funding_goal, team_size, _ in rows])
+    for pitch_id, tags, _, _, created_at in rows:
+        set_pitch_tags(conn, pitch_id, parse_tags(tags), created_at)
+
+def create_facets(c):
+    """Add the numeric columns, tag tables, counts and triggers"""
+    existing = [column[1] for column in c.execute('PRAGMA table_info(pitches)').fetchall()]
+    for column_name, column_type in FACET_COLUMNS.items():
+        if column_name not in existing:
+            c.execute(f'ALTER TABLE pitches ADD COLUMN {column_name} {column_type}')
+    for statement in FACET_SCHEMA:
+        c.execute(statement)
+
+def recount(c):
+    """Recompute facet_counts from pitches and pitch_tags, and drop unused tags"""
+    for statement in RECOUNT_SQL:
+        c.execute(statement)
+
+def rebuild(c):
+    """Re-parse every pitch, then recompute the counts"""
+    rows = c.execute('SELECT id, tags, funding_goal, team_size, created_at FROM pitches').fetchall()
+    index_pitches(c, rows)
+    recount(c)
+    return len(rows)
+
+def rebuild_facets(db_path='data.db'):
+    """Rebuild the tag tables and facet counts in one transaction"""
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    create_facets(c)
+    count = rebuild(c)
+    conn.commit()
+    tags = c.execute('SELECT COUNT(*) FROM tags').fetchone()[0]
+    conn.close()
+    print(f'Facets rebuilt for {count} pitches ({tags} tags)')
+
+if __name__ == '__main__':
+    rebuild_facets(sys.argv[1] if len(sys.argv) > 1 else 'data.db')
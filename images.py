@@ -0,0 +1,204 @@
+"""Upload image pipeline: resized, metadata-free WebP and JPEG variants.
+
+post() saves the upload as-is and hands it to process_async(); a small worker
+pool writes the variants next to it in static/uploads/variants/. Templates ask
+image_sources() for the srcset URLs and fall back to the raw upload until the
+variants exist.
+
+Usage: python images.py [--force] [uploads_dir]   # backfill existing uploads
+"""
+import atexit
+import json
+import os
+import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# Variant name -> longest edge in pixels. Processed largest first, so the last
+# file written (the thumbnail JPEG) marks a finished set.
+VARIANTS = [('original', 2400), ('detail', 1200), ('thumb', 480)]
+FORMATS = [('webp', 'WEBP', {'quality': 80, 'method': 4}),
+           ('jpg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True})]
+VARIANT_DIR = 'variants'
+
+# Reject decompression bombs before decoding: 40 megapixels is far above any real cover image
+MAX_PIXELS = 40_000_000
+Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+
+IMAGE_WORKERS = int(os.environ.get('IMAGE_WORKERS', 2))
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+# (upload_dir, filename) -> {variant: width} of finished uploads; names never get new pixels
+_widths = {}
+MAX_CACHED_WIDTHS = 10000
+
+def variant_name(filename, variant, ext):
+    """Relative path (under the uploads folder) of one variant of an upload"""
+    stem = os.path.splitext(filename)[0]
+    return f'{VARIANT_DIR}/{stem}-{variant}.{ext}'
+
+def widths_name(filename):
+    """Relative path of the JSON file recording each variant's width in pixels"""
+    stem = os.path.splitext(filename)[0]
+    return f'{VARIANT_DIR}/{stem}-widths.json'
+
+def variant_files(filename):
+    """Every file generated for an upload, relative to the uploads folder"""
+    return ([variant_name(filename, variant, ext) for variant, _ in VARIANTS for ext, _, _ in FORMATS]
+            + [widths_name(filename)])
+
+def check_image(stream):
+    """Return an error message if the upload is not a usable image, else None.
+
+    Only the header is read, so this is cheap enough to run on the request thread.
+    """
+    try:
+        with Image.open(stream) as image:
+            width, height = image.size
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        return 'The uploaded file is not a valid image'
+    finally:
+        stream.seek(0)
+    if width * height > MAX_PIXELS:
+        return 'The uploaded image is too large (max 40 megapixels)'
+    return None
+
+def _save_atomic(image, path, pil_format, options):
+    tmp_path = f'{path}.tmp'
+    image.save(tmp_path, pil_format, **options)
+    os.replace(tmp_path, path)
+
+def process_upload(upload_dir, filename, force=False):
+    """Write every variant of one upload; returns False if it is not a readable image"""
+    os.makedirs(os.path.join(upload_dir, VARIANT_DIR), exist_ok=True)
+    if not force and os.path.exists(os.path.join(upload_dir, variant_name(filename, 'thumb', 'jpg'))):
+        return True
+    try:
+        with Image.open(os.path.join(upload_dir, filename)) as source:
+            # Apply the EXIF rotation, then drop EXIF/ICC/XMP by copying only the pixels
+            # (animated GIFs keep their first frame)
+            image = ImageOps.exif_transpose(source)
+            image = image.convert('RGBA' if image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        return False
+
+    resized = image
+    previous = None
+    widths = {}
+    for variant, max_edge in VARIANTS:
+        paths = {ext: os.path.join(upload_dir, variant_name(filename, variant, ext)) for ext, _, _ in FORMATS}
+        if previous and max(resized.size) <= max_edge:
+            # Smaller than this cap already: same pixels as the previous variant, so skip the re-encode
+            for ext, path in paths.items():
+                shutil.copyfile(previous[ext], path)
+            previous = paths
+            widths[variant] = resized.width
+            continue
+        # Each variant is downscaled from the previous (larger) one
+        resized = resized.copy()
+        resized.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        # JPEG has no alpha channel: flatten onto white
+        flat = resized
+        if resized.mode == 'RGBA':
+            flat = Image.new('RGB', resized.size, (255, 255, 255))
+            flat.paste(resized, mask=resized.getchannel('A'))
+        for ext, pil_format, options in FORMATS:
+            target = resized if pil_format == 'WEBP' else flat
+            _save_atomic(target, paths[ext], pil_format, options)
+        previous = paths
+        widths[variant] = resized.width
+    _write_widths(upload_dir, filename, widths)
+    return True
+
+def _write_widths(upload_dir, filename, widths):
+    path = os.path.join(upload_dir, widths_name(filename))
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(widths, f)
+    os.replace(f'{path}.tmp', path)
+
+def _read_widths(upload_dir, filename):
+    """{variant: width} from the widths file, or measured from the variants made before it existed"""
+    try:
+        with open(os.path.join(upload_dir, widths_name(filename))) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        pass
+    widths = {}
+    for variant, _ in VARIANTS:
+        # Opening reads only the header
+        with Image.open(os.path.join(upload_dir, variant_name(filename, variant, 'jpg'))) as image:
+            widths[variant] = image.width
+    try:
+        _write_widths(upload_dir, filename, widths)
+    except OSError:
+        pass
+    return widths
+
+def _get_executor():
+    global _executor, _executor_pid
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(max_workers=IMAGE_WORKERS, thread_name_prefix='images')
+                _executor_pid = os.getpid()
+    return _executor
+
+def process_async(upload_dir, filename):
+    """Queue an upload for processing off the request thread; returns a Future"""
+    return _get_executor().submit(process_upload, upload_dir, filename)
+
+def shutdown(wait=True):
+    """Finish queued uploads; registered to run at exit"""
+    if _executor is not None and _executor_pid == os.getpid():
+        _executor.shutdown(wait=wait)
+
+atexit.register(shutdown)
+
+def image_sources(upload_dir, filename):
+    """{ext: [(path, width), ...]} for an upload's variants, smallest first, or None until they exist.
+
+    Widths are the variants' real ones (a portrait or small image is narrower
+    than the cap); variants of the same width, copies of a small image, are listed once.
+    """
+    if not filename or filename == 'None':
+        return None
+    key = (upload_dir, filename)
+    widths = _widths.get(key)
+    if widths is None:
+        if not os.path.exists(os.path.join(upload_dir, variant_name(filename, 'thumb', 'jpg'))):
+            return None
+        try:
+            widths = _read_widths(upload_dir, filename)
+        except (OSError, UnidentifiedImageError):
+            return None
+        if len(_widths) >= MAX_CACHED_WIDTHS:
+            _widths.clear()
+        _widths[key] = widths
+    variants = {}
+    for variant, _ in reversed(VARIANTS):
+        variants.setdefault(widths[variant], variant)
+    return {ext: [(f'uploads/{variant_name(filename, variant, ext)}', width) for width, variant in variants.items()]
+            for ext, _, _ in FORMATS}
+
+def backfill(upload_dir, force=False):
+    """Generate variants for every existing upload, using the worker pool"""
+    filenames = [name for name in sorted(os.listdir(upload_dir))
+                 if os.path.isfile(os.path.join(upload_dir, name)) and not name.endswith('.tmp')]
+    executor = ThreadPoolExecutor(max_workers=max(IMAGE_WORKERS, os.cpu_count() or 1))
+    futures = {name: executor.submit(process_upload, upload_dir, name, force) for name in filenames}
+    failed = [name for name, future in futures.items() if not future.result()]
+    executor.shutdown()
+    for name in failed:
+        print(f'Skipped (not an image): {name}')
+    print(f'Processed {len(filenames) - len(failed)} uploads')
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != '--force']
+    backfill(args[0] if args else os.path.join(os.path.dirname(__file__), 'static', 'uploads'),
+             force='--force' in sys.argv[1:])
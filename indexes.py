@@ -0,0 +1,84 @@
+# Secondary indexes for the queries in app.py. check_query_plans.py fails if a
+# route's SQL falls back to a full scan of a large table, so add the index here
+# when adding a query.
+
+NOTIFICATION_INDEXES = [
+    # Notification list, newest first, keyset-paged on (created_at, id)
+    '''CREATE INDEX IF NOT EXISTS idx_notifications_user_page
+       ON notifications(user_id, created_at DESC, id DESC)''',
+    # Unread notifications per user (partial: read rows are the vast majority)
+    '''CREATE INDEX IF NOT EXISTS idx_notifications_unread
+       ON notifications(user_id) WHERE is_read = 0''',
+    # Retention: read notifications by age (see retention.py)
+    '''CREATE INDEX IF NOT EXISTS idx_notifications_read_created
+       ON notifications(created_at) WHERE is_read = 1''',
+    # Notifications about a deleted pitch or user (see purge.py)
+    '''CREATE INDEX IF NOT EXISTS idx_notifications_related
+       ON notifications(related_type, related_id)''',
+]
+
+INDEXES = [
+    # Feed: keyset pagination on (created_at, id); author_id resolves the join
+    '''CREATE INDEX IF NOT EXISTS idx_pitches_feed
+       ON pitches(created_at DESC, id DESC, author_id)''',
+    # A user's pitches (dashboard, admin counts, cascades from users)
+    '''CREATE INDEX IF NOT EXISTS idx_pitches_author_created
+       ON pitches(author_id, created_at DESC)''',
+    # Comments under a pitch, and a user's comments
+    '''CREATE INDEX IF NOT EXISTS idx_comments_pitch_created
+       ON comments(pitch_id, created_at DESC)''',
+    '''CREATE INDEX IF NOT EXISTS idx_comments_user
+       ON comments(user_id)''',
+    # A user's likes (likes by pitch use the UNIQUE(pitch_id, user_id) index)
+    '''CREATE INDEX IF NOT EXISTS idx_likes_user
+       ON likes(user_id)''',
+    # A user's messages (cascades from users) and unread messages per receiver
+    '''CREATE INDEX IF NOT EXISTS idx_messages_receiver_created
+       ON messages(receiver_id, created_at DESC)''',
+    '''CREATE INDEX IF NOT EXISTS idx_messages_sender_created
+       ON messages(sender_id, created_at DESC)''',
+    '''CREATE INDEX IF NOT EXISTS idx_messages_unread
+       ON messages(receiver_id) WHERE is_read = 0''',
+    # Thread view: a conversation's messages, newest first, paged on id
+    '''CREATE INDEX IF NOT EXISTS idx_messages_conversation
+       ON messages(conversation_id, id DESC)''',
+    # Inbox: a user's conversations by latest message, keyset-paged
+    '''CREATE INDEX IF NOT EXISTS idx_conversation_members_inbox
+       ON conversation_members(user_id, last_message_at DESC, conversation_id DESC)''',
+    # Cascades from users on the other side of a conversation
+    '''CREATE INDEX IF NOT EXISTS idx_conversation_members_other
+       ON conversation_members(other_id)''',
+    '''CREATE INDEX IF NOT EXISTS idx_conversations_user_high
+       ON conversations(user_high)''',
+    # Admin user list, keyset-paged on (created_at, id), optionally for one role;
+    # the role index also counts users per role for the admin statistics
+    '''CREATE INDEX IF NOT EXISTS idx_users_page
+       ON users(created_at DESC, id DESC)''',
+    '''CREATE INDEX IF NOT EXISTS idx_users_role
+       ON users(role, created_at DESC, id DESC)''',
+    # Admin pitch list filtered by category, and pitches per category
+    '''CREATE INDEX IF NOT EXISTS idx_pitches_category
+       ON pitches(category, created_at DESC, id DESC)''',
+    # Feed filtered by stage (see feed_filters in app.py)
+    '''CREATE INDEX IF NOT EXISTS idx_pitches_stage
+       ON pitches(stage, created_at DESC, id DESC)''',
+] + NOTIFICATION_INDEXES
+
+# Superseded by the composite indexes above
+DROPPED_INDEXES = [
+    'idx_notifications_user_id',
+    'idx_notifications_is_read',
+    'idx_notifications_created_at',
+    'idx_notifications_user_created',
+    'idx_users_created',
+    'idx_messages_receiver',
+    'idx_messages_sender',
+    'idx_messages_created_at',
+]
+
+def create_indexes(c):
+    """Create the secondary indexes and drop the ones they replace"""
+    for statement in INDEXES:
+        c.execute(statement)
+    for name in DROPPED_INDEXES:
+        c.execute(f'DROP INDEX IF EXISTS {name}')
@@ -0,0 +1,196 @@
+"""Opt-in request and SQL instrumentation, exported in the Prometheus text format.
+
+With METRICS=1 the app times every request (a latency histogram per endpoint)
+and every SQL statement run through the pool (count and total time per
+normalized statement), counts the statements each request runs, and flags N+1
+patterns: one statement repeated more than `n_plus_one` times in a request,
+which is almost always a query inside a loop over rows. GET /metrics serves it
+all. With METRICS unset none of the hooks are installed, so requests and
+statements run exactly as before.
+
+SamplingProfiler (also only with METRICS=1): while started it samples the stack of every
+thread serving a request `hz` times a second and keeps the counts per endpoint
+as folded stacks ("endpoint;module:function;... count"), the input format of
+flamegraph.pl and speedscope. Under the gevent worker all requests share one
+thread, so a sample shows only the greenlet that happened to be running.
+"""
+import logging
+import sys
+import threading
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Histogram buckets, in seconds and in statements per request
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+# Longest statement text kept as a label
+MAX_QUERY_LABEL = 200
+
+@lru_cache(maxsize=1024)
+def normalize_sql(sql):
+    """One line of statement text, so the same query always gets the same label"""
+    return ' '.join(sql.split())[:MAX_QUERY_LABEL]
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class Histogram:
+    """Cumulative-bucket histogram (not thread-safe; Metrics holds the lock)"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+
+    def lines(self, name, labels):
+        pairs = [f'{key}="{escape_label(value)}"' for key, value in labels.items()]
+        selector = '{' + ','.join(pairs) + '}' if pairs else ''
+        total = 0
+        for bound, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            le = 'le="%s"' % bound
+            yield f'{name}_bucket{{{",".join(pairs + [le])}}} {total}'
+        yield f'{name}_sum{selector} {self.sum:.6f}'
+        yield f'{name}_count{selector} {total}'
+
+class Metrics:
+    def __init__(self, n_plus_one=5):
+        self.n_plus_one = n_plus_one
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._query_counts = Histogram(QUERY_COUNT_BUCKETS)
+        self._sql = defaultdict(lambda: [0, 0.0, 0.0])  # count, total seconds, max seconds
+        self._n_plus_one = Counter()
+
+    def record_query(self, sql, seconds):
+        """Add one statement's timing; called by the pool for every execute()"""
+        query = normalize_sql(sql)
+        with self._lock:
+            stats = self._sql[query]
+            stats[0] += 1
+            stats[1] += seconds
+            if seconds > stats[2]:
+                stats[2] = seconds
+        return query
+
+    def record_request(self, endpoint, method, status, seconds, statements):
+        """Add one request; `statements` counts each normalized statement it ran"""
+        endpoint = endpoint or 'unknown'
+        repeated = [query for query, count in statements.items() if count > self.n_plus_one]
+        with self._lock:
+            key = (endpoint, method, f'{status // 100}xx')
+            histogram = self._requests.get(key)
+            if histogram is None:
+                histogram = self._requests[key] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+            self._query_counts.observe(sum(statements.values()))
+            for query in repeated:
+                first = (endpoint, query) not in self._n_plus_one
+                self._n_plus_one[endpoint, query] += 1
+                if first:
+                    logger.warning('Possible N+1 in %s: %d runs of %s', endpoint, statements[query], query)
+        return repeated
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        with self._lock:
+            lines = ['# HELP ideabridge_request_seconds Request latency by endpoint',
+                     '# TYPE ideabridge_request_seconds histogram']
+            for (endpoint, method, status), histogram in sorted(self._requests.items()):
+                lines += histogram.lines('ideabridge_request_seconds',
+                                         {'endpoint': endpoint, 'method': method, 'status': status})
+            lines += ['# HELP ideabridge_request_queries SQL statements run per request',
+                      '# TYPE ideabridge_request_queries histogram']
+            lines += self._query_counts.lines('ideabridge_request_queries', {})
+            lines += ['# HELP ideabridge_sql_queries_total Statements run, by normalized text',
+                      '# TYPE ideabridge_sql_queries_total counter']
+            lines += [f'ideabridge_sql_queries_total{{query="{escape_label(query)}"}} {count}'
+                      for query, (count, _, _) in sorted(self._sql.items())]
+            lines += ['# HELP ideabridge_sql_seconds_total Time spent in execute(), by normalized text',
+                      '# TYPE ideabridge_sql_seconds_total counter']
+            lines += [f'ideabridge_sql_seconds_total{{query="{escape_label(query)}"}} {total:.6f}'
+                      for query, (_, total, _) in sorted(self._sql.items())]
+            lines += ['# HELP ideabridge_sql_max_seconds Slowest single execute(), by normalized text',
+                      '# TYPE ideabridge_sql_max_seconds gauge']
+            lines += [f'ideabridge_sql_max_seconds{{query="{escape_label(query)}"}} {longest:.6f}'
+                      for query, (_, _, longest) in sorted(self._sql.items())]
+            lines += ['# HELP ideabridge_n_plus_one_total Requests that repeated one statement too often',
+                      '# TYPE ideabridge_n_plus_one_total counter']
+            lines += [f'ideabridge_n_plus_one_total{{endpoint="{escape_label(endpoint)}",'
+                      f'query="{escape_label(query)}"}} {count}'
+                      for (endpoint, query), count in sorted(self._n_plus_one.items())]
+        return '\n'.join(lines) + '\n'
+
+class SamplingProfiler:
+    """Samples the stacks of threads serving requests; see the module docstring"""
+
+    def __init__(self, hz=100, max_depth=64):
+        self.hz = hz
+        self.max_depth = max_depth
+        # Thread ident -> endpoint, maintained by the app's request hooks
+        self.active = {}
+        self.samples = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def reset(self):
+        with self._lock:
+            self.samples = Counter()
+
+    def _run(self):
+        interval = 1.0 / self.hz
+        while not self._stop.wait(interval):
+            frames = sys._current_frames()
+            stacks = [self._stack(endpoint, frames[ident])
+                      for ident, endpoint in list(self.active.items()) if ident in frames]
+            with self._lock:
+                self.samples.update(stacks)
+
+    def _stack(self, endpoint, frame):
+        stack = []
+        while frame is not None and len(stack) < self.max_depth:
+            code = frame.f_code
+            stack.append(f'{frame.f_globals.get("__name__", "?")}:{code.co_name}')
+            frame = frame.f_back
+        return (endpoint,) + tuple(reversed(stack))
+
+    def sample_count(self):
+        with self._lock:
+            return sum(self.samples.values())
+
+    def folded(self, endpoint=None):
+        """Folded stacks, one "frame;frame;... count" line each, optionally for one endpoint"""
+        with self._lock:
+            samples = self.samples.most_common()
+        return ''.join(f'{";".join(stack)} {count}\n' for stack, count in samples
+                       if endpoint is None or stack[0] == endpoint)
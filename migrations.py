@@ -0,0 +1,291 @@
+"""Numbered schema migrations, recorded in the schema_version table.
+
+Usage: python migrations.py [path/to/data.db] [--status]
+
+migrate() applies every step newer than the database's recorded version, all in
+one transaction, so a failed step leaves the schema as it was. The app calls it
+on startup; when nothing is pending that is one indexed read. Concurrent workers
+serialize on BEGIN IMMEDIATE and re-check the version once they hold the lock.
+
+To change the schema, append a step to MIGRATIONS with the next version number;
+never edit one that has shipped. Steps must also be safe on a database built by
+the old init_db/migrate_db scripts, which has the tables but no schema_version,
+so they use IF NOT EXISTS and check columns before adding them.
+
+A step that has to rewrite every row of a large table gives a backfill as well.
+It runs after the schema commit, batch_size rows per short write transaction,
+so the site keeps serving writes meanwhile; the version is marked done once it
+finds nothing left to do, and an interrupted backfill resumes on the next run.
+A backfill is called as backfill(conn, batch_size, position) and returns (rows
+handled, new position); the position is saved after each batch, for backfills
+that walk the table by id rather than by a condition (see batch_update).
+Code reading a backfilled column must therefore cope with rows not reached yet.
+"""
+import argparse
+import sqlite3
+import time
+from datetime import datetime
+
+from add_interactions import create_interaction_tables
+from conversations import create_conversations, rebuild
+from counters import create_counters, reconcile
+from facets import create_facets, index_pitches, recount as recount_facets
+from indexes import create_indexes
+from purge import create_purge_table
+from search_index import create_search_index
+from trending import create_trending_tables
+from uploads import create_upload_table, recount
+from view_counter import create_view_tables
+
+VERSION_SCHEMA = '''CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    applied_at TEXT NOT NULL,
+    duration_ms REAL NOT NULL,
+    backfill_pending INTEGER NOT NULL DEFAULT 0,
+    backfill_position INTEGER
+)'''
+
+# Columns added to pitches after the first release
+PITCH_COLUMNS = ['category', 'tags', 'image', 'funding_goal', 'stage', 'team_size',
+                 'location', 'website', 'demo_url', 'looking_for']
+
+def add_column(c, table, column, definition):
+    """ALTER TABLE ... ADD COLUMN unless the column is already there; returns True if added"""
+    if column in [row[1] for row in c.execute(f'PRAGMA table_info({table})').fetchall()]:
+        return False
+    c.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    return True
+
+def batch_update(table, assignment, condition):
+    """A backfill that runs `UPDATE table SET assignment` on rows matching condition.
+
+    The condition must stop matching a row once it is updated (e.g. `col IS NULL`).
+    """
+    def backfill(conn, batch_size, position):
+        changed = conn.execute(f'''UPDATE {table} SET {assignment} WHERE rowid IN
+                                   (SELECT rowid FROM {table} WHERE {condition} LIMIT ?)''',
+                               [batch_size]).rowcount
+        return changed, None
+    return backfill
+
+def base_schema(c):
+    """Users, pitches, notifications, likes, comments and messages"""
+    c.execute('CREATE TABLE IF NOT EXISTS users (id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL, password_hash TEXT NOT NULL, role TEXT NOT NULL DEFAULT "user", created_at TEXT)')
+    c.execute('''CREATE TABLE IF NOT EXISTS pitches (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        summary TEXT,
+        content TEXT NOT NULL,
+        category TEXT,
+        tags TEXT,
+        image TEXT,
+        funding_goal TEXT,
+        stage TEXT,
+        team_size TEXT,
+        location TEXT,
+        website TEXT,
+        demo_url TEXT,
+        looking_for TEXT,
+        author_id INTEGER,
+        created_at TEXT,
+        FOREIGN KEY(author_id) REFERENCES users(id)
+    )''')
+    for column in PITCH_COLUMNS:
+        add_column(c, 'pitches', column, 'TEXT')
+    c.execute('''CREATE TABLE IF NOT EXISTS notifications (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        title TEXT NOT NULL,
+        message TEXT NOT NULL,
+        related_id INTEGER,
+        related_type TEXT,
+        is_read INTEGER DEFAULT 0,
+        created_at TEXT NOT NULL,
+        FOREIGN KEY(user_id) REFERENCES users(id) ON DELETE CASCADE
+    )''')
+    create_interaction_tables(c)
+
+def search_index(c):
+    """Full-text search index over the pitch text fields"""
+    if create_search_index(c):
+        c.execute("INSERT INTO pitches_fts(pitches_fts) VALUES ('rebuild')")
+
+def counters(c):
+    """Denormalized like/comment/unread counters and site totals"""
+    if create_counters(c):
+        reconcile(c)
+
+def upload_refs(c):
+    """Refcounts of content-addressed uploads"""
+    if create_upload_table(c):
+        recount(c)
+
+def conversation_index(c):
+    """Messages grouped into conversations per participant pair"""
+    if create_conversations(c):
+        rebuild(c)
+
+def purge_jobs(c):
+    """Queue of users being deleted in the background"""
+    create_purge_table(c)
+
+def secondary_indexes(c):
+    """Composite and covering indexes, replacing the old single-column ones"""
+    create_indexes(c)
+
+def facet_index(c):
+    """Normalized tags, numeric funding and team size, and facet counts"""
+    create_facets(c)
+    # Picks up idx_pitches_stage
+    create_indexes(c)
+    # Category and stage are counted now; funding and tags as the backfill reaches each row
+    recount_facets(c)
+
+def backfill_facets(conn, batch_size, position):
+    """Parse the tags, funding goal and team size of the next pitches after id `position`"""
+    rows = conn.execute('''SELECT id, tags, funding_goal, team_size, created_at FROM pitches
+                           WHERE id > ? ORDER BY id LIMIT ?''', [position or 0, batch_size]).fetchall()
+    index_pitches(conn, rows)
+    return len(rows), (rows[-1][0] if rows else position)
+
+def trending_scores(c):
+    """Time-decayed trending scores (filled by the app's first rebuild)"""
+    create_trending_tables(c)
+
+def view_counts(c):
+    """Per-pitch view counts and the log of flushed views"""
+    create_view_tables(c)
+
+# (version, upgrade, backfill or None), in order
+MIGRATIONS = [
+    (1, base_schema, None),
+    (2, search_index, None),
+    (3, counters, None),
+    (4, upload_refs, None),
+    (5, conversation_index, None),
+    (6, purge_jobs, None),
+    (7, secondary_indexes, None),
+    (8, facet_index, backfill_facets),
+    (9, trending_scores, None),
+    (10, view_counts, None),
+]
+
+LATEST = MIGRATIONS[-1][0]
+
+def connect(db_path, busy_timeout_ms=30000):
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute(f'PRAGMA busy_timeout = {busy_timeout_ms}')
+    return conn
+
+def current_version(conn):
+    """(recorded version, versions with an unfinished backfill); (0, []) for a new database"""
+    try:
+        rows = conn.execute('SELECT version, backfill_pending FROM schema_version').fetchall()
+    except sqlite3.OperationalError:
+        return 0, []
+    return max([row[0] for row in rows], default=0), [row[0] for row in rows if row[1]]
+
+def apply_pending(conn, verbose=False):
+    """Run every step newer than the recorded version in one transaction; returns the versions applied"""
+    if conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()[0] == 0:
+        # Lets retention.py hand freed pages back; only settable before the
+        # first table exists, and not inside a transaction
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute(VERSION_SCHEMA)
+        add_column(conn, 'schema_version', 'backfill_position', 'INTEGER')
+        # Another process may have migrated while this one waited for the lock
+        version, _ = current_version(conn)
+        applied = []
+        for step, upgrade, backfill in MIGRATIONS:
+            if step <= version:
+                continue
+            started = time.perf_counter()
+            upgrade(conn)
+            duration_ms = round((time.perf_counter() - started) * 1000, 3)
+            conn.execute('''INSERT INTO schema_version (version, name, applied_at, duration_ms, backfill_pending)
+                            VALUES (?, ?, ?, ?, ?)''',
+                         [step, upgrade.__name__, datetime.utcnow().isoformat(), duration_ms,
+                          int(backfill is not None)])
+            applied.append(step)
+            if verbose:
+                print(f'Applied {step}: {upgrade.__doc__} ({duration_ms:.0f} ms)')
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    return applied
+
+def run_backfills(conn, versions, batch_size=1000, pause=0.01, verbose=False):
+    """Finish the backfills of `versions`, one batch per write transaction"""
+    backfills = {step: backfill for step, _, backfill in MIGRATIONS}
+    for step in versions:
+        backfill = backfills[step]
+        position = conn.execute('SELECT backfill_position FROM schema_version WHERE version = ?',
+                                [step]).fetchone()[0]
+        total = 0
+        while True:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                changed, position = backfill(conn, batch_size, position) if backfill else (0, None)
+                if changed < batch_size:
+                    conn.execute('UPDATE schema_version SET backfill_pending = 0 WHERE version = ?', [step])
+                else:
+                    conn.execute('UPDATE schema_version SET backfill_position = ? WHERE version = ?',
+                                 [position, step])
+                conn.execute('COMMIT')
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            total += changed
+            if changed < batch_size:
+                break
+            # Let request writes in between batches
+            time.sleep(pause)
+        if verbose:
+            print(f'Backfilled {step}: {total} rows')
+
+def migrate(db_path='data.db', batch_size=1000, verbose=False):
+    """Bring the database up to LATEST; returns the versions applied"""
+    conn = connect(db_path)
+    try:
+        version, pending = current_version(conn)
+        if version == LATEST and not pending:
+            return []
+        applied = apply_pending(conn, verbose) if version < LATEST else []
+        _, pending = current_version(conn)
+        run_backfills(conn, pending, batch_size, verbose=verbose)
+        return applied
+    finally:
+        conn.close()
+
+def print_status(db_path):
+    conn = connect(db_path)
+    version, pending = current_version(conn)
+    applied = {}
+    if version:
+        applied = {row[0]: row[1:] for row in conn.execute(
+            'SELECT version, applied_at, duration_ms FROM schema_version')}
+    conn.close()
+    for step, upgrade, _ in MIGRATIONS:
+        if step in applied:
+            applied_at, duration_ms = applied[step]
+            state = f'applied {applied_at} ({duration_ms:.0f} ms)' + (', backfill pending' if step in pending else '')
+        else:
+            state = 'pending'
+        print(f'{step:3d} {upgrade.__name__:20s} {state}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Apply pending schema migrations')
+    parser.add_argument('db_path', nargs='?', default='data.db')
+    parser.add_argument('--status', action='store_true', help='list migrations instead of applying them')
+    parser.add_argument('--batch', type=int, default=1000, help='rows per backfill transaction')
+    args = parser.parse_args()
+    if args.status:
+        print_status(args.db_path)
+    else:
+        applied = migrate(args.db_path, args.batch, verbose=True)
+        print(f'Database at version {LATEST}' + ('' if applied else ' (nothing to do)'))
@@ -0,0 +1,191 @@
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+INSERT_NOTIFICATION = '''INSERT INTO notifications
+                         (user_id, type, title, message, related_id, related_type, created_at)
+                         VALUES (?, ?, ?, ?, ?, ?, ?)'''
+
+# Notification types whose repeats within one batch are merged into a single row
+COLLAPSE_TYPES = ('like', 'comment')
+
+_STOP = object()
+
+class NotificationQueue:
+    """In-process notification fan-out.
+
+    Request handlers put() notifications and return immediately; a worker thread
+    drains the queue and writes each batch with one executemany in one
+    transaction. Repeats for the same recipient and pitch in a batch can be
+    collapsed, so five likes arriving together become
+    "alice and 4 others liked your pitch".
+    """
+
+    def __init__(self, pool, batch_size=200, flush_interval=0.5, max_size=10000, collapse=True):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self.collapse = collapse
+        # Called with the rows of each written batch (e.g. to push them to live streams)
+        self.on_written = None
+        self._start_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._queue = queue.Queue(maxsize=self.max_size)
+        self._thread = None
+        self._stopped = False
+        self._stats = {'enqueued': 0, 'written': 0, 'collapsed': 0, 'dropped': 0,
+                       'batches': 0, 'last_batch_size': 0, 'last_batch_ms': 0.0}
+
+    def put(self, user_id, notification_type, title, message, related_id=None, related_type=None,
+            actor=None):
+        """Queue a notification; `{actor}` in the message is replaced by the actor's name"""
+        item = (user_id, notification_type, title, message, related_id, related_type, actor,
+                datetime.utcnow().isoformat())
+        self._ensure_worker()
+        self._stats['enqueued'] += 1
+        if self._stopped:
+            self._write([item])
+            return
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # Backpressure: write inline rather than drop the notification
+            self._write([item])
+
+    def _ensure_worker(self):
+        if self._pid != os.getpid():
+            self._reset()
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='notification-queue', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+            try:
+                self._write(batch)
+            except Exception:
+                # The worker must outlive a bad batch, or every later put() would pile up unwritten
+                logger.exception('Notification batch of %d could not be written', len(batch))
+                self._stats['dropped'] += len(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _collapse(self, items):
+        """Merge collapsible notifications that share a recipient, type and target"""
+        groups = OrderedDict()
+        for item in items:
+            user_id, notification_type, _, _, related_id, related_type, actor, _ = item
+            if self.collapse and actor is not None and notification_type in COLLAPSE_TYPES:
+                key = (user_id, notification_type, related_id, related_type)
+            else:
+                key = object()
+            groups.setdefault(key, []).append(item)
+
+        rows = []
+        for group in groups.values():
+            user_id, notification_type, title, message, related_id, related_type, actor, _ = group[0]
+            created_at = group[-1][7]
+            actors = list(OrderedDict.fromkeys(item[6] for item in group if item[6] is not None))
+            if len(actors) == 2:
+                actor = f'{actors[0]} and {actors[1]}'
+            elif len(actors) > 2:
+                actor = f'{actors[0]} and {len(actors) - 1} others'
+            if actor is not None:
+                message = message.replace('{actor}', actor)
+            self._stats['collapsed'] += len(group) - 1
+            rows.append((user_id, notification_type, title, message, related_id, related_type, created_at))
+        return rows
+
+    def _write(self, items):
+        rows = self._collapse(items)
+        started = time.perf_counter()
+        try:
+            with self.pool.writer() as conn:
+                conn.executemany(INSERT_NOTIFICATION, rows)
+        except Exception:
+            # One bad row (e.g. a recipient deleted meanwhile) must not sink the batch
+            logger.exception('Notification batch failed; retrying rows one by one')
+            written = []
+            for row in rows:
+                try:
+                    with self.pool.writer() as conn:
+                        conn.execute(INSERT_NOTIFICATION, row)
+                    written.append(row)
+                except Exception:
+                    self._stats['dropped'] += 1
+            rows = written
+        self._stats['written'] += len(rows)
+        if rows and self.on_written is not None:
+            try:
+                self.on_written(rows)
+            except Exception:
+                logger.exception('Notification on_written hook failed')
+        self._stats['batches'] += 1
+        self._stats['last_batch_size'] = len(rows)
+        self._stats['last_batch_ms'] = round((time.perf_counter() - started) * 1000, 3)
+
+    def flush(self, timeout=5.0):
+        """Block until everything queued so far has been written (or timeout)"""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.005)
+        return self._queue.unfinished_tasks == 0
+
+    def stop(self, timeout=5.0):
+        """Flush pending notifications and stop the worker; later puts write inline"""
+        if self._pid != os.getpid() or self._thread is None or self._stopped:
+            self._stopped = True
+            return
+        self._stopped = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        # Anything that raced in behind the stop marker is written here
+        leftovers = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftovers.append(item)
+            self._queue.task_done()
+        if leftovers:
+            self._write(leftovers)
+
+    def stats(self):
+        """Queue depth and delivery counters"""
+        return dict(self._stats, depth=self._queue.qsize(),
+                    running=self._thread is not None and self._thread.is_alive())
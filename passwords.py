@@ -0,0 +1,155 @@
+"""Password hashing off the request path, and a login attempt limiter.
+
+The hash method comes from PASSWORD_HASH_METHOD in werkzeug's notation (e.g.
+"pbkdf2:sha256:600000" or "scrypt:32768:8:1"). A stored hash made with other
+parameters still verifies; needs_rehash() tells login() to store a new one.
+
+Hashes are computed by a small pool of real OS threads (hashlib releases the
+GIL), at most `workers` at a time. Under the gevent worker that is gevent's
+native threadpool, so the hub keeps serving pages while a hash runs. When more
+than `max_pending` hashes are already queued, submit() raises HasherBusy
+instead of queueing more, so a login flood gets a quick "try again" rather
+than holding every worker.
+
+AttemptLimiter counts failed logins per key (client IP, username) in a sliding
+window and answers before any hash is computed. It is in memory and per
+process, so with several workers the effective limit is that many times higher.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+class HasherBusy(Exception):
+    """Too many hashes are already waiting; the caller should answer 503"""
+
+class PasswordHasher:
+    def __init__(self, method='pbkdf2:sha256:600000', workers=2, max_pending=32):
+        self.method = method
+        self.workers = workers
+        self.max_pending = max_pending
+        self._dummy_hash = None
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._executor = None
+
+    @property
+    def dummy_hash(self):
+        """Compared against when the user does not exist, so that takes as long as a wrong password"""
+        if self._dummy_hash is None:
+            self._dummy_hash = generate_password_hash(os.urandom(16).hex(), self.method)
+        return self._dummy_hash
+
+    @property
+    def prefix(self):
+        """What werkzeug writes before the salt for this method (e.g. pbkdf2:sha256:600000)"""
+        return self.dummy_hash.split('$', 1)[0]
+
+    def _pool(self):
+        if self._pid != os.getpid():
+            self._reset()
+        if self._executor is None:
+            try:
+                from gevent import monkey
+                patched = monkey.is_module_patched('threading')
+            except ImportError:
+                patched = False
+            if patched:
+                # Patched threads are greenlets; hashing must leave the hub's thread
+                from gevent.threadpool import ThreadPool
+                self._executor = ThreadPool(self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='hasher')
+        return self._executor
+
+    def submit(self, function, *args):
+        """Run function(*args) on the hashing pool and wait for it; raises HasherBusy when full"""
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise HasherBusy()
+            self._pending += 1
+        try:
+            pool = self._pool()
+            if isinstance(pool, ThreadPoolExecutor):
+                return pool.submit(function, *args).result()
+            return pool.apply(function, args)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def hash(self, password):
+        return self.submit(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        """Check a password; pwhash None (no such user) costs the same as a wrong password"""
+        matches = self.submit(check_password_hash, pwhash or self.dummy_hash, password)
+        return matches and pwhash is not None
+
+    def needs_rehash(self, pwhash):
+        """True if pwhash was made with other parameters than the configured method"""
+        return pwhash.split('$', 1)[0] != self.prefix
+
+    def stats(self):
+        return {'method': self.prefix, 'workers': self.workers, 'pending': self._pending,
+                'max_pending': self.max_pending}
+
+class AttemptLimiter:
+    """Sliding-window failure counts per key, for at most max_keys keys (least recently used dropped)"""
+
+    def __init__(self, limit, window_seconds, max_keys=10000):
+        self.limit = limit
+        self.window = window_seconds
+        self.max_keys = max_keys
+        self._attempts = OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _recent(self, key, now):
+        attempts = self._attempts.get(key)
+        if attempts is None:
+            return None
+        while attempts and attempts[0] <= now - self.window:
+            attempts.popleft()
+        if not attempts:
+            del self._attempts[key]
+            return None
+        return attempts
+
+    def retry_after(self, key):
+        """Seconds until key may try again, or 0 if it may now"""
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._recent(key, now)
+            if attempts is None or len(attempts) < self.limit:
+                return 0
+            self.rejected += 1
+            return max(1, int(attempts[0] + self.window - now) + 1)
+
+    def fail(self, key):
+        """Record a failed attempt"""
+        now = time.monotonic()
+        with self._lock:
+            attempts = self._recent(key, now)
+            if attempts is None:
+                attempts = self._attempts[key] = deque(maxlen=self.limit)
+                while len(self._attempts) > self.max_keys:
+                    self._attempts.popitem(last=False)
+            else:
+                self._attempts.move_to_end(key)
+            attempts.append(now)
+
+    def reset(self, key):
+        with self._lock:
+            self._attempts.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'keys': len(self._attempts), 'limit': self.limit, 'window_seconds': self.window,
+                    'rejected': self.rejected}
@@ -0,0 +1,300 @@
+"""Cascading deletes for pitches and users, and a sweeper for orphaned rows.
+
+The ON DELETE CASCADE clauses (foreign keys are on for every pool connection,
+see db.py) only reach rows with a foreign key. Notifications point at pitches
+and users through related_id, so those are removed here explicitly.
+
+A pitch is deleted in one transaction. A user can own thousands of rows, so
+deleting one is a purge job: it is recorded in purge_jobs, and the Purger thread
+removes the rows a batch at a time, each batch in its own short write
+transaction, before deleting the user row itself. Jobs survive a restart and
+resume the next time the purger starts.
+
+Usage: python purge.py [path/to/data.db] [static/uploads]
+runs the pending purge jobs and then sweeps rows orphaned by deletes that ran
+without foreign keys.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+import facets
+import uploads
+
+logger = logging.getLogger(__name__)
+
+PURGE_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS purge_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        target_id INTEGER NOT NULL,
+        created_at TEXT NOT NULL,
+        UNIQUE(kind, target_id)
+    )''',
+]
+
+# Rows removed along with a pitch or a user, as (table, condition on the id);
+# a table added later that references pitches or users belongs here too
+PITCH_DEPENDENTS = [
+    ('likes', 'pitch_id = ?'),
+    ('pitch_tags', 'pitch_id = ?'),
+    ('pitch_scores', 'pitch_id = ?'),
+    ('pitch_view_log', 'pitch_id = ?'),
+    ('comments', 'pitch_id = ?'),
+    ('notifications', "related_type = 'pitch' AND related_id = ?"),
+]
+USER_DEPENDENTS = [
+    ('likes', 'user_id = ?'),
+    ('comments', 'user_id = ?'),
+    ('messages', 'sender_id = ?'),
+    ('messages', 'receiver_id = ?'),
+    ('conversation_members', 'user_id = ?'),
+    ('conversation_members', 'other_id = ?'),
+    ('conversations', 'user_low = ?'),
+    ('conversations', 'user_high = ?'),
+    ('notifications', 'user_id = ?'),
+    ('notifications', "related_type = 'user' AND related_id = ?"),
+]
+
+# Rows whose parent is gone, as (table, condition); used by the sweeper
+ORPHANS = [
+    ('pitches', 'NOT EXISTS (SELECT 1 FROM users WHERE users.id = pitches.author_id)'),
+    ('likes', '''NOT EXISTS (SELECT 1 FROM pitches WHERE pitches.id = likes.pitch_id)
+                 OR NOT EXISTS (SELECT 1 FROM users WHERE users.id = likes.user_id)'''),
+    ('pitch_tags', 'NOT EXISTS (SELECT 1 FROM pitches WHERE pitches.id = pitch_tags.pitch_id)'),
+    ('pitch_scores', 'NOT EXISTS (SELECT 1 FROM pitches WHERE pitches.id = pitch_scores.pitch_id)'),
+    ('pitch_view_log', 'NOT EXISTS (SELECT 1 FROM pitches WHERE pitches.id = pitch_view_log.pitch_id)'),
+    ('comments', '''NOT EXISTS (SELECT 1 FROM pitches WHERE pitches.id = comments.pitch_id)
+                    OR NOT EXISTS (SELECT 1 FROM users WHERE users.id = comments.user_id)'''),
+    ('messages', '''NOT EXISTS (SELECT 1 FROM users WHERE users.id = messages.sender_id)
+                    OR NOT EXISTS (SELECT 1 FROM users WHERE users.id = messages.receiver_id)'''),
+    ('notifications', '''NOT EXISTS (SELECT 1 FROM users WHERE users.id = notifications.user_id)
+                         OR (related_type = 'pitch' AND NOT EXISTS
+                             (SELECT 1 FROM pitches WHERE pitches.id = notifications.related_id))
+                         OR (related_type = 'user' AND NOT EXISTS
+                             (SELECT 1 FROM users WHERE users.id = notifications.related_id))'''),
+]
+
+def create_purge_table(c):
+    """Create the purge_jobs table"""
+    for statement in PURGE_SCHEMA:
+        c.execute(statement)
+
+def delete_batch(conn, table, condition, target_id, batch_size=None):
+    """Delete up to batch_size rows of `table` matching condition (all of them if None)"""
+    args = [target_id] * condition.count('?')
+    if batch_size is None:
+        return conn.execute(f'DELETE FROM {table} WHERE {condition}', args).rowcount
+    return conn.execute(f'''DELETE FROM {table} WHERE rowid IN
+                            (SELECT rowid FROM {table} WHERE {condition} LIMIT ?)''',
+                        args + [batch_size]).rowcount
+
+def delete_pitch(conn, pitch_id):
+    """Delete a pitch and everything hanging off it; call inside one write transaction.
+
+    Returns the uploads it left unused (its image, unless another pitch uses the
+    same file); remove them with uploads.remove_orphan_files() after the commit.
+    """
+    for table, condition in PITCH_DEPENDENTS:
+        delete_batch(conn, table, condition, pitch_id)
+    conn.execute('DELETE FROM pitches WHERE id = ?', [pitch_id])
+    return uploads.delete_orphans(conn)
+
+def purge_user(pool, user_id, upload_dir, batch_size=500, pause=0.005, on_pitch=None):
+    """Delete a user and all of their rows, in many short write transactions.
+
+    Each pitch is deleted in its own transaction (on_pitch is called with its
+    id), then the user's other rows go batch_size at a time; the user row
+    itself is deleted last, together with anything that arrived meanwhile.
+    """
+    while True:
+        conn = pool.acquire()
+        try:
+            pitch_ids = [row[0] for row in conn.execute('SELECT id FROM pitches WHERE author_id = ? LIMIT ?',
+                                                        [user_id, batch_size])]
+        finally:
+            pool.release(conn)
+        for pitch_id in pitch_ids:
+            with pool.writer() as conn:
+                orphans = delete_pitch(conn, pitch_id)
+            uploads.remove_orphan_files(pool, upload_dir, orphans)
+            if on_pitch is not None:
+                on_pitch(pitch_id)
+            time.sleep(pause)
+        if len(pitch_ids) < batch_size:
+            break
+
+    for table, condition in USER_DEPENDENTS:
+        while True:
+            with pool.writer() as conn:
+                deleted = delete_batch(conn, table, condition, user_id, batch_size)
+            if deleted < batch_size:
+                break
+            # Let request writes in between batches
+            time.sleep(pause)
+
+    with pool.writer() as conn:
+        orphans = []
+        for pitch_id in [row[0] for row in conn.execute('SELECT id FROM pitches WHERE author_id = ?', [user_id])]:
+            orphans += delete_pitch(conn, pitch_id)
+        for table, condition in USER_DEPENDENTS:
+            delete_batch(conn, table, condition, user_id)
+        conn.execute('DELETE FROM users WHERE id = ?', [user_id])
+        orphans += uploads.delete_orphans(conn)
+    uploads.remove_orphan_files(pool, upload_dir, orphans)
+
+class Purger:
+    """Runs purge jobs from the purge_jobs table on a background thread"""
+
+    def __init__(self, pool, upload_dir, batch_size=500, pause=0.005):
+        self.pool = pool
+        self.upload_dir = upload_dir
+        self.batch_size = batch_size
+        self.pause = pause
+        # Called with (kind, target_id) after each finished job, and with
+        # ('pitch', id) for every pitch a user purge removes
+        self.on_deleted = None
+        self._start_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._wake = threading.Event()
+        self._busy = False
+        self._thread = None
+        self._stopped = False
+        self._stats = {'finished': 0, 'failed': 0, 'last_job_ms': 0.0}
+
+    def schedule(self, conn, kind, target_id):
+        """Record a purge job in the caller's write transaction; the worker starts after it commits"""
+        conn.execute('INSERT OR IGNORE INTO purge_jobs (kind, target_id, created_at) VALUES (?, ?, ?)',
+                     [kind, target_id, datetime.utcnow().isoformat()])
+
+    def wake(self):
+        """Start the worker if needed and have it look for jobs"""
+        if self._pid != os.getpid():
+            self._reset()
+        if self._stopped:
+            return
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='purger', daemon=True)
+                    self._thread.start()
+        self._wake.set()
+
+    def _next_job(self):
+        conn = self.pool.acquire()
+        try:
+            return conn.execute('SELECT id, kind, target_id FROM purge_jobs ORDER BY id LIMIT 1').fetchone()
+        finally:
+            self.pool.release(conn)
+
+    def pending(self):
+        conn = self.pool.acquire()
+        try:
+            return conn.execute('SELECT COUNT(*) FROM purge_jobs').fetchone()[0]
+        finally:
+            self.pool.release(conn)
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.clear()
+            job = self._next_job()
+            if job is None:
+                self._wake.wait()
+                continue
+            job_id, kind, target_id = job
+            started = time.perf_counter()
+            self._busy = True
+            try:
+                self.run_job(kind, target_id)
+            except Exception:
+                # Left in the table: retried on the next wake or by `python purge.py`
+                logger.exception('Purge of %s %s failed', kind, target_id)
+                self._stats['failed'] += 1
+                self._busy = False
+                self._wake.wait()
+                continue
+            with self.pool.writer() as conn:
+                conn.execute('DELETE FROM purge_jobs WHERE id = ?', [job_id])
+            self._busy = False
+            self._stats['finished'] += 1
+            self._stats['last_job_ms'] = round((time.perf_counter() - started) * 1000, 3)
+            self._notify(kind, target_id)
+
+    def run_job(self, kind, target_id):
+        if kind == 'user':
+            purge_user(self.pool, target_id, self.upload_dir, self.batch_size, self.pause,
+                       on_pitch=lambda pitch_id: self._notify('pitch', pitch_id))
+        elif kind == 'pitch':
+            with self.pool.writer() as conn:
+                orphans = delete_pitch(conn, target_id)
+            uploads.remove_orphan_files(self.pool, self.upload_dir, orphans)
+        else:
+            raise ValueError(f'Unknown purge job kind: {kind}')
+
+    def _notify(self, kind, target_id):
+        if self.on_deleted is not None:
+            try:
+                self.on_deleted(kind, target_id)
+            except Exception:
+                logger.exception('Purger on_deleted hook failed')
+
+    def flush(self, timeout=30.0):
+        """Block until every scheduled job has been run (or timeout)"""
+        deadline = time.monotonic() + timeout
+        while self._busy or self.pending():
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def stop(self):
+        """Take no new jobs; one cut short by exit is resumed on the next start"""
+        self._stopped = True
+        self._wake.set()
+
+    def stats(self):
+        return dict(self._stats, pending=self.pending(),
+                    running=self._thread is not None and self._thread.is_alive())
+
+def sweep_orphans(db_path='data.db', upload_dir=None):
+    """Run pending purge jobs, then delete rows left behind by deletes that ran without foreign keys"""
+    from conversations import rebuild
+    from counters import reconcile
+    from db import ConnectionPool
+    upload_dir = upload_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
+
+    pool = ConnectionPool(db_path)
+    with pool.writer() as conn:
+        create_purge_table(conn)
+    purger = Purger(pool, upload_dir)
+    for job_id, kind, target_id in iter(purger._next_job, None):
+        purger.run_job(kind, target_id)
+        with pool.writer() as conn:
+            conn.execute('DELETE FROM purge_jobs WHERE id = ?', [job_id])
+        print(f'Purged {kind} {target_id}')
+
+    with pool.writer() as conn:
+        for table, condition in ORPHANS:
+            deleted = conn.execute(f'DELETE FROM {table} WHERE {condition}').rowcount
+            print(f'{table}: {deleted} orphaned rows deleted')
+        # Summaries derived from the rows above
+        rebuild(conn)
+        reconcile(conn)
+        facets.recount(conn)
+        uploads.recount(conn)
+        uploads.delete_orphans(conn)
+        problems = conn.execute('PRAGMA foreign_key_check').fetchall()
+    # After the commit; this also catches files whose delete was cut short
+    print(f'uploads: {uploads.remove_stray_files(pool, upload_dir)} unused files deleted')
+    if problems:
+        print(f'{len(problems)} rows still violate a foreign key, e.g. {tuple(problems[0])}')
+    print('Orphan sweep completed!')
+
+if __name__ == '__main__':
+    sweep_orphans(sys.argv[1] if len(sys.argv) > 1 else 'data.db', sys.argv[2] if len(sys.argv) > 2 else None)
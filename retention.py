@@ -0,0 +1,114 @@
+"""Retention for notifications: prune (or archive) old read notifications, then
+give the freed pages back to the file system.
+
+Usage: python retention.py [path/to/data.db] [--days 90] [--archive archive.db]
+                           [--batch 5000] [--full-vacuum]
+
+Rows are removed in batches, each in its own short write transaction, so the app
+keeps serving likes and comments while a large backlog is pruned. With --archive
+the rows are first copied into the notifications table of a separate SQLite
+file. Unread notifications are never touched.
+
+Afterwards `PRAGMA incremental_vacuum` truncates the free pages. That needs
+auto_vacuum=INCREMENTAL, which migrations.py sets for new databases; an older
+database is converted once with --full-vacuum (a full VACUUM, which locks the
+database while it rewrites it).
+"""
+import argparse
+import json
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+AUTO_VACUUM_INCREMENTAL = 2
+
+ARCHIVE_SCHEMA = '''CREATE TABLE IF NOT EXISTS archive.notifications (
+    id INTEGER PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    title TEXT NOT NULL,
+    message TEXT NOT NULL,
+    related_id INTEGER,
+    related_type TEXT,
+    is_read INTEGER,
+    created_at TEXT NOT NULL
+)'''
+
+ARCHIVE_COLUMNS = 'id, user_id, type, title, message, related_id, related_type, is_read, created_at'
+
+def connect(db_path, busy_timeout_ms=5000):
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    conn.execute(f'PRAGMA busy_timeout = {busy_timeout_ms}')
+    conn.execute('PRAGMA foreign_keys = ON')
+    return conn
+
+def prune_notifications(conn, days, batch_size=5000, archive=False, pause=0.01):
+    """Delete read notifications older than `days` in batches; returns how many went.
+
+    With archive=True they are copied into archive.notifications (an attached
+    database) in the same transaction as the delete.
+    """
+    cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
+    removed = 0
+    while True:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # idx_notifications_read_created: only read rows, ordered by age
+            ids = [row[0] for row in conn.execute(
+                '''SELECT id FROM notifications WHERE is_read = 1 AND created_at < ?
+                   ORDER BY created_at LIMIT ?''', [cutoff, batch_size])]
+            if ids:
+                batch = json.dumps(ids)
+                if archive:
+                    conn.execute(f'''INSERT OR REPLACE INTO archive.notifications ({ARCHIVE_COLUMNS})
+                                    SELECT {ARCHIVE_COLUMNS} FROM main.notifications
+                                    WHERE id IN (SELECT value FROM json_each(?))''', [batch])
+                conn.execute('DELETE FROM notifications WHERE id IN (SELECT value FROM json_each(?))', [batch])
+            conn.execute('COMMIT')
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        removed += len(ids)
+        if len(ids) < batch_size:
+            return removed
+        # Let queued writers in between batches
+        time.sleep(pause)
+
+def reclaim_space(conn, full_vacuum=False):
+    """Return free pages to the file system; returns the number of pages freed"""
+    before = conn.execute('PRAGMA page_count').fetchone()[0]
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == AUTO_VACUUM_INCREMENTAL:
+        # Frees one page per step; execute() would step it only once, executescript() runs it to the end
+        conn.executescript('PRAGMA incremental_vacuum')
+    elif full_vacuum:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('VACUUM')
+    else:
+        print('auto_vacuum is not INCREMENTAL; run once with --full-vacuum to convert the database')
+        return 0
+    # Also shrink the WAL, which otherwise keeps its high-water size
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+    return max(0, before - conn.execute('PRAGMA page_count').fetchone()[0])
+
+def run_retention(db_path='data.db', days=90, archive_path=None, batch_size=5000, full_vacuum=False):
+    conn = connect(db_path)
+    if archive_path:
+        conn.execute('ATTACH DATABASE ? AS archive', [archive_path])
+        conn.execute(ARCHIVE_SCHEMA)
+    removed = prune_notifications(conn, days, batch_size, archive=bool(archive_path))
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    freed = reclaim_space(conn, full_vacuum)
+    conn.close()
+    action = f'Archived to {archive_path} and removed' if archive_path else 'Removed'
+    print(f'{action} {removed} read notifications older than {days} days')
+    print(f'Reclaimed {freed * page_size / 1024 / 1024:.1f} MiB')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prune old read notifications and reclaim space')
+    parser.add_argument('db_path', nargs='?', default='data.db')
+    parser.add_argument('--days', type=int, default=90)
+    parser.add_argument('--archive', metavar='PATH')
+    parser.add_argument('--batch', type=int, default=5000)
+    parser.add_argument('--full-vacuum', action='store_true')
+    args = parser.parse_args()
+    run_retention(args.db_path, args.days, args.archive, args.batch, args.full_vacuum)
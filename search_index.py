@@ -0,0 +1,53 @@
+import sqlite3
+import sys
+
+# Full-text index over the pitch text fields. It is an external-content FTS5
+# table: the text lives only in `pitches`, and the triggers below keep the
+# index in step with every insert, update and delete on that table.
+SEARCH_SCHEMA = [
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS pitches_fts USING fts5(
+        title, summary, content, tags, category,
+        content='pitches', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )''',
+
+    '''CREATE TRIGGER IF NOT EXISTS pitches_fts_ai AFTER INSERT ON pitches BEGIN
+        INSERT INTO pitches_fts(rowid, title, summary, content, tags, category)
+        VALUES (new.id, new.title, new.summary, new.content, new.tags, new.category);
+    END''',
+
+    '''CREATE TRIGGER IF NOT EXISTS pitches_fts_ad AFTER DELETE ON pitches BEGIN
+        INSERT INTO pitches_fts(pitches_fts, rowid, title, summary, content, tags, category)
+        VALUES ('delete', old.id, old.title, old.summary, old.content, old.tags, old.category);
+    END''',
+
+    '''CREATE TRIGGER IF NOT EXISTS pitches_fts_au AFTER UPDATE OF title, summary, content, tags, category ON pitches BEGIN
+        INSERT INTO pitches_fts(pitches_fts, rowid, title, summary, content, tags, category)
+        VALUES ('delete', old.id, old.title, old.summary, old.content, old.tags, old.category);
+        INSERT INTO pitches_fts(rowid, title, summary, content, tags, category)
+        VALUES (new.id, new.title, new.summary, new.content, new.tags, new.category);
+    END''',
+]
+
+def create_search_index(c):
+    """Create the FTS5 table and sync triggers; returns True if the table is new"""
+    exists = c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'pitches_fts'").fetchone()
+    for statement in SEARCH_SCHEMA:
+        c.execute(statement)
+    return exists is None
+
+def rebuild_search_index(db_path='data.db'):
+    """Rebuild the full-text index from the pitches table and optimize it"""
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    create_search_index(c)
+    c.execute("INSERT INTO pitches_fts(pitches_fts) VALUES ('rebuild')")
+    c.execute("INSERT INTO pitches_fts(pitches_fts) VALUES ('optimize')")
+    conn.commit()
+    count = c.execute('SELECT COUNT(*) FROM pitches').fetchone()[0]
+    conn.close()
+    print(f'Search index rebuilt for {count} pitches')
+
+if __name__ == '__main__':
+    rebuild_search_index(sys.argv[1] if len(sys.argv) > 1 else 'data.db')
@@ -0,0 +1,274 @@
+"""Time-decayed "hot" scores for pitches, refreshed incrementally in the background.
+
+Every interaction (the post itself, a like, a comment, a batch of views) adds
+weight * 2^(t / half_life) to its pitch, where t is its time since 2024-01-01
+(EPOCH_JULIAN): a like counts twice as much as one made a half-life earlier,
+which is the same as every score halving each half-life. Because all
+contributions decay at the same rate, the order of the sums never changes as
+time passes, so a score only has to be touched when something new happens to
+its pitch. pitch_scores stores log2 of the sum (the sums themselves would
+overflow a float within a few years), indexed for the hot listing.
+
+refresh() folds in the rows added to each source table since its watermark
+(the last id seen, kept in trending_state) and must run in a write
+transaction, so no row can commit behind the watermark. Deleted likes and
+comments are not subtracted; they drop out at the next rebuild(), which the
+scheduler runs every `rebuild_hours` and whenever the weights or half-life
+change.
+
+Usage: python trending.py [path/to/data.db] rebuilds every score.
+"""
+import json
+import logging
+import math
+import os
+import sqlite3
+import sys
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Julian day of 2024-01-01T00:00:00, the zero of the decay exponent
+EPOCH_JULIAN = 2460310.5
+
+DEFAULT_WEIGHTS = {'post': 2.0, 'like': 1.0, 'comment': 3.0, 'view': 0.1}
+DEFAULT_HALF_LIFE_HOURS = 24.0
+
+# Source name -> rows of (id, pitch_id, julian day, count) after a watermark id, in id order
+SOURCES = {
+    'post': 'SELECT id, id, julianday(created_at), 1 FROM pitches WHERE id > ? ORDER BY id LIMIT ?',
+    'like': 'SELECT id, pitch_id, julianday(created_at), 1 FROM likes WHERE id > ? ORDER BY id LIMIT ?',
+    'comment': 'SELECT id, pitch_id, julianday(created_at), 1 FROM comments WHERE id > ? ORDER BY id LIMIT ?',
+    # One row per pitch per view counter flush (see view_counter.py)
+    'view': 'SELECT id, pitch_id, julianday(flushed_at), views FROM pitch_view_log WHERE id > ? ORDER BY id LIMIT ?',
+}
+
+TRENDING_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS pitch_scores (
+        pitch_id INTEGER PRIMARY KEY,
+        score REAL NOT NULL,
+        updated_at TEXT NOT NULL,
+        FOREIGN KEY(pitch_id) REFERENCES pitches(id) ON DELETE CASCADE
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_pitch_scores_hot ON pitch_scores(score DESC, pitch_id DESC)',
+    # Per-source watermarks, the time of the last rebuild, and the settings it used
+    '''CREATE TABLE IF NOT EXISTS trending_state (
+        name TEXT PRIMARY KEY,
+        value TEXT NOT NULL
+    )''',
+]
+
+# Skips pitches deleted since their rows were read (or likes orphaned by old deletes)
+INSERT_SCORE = '''INSERT INTO pitch_scores (pitch_id, score, updated_at)
+                  SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM pitches WHERE id = ?)'''
+
+def create_trending_tables(c):
+    for statement in TRENDING_SCHEMA:
+        c.execute(statement)
+
+def parse_weights(text):
+    """Source weights from "post=2,like=1,comment=3,view=0.1"; sources left out keep their default"""
+    weights = dict(DEFAULT_WEIGHTS)
+    for part in (text or '').split(','):
+        name, _, value = part.partition('=')
+        if name.strip():
+            weights[name.strip()] = float(value)
+    return weights
+
+def log2_add(a, b):
+    """log2(2^a + 2^b) without leaving the log domain; None stands for an empty sum"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    high, low = max(a, b), min(a, b)
+    return high + math.log2(1.0 + 2.0 ** (low - high))
+
+def decayed_sums(conn, weights, half_life_hours, watermarks, batch_size=-1):
+    """Decayed sums (as log2) per pitch of the rows after each watermark.
+
+    Returns (scores, new watermarks, True if any source had more than batch_size rows).
+    """
+    per_day = 24.0 / half_life_hours
+    # Exponents are taken relative to now, so every term is at most about 1
+    reference = (time.time() / 86400.0 + 2440587.5 - EPOCH_JULIAN) * per_day
+    sums = {}
+    marks = dict(watermarks)
+    more = False
+    for source, sql in SOURCES.items():
+        rows = conn.execute(sql, [marks.get(source, 0), batch_size]).fetchall()
+        if not rows:
+            continue
+        marks[source] = rows[-1][0]
+        more = more or len(rows) == batch_size
+        weight = weights.get(source, 0.0)
+        if weight <= 0:
+            continue
+        for _, pitch_id, julian, count in rows:
+            exponent = (julian - EPOCH_JULIAN) * per_day - reference if julian is not None else -reference
+            sums[pitch_id] = sums.get(pitch_id, 0.0) + weight * count * 2.0 ** min(exponent, 64.0)
+    scores = {pitch_id: reference + math.log2(total) for pitch_id, total in sums.items() if total > 0}
+    return scores, marks, more
+
+def settings_key(weights, half_life_hours):
+    return json.dumps({'weights': weights, 'half_life_hours': half_life_hours}, sort_keys=True)
+
+def read_state(conn):
+    return dict(conn.execute('SELECT name, value FROM trending_state').fetchall())
+
+def write_state(conn, state):
+    conn.executemany('INSERT OR REPLACE INTO trending_state (name, value) VALUES (?, ?)',
+                     [(name, str(value)) for name, value in state.items()])
+
+def refresh(conn, weights=DEFAULT_WEIGHTS, half_life_hours=DEFAULT_HALF_LIFE_HOURS, batch_size=10000):
+    """Fold one batch of new interactions into the scores; returns (pitches updated, more pending)"""
+    state = read_state(conn)
+    watermarks = {source: int(state.get(f'watermark:{source}', 0)) for source in SOURCES}
+    added, marks, more = decayed_sums(conn, weights, half_life_hours, watermarks, batch_size)
+    if added:
+        existing = dict(conn.execute('''SELECT pitch_id, score FROM pitch_scores
+                                        WHERE pitch_id IN (SELECT value FROM json_each(?))''',
+                                     [json.dumps(list(added))]).fetchall())
+        now = datetime.utcnow().isoformat()
+        conn.executemany(f'''{INSERT_SCORE}
+                             ON CONFLICT(pitch_id) DO UPDATE SET score = excluded.score,
+                                                                 updated_at = excluded.updated_at''',
+                         [(pitch_id, log2_add(existing.get(pitch_id), score), now, pitch_id)
+                          for pitch_id, score in added.items()])
+    if marks != watermarks:
+        write_state(conn, {f'watermark:{source}': mark for source, mark in marks.items()})
+    return len(added), more
+
+def store_scores(conn, scores, marks, weights, half_life_hours):
+    """Replace every score with the output of decayed_sums() over all rows"""
+    now = datetime.utcnow().isoformat()
+    conn.execute('DELETE FROM pitch_scores')
+    conn.executemany(INSERT_SCORE, [(pitch_id, score, now, pitch_id) for pitch_id, score in scores.items()])
+    state = {f'watermark:{source}': marks.get(source, 0) for source in SOURCES}
+    state.update(settings=settings_key(weights, half_life_hours), rebuilt_at=time.time())
+    write_state(conn, state)
+
+def rebuild(conn, weights=DEFAULT_WEIGHTS, half_life_hours=DEFAULT_HALF_LIFE_HOURS):
+    """Recompute every score from the interaction tables; returns the number of pitches scored"""
+    scores, marks, _ = decayed_sums(conn, weights, half_life_hours, {})
+    store_scores(conn, scores, marks, weights, half_life_hours)
+    return len(scores)
+
+class TrendingScheduler:
+    """Refreshes the scores every `interval` seconds on a background thread"""
+
+    def __init__(self, pool, weights=DEFAULT_WEIGHTS, half_life_hours=DEFAULT_HALF_LIFE_HOURS,
+                 interval=60.0, rebuild_hours=24.0, batch_size=10000):
+        self.pool = pool
+        self.weights = weights
+        self.half_life_hours = half_life_hours
+        self.interval = interval
+        self.rebuild_hours = rebuild_hours
+        self.batch_size = batch_size
+        # Called with the number of pitches whose score changed, after each refresh that changed any
+        self.on_refresh = None
+        self._start_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._wake = threading.Event()
+        self._thread = None
+        self._stopped = False
+        self._stats = {'refreshes': 0, 'rebuilds': 0, 'failed': 0, 'last_refresh_ms': 0.0,
+                       'last_rebuild_ms': 0.0, 'pitches_updated': 0}
+
+    def start(self):
+        """Start the thread if it is not running in this process"""
+        if self._pid != os.getpid():
+            self._reset()
+        if self._thread is None and not self._stopped:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='trending', daemon=True)
+                    self._thread.start()
+
+    def wake(self):
+        """Refresh now rather than at the end of the interval"""
+        self.start()
+        self._wake.set()
+
+    def _rebuild(self):
+        """Rebuild with the sums read from one snapshot, so writers wait only for the store"""
+        conn = self.pool.acquire()
+        try:
+            state = read_state(conn)
+            if (state.get('settings') == settings_key(self.weights, self.half_life_hours)
+                    and time.time() - float(state.get('rebuilt_at', 0)) < self.rebuild_hours * 3600):
+                return None
+            conn.execute('BEGIN')
+            try:
+                scores, marks, _ = decayed_sums(conn, self.weights, self.half_life_hours, {})
+            finally:
+                conn.execute('COMMIT')
+        finally:
+            self.pool.release(conn)
+        # Rows committed since the snapshot are past the watermarks; the next refresh adds them
+        with self.pool.writer() as conn:
+            store_scores(conn, scores, marks, self.weights, self.half_life_hours)
+        return len(scores)
+
+    def run_once(self):
+        """One rebuild or refresh pass; returns the number of pitches whose score changed"""
+        started = time.perf_counter()
+        changed, more = self._rebuild(), False
+        rebuilding = changed is not None
+        if not rebuilding:
+            with self.pool.writer() as conn:
+                changed, more = refresh(conn, self.weights, self.half_life_hours, self.batch_size)
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 3)
+        if rebuilding:
+            self._stats['rebuilds'] += 1
+            self._stats['last_rebuild_ms'] = elapsed_ms
+        else:
+            self._stats['refreshes'] += 1
+            self._stats['last_refresh_ms'] = elapsed_ms
+        self._stats['pitches_updated'] += changed
+        if more:
+            # A backlog is worked off a batch at a time, with writes let in between
+            self._wake.set()
+        if changed and self.on_refresh is not None:
+            try:
+                self.on_refresh(changed)
+            except Exception:
+                logger.exception('Trending on_refresh hook failed')
+        return changed
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.clear()
+            try:
+                self.run_once()
+            except Exception:
+                logger.exception('Trending refresh failed')
+                self._stats['failed'] += 1
+            self._wake.wait(self.interval)
+
+    def stop(self):
+        self._stopped = True
+        self._wake.set()
+
+    def stats(self):
+        return dict(self._stats, interval=self.interval, half_life_hours=self.half_life_hours,
+                    weights=self.weights, running=self._thread is not None and self._thread.is_alive())
+
+def rebuild_scores(db_path='data.db'):
+    """Rebuild every score with the settings from the environment"""
+    conn = sqlite3.connect(db_path)
+    create_trending_tables(conn)
+    started = time.perf_counter()
+    count = rebuild(conn, parse_weights(os.environ.get('TRENDING_WEIGHTS')),
+                    float(os.environ.get('TRENDING_HALF_LIFE_HOURS', DEFAULT_HALF_LIFE_HOURS)))
+    conn.commit()
+    conn.close()
+    print(f'Trending scores rebuilt for {count} pitches in {time.perf_counter() - started:.2f} s')
+
+if __name__ == '__main__':
+    rebuild_scores(sys.argv[1] if len(sys.argv) > 1 else 'data.db')
@@ -0,0 +1,214 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+from images import VARIANT_DIR, variant_files
+
+# Uploads are stored under the SHA-256 of their bytes, so identical images share
+# one file and a name never changes meaning (safe to cache forever). The uploads
+# table counts how many pitches use each file; the triggers keep the count exact.
+HASH_LENGTH = 32  # hex characters (128 bits) kept in the file name
+CHUNK_SIZE = 64 * 1024
+
+# Extensions that name the same format
+EXTENSION_ALIASES = {'jpeg': 'jpg'}
+
+UPLOAD_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS uploads (
+        filename TEXT PRIMARY KEY,
+        refcount INTEGER NOT NULL DEFAULT 0
+    )''',
+    '''CREATE INDEX IF NOT EXISTS idx_uploads_orphans ON uploads(filename) WHERE refcount <= 0''',
+
+    '''CREATE TRIGGER IF NOT EXISTS pitches_upload_ai AFTER INSERT ON pitches
+       WHEN new.image IS NOT NULL AND new.image NOT IN ('', 'None') BEGIN
+        INSERT INTO uploads (filename, refcount) VALUES (new.image, 1)
+        ON CONFLICT(filename) DO UPDATE SET refcount = refcount + 1;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS pitches_upload_ad AFTER DELETE ON pitches
+       WHEN old.image IS NOT NULL AND old.image NOT IN ('', 'None') BEGIN
+        UPDATE uploads SET refcount = refcount - 1 WHERE filename = old.image;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS pitches_upload_au AFTER UPDATE OF image ON pitches
+       WHEN old.image IS NOT new.image BEGIN
+        UPDATE uploads SET refcount = refcount - 1
+        WHERE filename = old.image AND old.image NOT IN ('', 'None');
+        INSERT INTO uploads (filename, refcount)
+        SELECT new.image, 1 WHERE new.image IS NOT NULL AND new.image NOT IN ('', 'None')
+        ON CONFLICT(filename) DO UPDATE SET refcount = refcount + 1;
+    END''',
+]
+
+RECOUNT_SQL = [
+    'UPDATE uploads SET refcount = 0',
+    '''INSERT INTO uploads (filename, refcount)
+       SELECT image, COUNT(*) FROM pitches WHERE image IS NOT NULL AND image NOT IN ('', 'None') GROUP BY image
+       ON CONFLICT(filename) DO UPDATE SET refcount = excluded.refcount''',
+]
+
+def create_upload_table(c):
+    """Create the uploads table and refcount triggers; returns True if the table is new"""
+    exists = c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'uploads'").fetchone()
+    for statement in UPLOAD_SCHEMA:
+        c.execute(statement)
+    return exists is None
+
+def recount(c):
+    """Recompute every upload's refcount from pitches.image"""
+    for statement in RECOUNT_SQL:
+        c.execute(statement)
+
+def hashed_name(digest, original_name):
+    """Content-addressed file name: hash prefix plus the normalized extension"""
+    ext = original_name.rsplit('.', 1)[-1].lower() if '.' in original_name else 'bin'
+    return f'{digest[:HASH_LENGTH]}.{EXTENSION_ALIASES.get(ext, ext)}'
+
+def is_hashed_name(filename):
+    """True for names produced by hashed_name() (and their image variants)"""
+    stem = os.path.basename(filename).split('.', 1)[0].split('-', 1)[0]
+    return len(stem) == HASH_LENGTH and all(ch in '0123456789abcdef' for ch in stem)
+
+def store_upload(stream, original_name, upload_dir):
+    """Copy an upload into the folder under its content hash; returns the file name.
+
+    The hash is computed chunk by chunk while the bytes are written to a temporary
+    file, so the upload is read exactly once and never held in memory. If a file
+    with the same hash already exists the copy is discarded.
+    """
+    digest = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=upload_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                tmp.write(chunk)
+        filename = hashed_name(digest.hexdigest(), original_name)
+        path = os.path.join(upload_dir, filename)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return filename
+
+def remove_files(upload_dir, filename):
+    """Delete an upload and all of its image variants"""
+    paths = [os.path.join(upload_dir, name) for name in [filename] + variant_files(filename)]
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+
+def delete_orphans(conn):
+    """Drop the rows of uploads no pitch references any more; returns their names.
+
+    Call it inside the write transaction that removed the pitches, and pass the
+    names to remove_orphan_files() once that has committed, so a rollback never
+    leaves a pitch pointing at a deleted file.
+    """
+    return [row[0] for row in conn.execute('DELETE FROM uploads WHERE refcount <= 0 RETURNING filename')]
+
+def remove_orphan_files(pool, upload_dir, filenames):
+    """Delete the files of committed orphans, except any a pitch has used again since; returns the removed names.
+
+    Posts store their upload inside a write transaction, so holding the write lock
+    keeps one from re-using a file between the check and the unlink. Files left
+    by a crash in between are removed by the orphan sweep (remove_stray_files).
+    """
+    if not filenames:
+        return []
+    removed = []
+    with pool.writer() as conn:
+        for filename in filenames:
+            if conn.execute('SELECT 1 FROM uploads WHERE filename = ? AND refcount > 0', [filename]).fetchone() is None:
+                remove_files(upload_dir, filename)
+                removed.append(filename)
+    return removed
+
+def remove_stray_files(pool, upload_dir):
+    """Delete content-addressed files and variants that no used upload refers to; returns how many went"""
+    removed = 0
+    with pool.writer() as conn:
+        used = {os.path.splitext(row[0])[0] for row in conn.execute('SELECT filename FROM uploads WHERE refcount > 0')}
+        for directory in (upload_dir, os.path.join(upload_dir, VARIANT_DIR)):
+            if not os.path.isdir(directory):
+                continue
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                # Variants are named <stem>-<variant>.<ext>
+                if is_hashed_name(name) and name.split('.', 1)[0].split('-', 1)[0] not in used and os.path.isfile(path):
+                    os.remove(path)
+                    removed += 1
+    return removed
+
+def file_digest(path):
+    """SHA-256 of a file on disk, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+def dedupe_uploads(db_path='data.db', upload_dir=None, prune=False):
+    """Rename existing uploads to their content hash, merge duplicates and rewrite pitches.image.
+
+    Files are copied to their new names first, the database is updated in one
+    transaction, and only then are the old names removed, so an interrupted run
+    leaves nothing dangling and can simply be run again.
+    """
+    upload_dir = upload_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static', 'uploads')
+    renames = {}
+    for name in sorted(os.listdir(upload_dir)):
+        path = os.path.join(upload_dir, name)
+        if not os.path.isfile(path) or name.endswith('.tmp') or is_hashed_name(name):
+            continue
+        new_name = hashed_name(file_digest(path), name)
+        renames[name] = new_name
+        new_path = os.path.join(upload_dir, new_name)
+        if not os.path.exists(new_path):
+            _link_or_copy(path, new_path)
+        # Carry over already generated variants (same pixels, new name)
+        for old_variant, new_variant in zip(variant_files(name), variant_files(new_name)):
+            old_variant = os.path.join(upload_dir, old_variant)
+            new_variant = os.path.join(upload_dir, new_variant)
+            if os.path.exists(old_variant) and not os.path.exists(new_variant):
+                _link_or_copy(old_variant, new_variant)
+
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    create_upload_table(c)
+    c.executemany('UPDATE pitches SET image = ? WHERE image = ?',
+                  [(new_name, name) for name, new_name in renames.items()])
+    recount(c)
+    referenced = {row[0] for row in c.execute('SELECT filename FROM uploads WHERE refcount > 0')}
+    c.execute('DELETE FROM uploads WHERE refcount <= 0')
+    conn.commit()
+    conn.close()
+
+    for name in renames:
+        remove_files(upload_dir, name)
+    unused = sorted({new_name for new_name in renames.values()} - referenced)
+    for name in unused:
+        if prune:
+            remove_files(upload_dir, name)
+    print(f'Renamed {len(renames)} uploads to {len(set(renames.values()))} content-addressed files')
+    if unused:
+        print(f"{len(unused)} files are not used by any pitch" + (' (deleted)' if prune else ' (use --prune to delete)'))
+    print('Uploads deduplicated!')
+
+if __name__ == '__main__':
+    args = [arg for arg in sys.argv[1:] if arg != '--prune']
+    dedupe_uploads(args[0] if args else 'data.db', args[1] if len(args) > 1 else None,
+                   prune='--prune' in sys.argv[1:])
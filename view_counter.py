@@ -0,0 +1,158 @@
+"""Per-pitch view counts, buffered in memory and written in batches.
+
+A view must not cost the pitch page a write: every write queues for SQLite's
+single writer lock. ViewCounter.record() only adds to an in-memory dict under a
+lock; a background thread writes the accumulated deltas every `interval`
+seconds in one transaction, and stop() writes what is left at exit. Each
+worker process buffers its own views, and a crash loses at most one interval.
+
+Each flush adds to pitches.view_count and the 'views' site total, and appends
+one (pitch, views, time) row per pitch to pitch_view_log, which trending.py
+reads as its view source. Log rows older than `log_days` are pruned.
+
+With dedup_seconds > 0, a viewer (the user id, or the client address and user
+agent when logged out) counts once per pitch per window. Recent (viewer, pitch)
+pairs are kept as hashes in an LRU of at most dedup_max_keys entries; when it
+is full the oldest pairs are forgotten early and may count again.
+"""
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+VIEW_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS pitch_view_log (
+        id INTEGER PRIMARY KEY,
+        pitch_id INTEGER NOT NULL,
+        views INTEGER NOT NULL,
+        flushed_at TEXT NOT NULL,
+        FOREIGN KEY(pitch_id) REFERENCES pitches(id) ON DELETE CASCADE
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_pitch_view_log_pitch ON pitch_view_log(pitch_id)',
+    "INSERT OR IGNORE INTO site_stats (name, value) VALUES ('views', 0)",
+]
+
+def create_view_tables(c):
+    """Add pitches.view_count and the view log; returns True if the column is new"""
+    existing = [column[1] for column in c.execute('PRAGMA table_info(pitches)').fetchall()]
+    if 'view_count' not in existing:
+        c.execute('ALTER TABLE pitches ADD COLUMN view_count INTEGER NOT NULL DEFAULT 0')
+    for statement in VIEW_SCHEMA:
+        c.execute(statement)
+    return 'view_count' not in existing
+
+def write_views(conn, deltas, log_days=30):
+    """Add {pitch_id: views} to the counts and the log, in the caller's transaction"""
+    now = datetime.utcnow()
+    rows = sorted(deltas.items())
+    conn.executemany('UPDATE pitches SET view_count = view_count + ? WHERE id = ?',
+                     [(views, pitch_id) for pitch_id, views in rows])
+    # Pitches deleted since they were viewed are skipped
+    conn.executemany('''INSERT INTO pitch_view_log (pitch_id, views, flushed_at)
+                        SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM pitches WHERE id = ?)''',
+                     [(pitch_id, views, now.isoformat(), pitch_id) for pitch_id, views in rows])
+    conn.execute("UPDATE site_stats SET value = value + ? WHERE name = 'views'", [sum(deltas.values())])
+    # Rows are appended in time order, so the old ones are at the start of the table
+    conn.execute('''DELETE FROM pitch_view_log WHERE id < (SELECT MIN(id) FROM pitch_view_log) + 1000
+                    AND flushed_at < ?''',
+                 [(now - timedelta(days=log_days)).isoformat()])
+
+class ViewCounter:
+    def __init__(self, pool, interval=5.0, dedup_seconds=0, dedup_max_keys=100000, log_days=30):
+        self.pool = pool
+        self.interval = interval
+        self.dedup_seconds = dedup_seconds
+        self.dedup_max_keys = dedup_max_keys
+        self.log_days = log_days
+        # Called with {pitch_id: views} after each flush
+        self.on_flush = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._pending = {}
+        self._seen = OrderedDict()
+        self._thread = None
+        self._stop = threading.Event()
+        self._stats = {'recorded': 0, 'duplicates': 0, 'flushes': 0, 'failed': 0, 'written': 0,
+                       'last_flush_ms': 0.0}
+
+    def _start(self):
+        if self._pid != os.getpid():
+            self._reset()
+        if self._thread is None and not self._stop.is_set():
+            self._thread = threading.Thread(target=self._run, name='view-counter', daemon=True)
+            self._thread.start()
+
+    def record(self, pitch_id, viewer=None):
+        """Count one view of a pitch; returns False if the viewer was deduplicated"""
+        now = time.monotonic()
+        with self._lock:
+            self._start()
+            if self.dedup_seconds > 0 and viewer is not None:
+                key = hash((viewer, pitch_id))
+                if self._seen.get(key, 0) > now:
+                    self._stats['duplicates'] += 1
+                    return False
+                self._seen[key] = now + self.dedup_seconds
+                self._seen.move_to_end(key)
+                # Drop expired pairs from the old end, and the oldest ones beyond the cap
+                while self._seen and (len(self._seen) > self.dedup_max_keys
+                                      or next(iter(self._seen.values())) <= now):
+                    self._seen.popitem(last=False)
+            self._pending[pitch_id] = self._pending.get(pitch_id, 0) + 1
+            self._stats['recorded'] += 1
+        return True
+
+    def flush(self):
+        """Write the buffered views in one transaction; returns the number of pitches written"""
+        with self._flush_lock:
+            with self._lock:
+                deltas, self._pending = self._pending, {}
+            if not deltas:
+                return 0
+            started = time.perf_counter()
+            try:
+                with self.pool.writer() as conn:
+                    write_views(conn, deltas, self.log_days)
+            except Exception:
+                # Put them back for the next flush
+                with self._lock:
+                    for pitch_id, views in deltas.items():
+                        self._pending[pitch_id] = self._pending.get(pitch_id, 0) + views
+                raise
+            self._stats['flushes'] += 1
+            self._stats['written'] += sum(deltas.values())
+            self._stats['last_flush_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        if self.on_flush is not None:
+            try:
+                self.on_flush(deltas)
+            except Exception:
+                logger.exception('View counter on_flush hook failed')
+        return len(deltas)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('View count flush failed')
+                self._stats['failed'] += 1
+
+    def stop(self):
+        """Stop the thread and write what is left"""
+        self._stop.set()
+        if self._thread is not None and self._pid == os.getpid():
+            self._thread.join()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, pending=sum(self._pending.values()), dedup_keys=len(self._seen),
+                        interval=self.interval, dedup_seconds=self.dedup_seconds)